@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Render benchmark for stocks-advanced.py: how long it takes to turn already-fetched quotes into the menu text, with no
+# network or database involved. Builds a synthetic watchlist (1,000 symbols by default, spread over a few categories, a
+# mix of market sessions, notes and alert notes) and a list of price limits, then times menu_lines() on it: cold, with
+# nothing rendered before, and again with the previous render's blocks reused as they are when no quote changed.
+#
+# Usage: python3 benchmarks/bench_render.py [--symbols 1000] [--categories 4] [--limits 50] [--runs 20] [--debug] [--top N]
+#                                           [--plugin path/to/stocks-advanced.py]
+#
+# --debug turns on OPTION_SHOW_DEBUG_SUBMENU, which adds the raw quote dump under every symbol. --top sets TOP_MOVERS_COUNT, so
+# only the top N stocks of each category are rendered in full.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from plugin_loader import default_plugin_path, load_plugin # noqa: E402
+
+MARKET_STATES = ('PRE', 'REGULAR', 'POST', 'CLOSED', 'POSTPOST')
+
+
+# A .info style dict shaped like what the batch quote path produces
+def synthetic_info(symbol, rng):
+    previous_close = rng.uniform(1, 500)
+    price = previous_close * rng.uniform(0.9, 1.1)
+    return {
+        'symbol': symbol,
+        'shortName': symbol + ' Inc',
+        'longName': symbol + ' Incorporated Holdings',
+        'currency': 'USD',
+        'marketState': rng.choice(MARKET_STATES),
+        'regularMarketPrice': price,
+        'regularMarketTime': 1792180800 + rng.randrange(23400),
+        'regularMarketPreviousClose': previous_close,
+        'regularMarketOpen': previous_close * rng.uniform(0.98, 1.02),
+        'dayHigh': price * 1.02,
+        'dayLow': price * 0.98,
+        'fiftyTwoWeekHigh': price * 1.5,
+        'fiftyTwoWeekLow': price * 0.5,
+        'bid': price - 0.01,
+        'ask': price + 0.01,
+        'preMarketPrice': price * rng.uniform(0.99, 1.01),
+        'postMarketPrice': price * rng.uniform(0.99, 1.01),
+    }
+
+
+def synthetic_watchlist(plugin, count, categories, limit_count, seed=0):
+    rng = random.Random(seed)
+    watchlist = {}
+    registry = {}
+    for n in range(count):
+        symbol = 'S{:04d}'.format(n)
+        note = rng.choice(['', '', 'Earnings next week, watch the guidance.', '!Stop loss set, check before the open.'])
+        watchlist.setdefault('Category {}'.format(n % categories), {})[symbol] = note
+        info = synthetic_info(symbol, rng)
+        registry[symbol] = plugin.Quote.from_info(symbol, info, info['regularMarketPrice'])
+    limits = [(rng.choice(['BUY', 'SELL']), 'S{:04d}'.format(rng.randrange(count)), '{:.2f}'.format(rng.uniform(1, 500)))
+              for _ in range(limit_count)]
+    return watchlist, registry, limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Menu render time of stocks-advanced.py for a synthetic watchlist')
+    parser.add_argument('--symbols', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=4)
+    parser.add_argument('--limits', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--debug', action='store_true', help='render with OPTION_SHOW_DEBUG_SUBMENU on')
+    parser.add_argument('--top', type=int, default=0, help='render with TOP_MOVERS_COUNT set to this')
+    parser.add_argument('--plugin', default=default_plugin_path())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        plugin = load_plugin(args.plugin, workdir)
+        watchlist, registry, limits = synthetic_watchlist(plugin, args.symbols, args.categories, args.limits)
+        plugin.watch_symbols = watchlist
+        plugin.OPTION_SHOW_DEBUG_SUBMENU = args.debug
+        plugin.TOP_MOVERS_COUNT = args.top
+        plugin.OPTION_SHOW_ANNOYING_INDICES_IN_MENU = False
+
+        # cold is a one-shot xbar run; unchanged is the daemon's cache, kept across renders and filled by the first one
+        kept = plugin.RenderCache(enabled=True)
+        plugin.RENDER_CACHE = kept
+        text = '\n'.join(plugin.menu_lines(registry, limits)) + '\n'
+        timings = {'cold': [], 'unchanged': []}
+        for _ in range(args.runs):
+            for label in ('cold', 'unchanged'):
+                plugin.RENDER_CACHE = plugin.RenderCache() if label == 'cold' else kept
+                start = time.perf_counter()
+                text = '\n'.join(plugin.menu_lines(registry, limits)) + '\n'
+                timings[label].append(time.perf_counter() - start)
+
+    lines = text.count('\n')
+    print('{} symbols, {} categories, {} limits{}{}'.format(args.symbols, args.categories, args.limits,
+                                                            ', debug submenu' if args.debug else '',
+                                                            ', top {} per category'.format(args.top) if args.top else ''))
+    print('menu: {} lines, {:.1f} KB'.format(lines, len(text.encode('utf-8')) / 1024))
+    for label, runs in timings.items():
+        print('render, {}: median {:.2f} ms, min {:.2f} ms over {} runs ({:.1f} us per symbol)'.format(
+            label, statistics.median(runs) * 1000, min(runs) * 1000, args.runs, statistics.median(runs) * 1e6 / args.symbols))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Cold-start benchmark for stocks-advanced.py: how long each argv mode takes from interpreter start to exit, and which heavy
+# modules it ends up importing. Every run uses a fresh copy of the plugin in a temporary directory, so your real price limits,
+# caches and daemon are never touched, and runs with STOCKS_HEADLESS=1 so no dialogs open. `set` adds a limit the way the
+# command line form does (validated, then written to the price_limits table in the temporary copy's state), and `remove`
+# takes it away again.
+#
+# Usage: python3 benchmarks/bench_startup.py [--runs 10] [--plugin path/to/stocks-advanced.py] [--with-network]
+#
+# The plain menu refresh hits Yahoo, so it's only measured with --with-network.
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from plugin_loader import default_plugin_path # noqa: E402
+
+HEAVY_MODULES = ('yfinance', 'pandas', 'numpy')
+
+# (label, argv) for each mode, in the order they're reported
+MODES = [
+    ('set', ['set', 'AAPL', 'BUY', '1']),
+    ('remove', ['remove', 'BUY AAPL 1']),
+    ('clear', ['clear']),
+    ('refresh', ['refresh']),
+]
+
+
+# One cold start: wall time in seconds and the heavy top-level modules imported, parsed from -X importtime
+def run_once(plugin, argv):
+    env = dict(os.environ, STOCKS_HEADLESS='1')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', plugin] + argv, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        name = line.rsplit('|', 1)[-1].strip()
+        if name in HEAVY_MODULES:
+            imported.add(name)
+    return elapsed, sorted(imported)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start time of each stocks-advanced.py argv mode')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--plugin', default=default_plugin_path())
+    parser.add_argument('--with-network', action='store_true', help='also time a full menu refresh (fetches from Yahoo)')
+    args = parser.parse_args()
+
+    modes = list(MODES)
+    if args.with_network:
+        modes.append(('menu', []))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        plugin = os.path.join(workdir, 'stocks-advanced.py')
+        shutil.copy(args.plugin, plugin)
+
+        baseline = [run_once_python(workdir) for _ in range(args.runs)]
+        print('{:<10} {:>10} {:>10}  {}'.format('mode', 'median ms', 'min ms', 'heavy imports'))
+        print('{:<10} {:>10.1f} {:>10.1f}  {}'.format('python', statistics.median(baseline) * 1000, min(baseline) * 1000, '-'))
+        for label, argv in modes:
+            timings = []
+            imported = []
+            for _ in range(args.runs):
+                elapsed, imported = run_once(plugin, argv)
+                timings.append(elapsed)
+            print('{:<10} {:>10.1f} {:>10.1f}  {}'.format(label, statistics.median(timings) * 1000, min(timings) * 1000,
+                                                          ', '.join(imported) or 'none'))
+
+
+# Bare interpreter start, for reference
+def run_once_python(workdir):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], cwd=workdir)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# End-to-end benchmark suite for stocks-advanced.py, run offline against the stand-in Yahoo backends in
+# tools/yahoo_replay.py. For each watchlist size (10, 100 and 1,000 symbols by default) it measures:
+#
+#   cold       first refresh with an empty state database (two days of bars downloaded for every symbol)
+#   warm       later refreshes with the quote cache off, i.e. what an xbar run costs when quotes are due
+#   cached     a refresh served from the quote cache
+#   render     turning the fetched quotes into menu text (menu_lines) alone: cold, with nothing rendered before, and
+#              warm, with the previous render's lines reused as they are when no quote changed
+#   peak MB    peak Python heap during a warm refresh (tracemalloc), and the process's max RSS
+#   scaling    warm refresh time at 1, 2, 4 and 8 fetch workers with the rate limiter lifted, to show how much the
+#              worker pool hides request latency
+#
+# Every request to the backend waits --latency seconds (default 0.15, about a Yahoo round trip) and --error-rate of
+# them fail. cold/warm/cached use the plugin's own FETCH_* settings, so they include the rate limiter's waits. Each
+# size runs in its own process so memory numbers don't carry over.
+#
+# Usage: python3 benchmarks/bench_suite.py [--sizes 10,100,1000] [--backend synthetic|replay:DIR] [--runs 3]
+#                                          [--latency 0.15] [--error-rate 0] [--workers 1,2,4,8]
+#                                          [--json results.json] [--check baseline.json --tolerance 0.25]
+#
+# --json saves the numbers; --check compares them against a saved run and exits non-zero if any time or memory
+# figure got worse by more than --tolerance (a fraction), so the suite can gate changes.
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+import yahoo_replay # noqa: E402
+from plugin_loader import default_plugin_path, load_plugin # noqa: E402
+
+GATED_METRICS = ('cold', 'warm', 'cached', 'render_cold', 'render_warm', 'peak_mb')
+
+
+def synthetic_watchlist(count, categories=4):
+    watchlist = {}
+    for n in range(count):
+        watchlist.setdefault('Category {}'.format(n % categories), {})['S{:04d}'.format(n)] = ''
+    return watchlist
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+# One size, in this process: returns the metrics as a dict
+def measure(args, size):
+    with tempfile.TemporaryDirectory() as workdir:
+        return measure_in(args, size, workdir)
+
+
+def measure_in(args, size, workdir):
+    plugin = load_plugin(args.plugin, workdir)
+    data_file = os.path.join(workdir, '.stocks_advanced.db')
+    client = yahoo_replay.install(plugin, args.backend, yahoo_replay.parse_latency(args.latency), args.error_rate)
+    if args.backend.startswith('replay:'):
+        symbols = client.store.symbols()
+        plugin.watch_symbols = {'Watchlist': dict.fromkeys(symbols, '')}
+        size = len(symbols)
+    else:
+        plugin.watch_symbols = synthetic_watchlist(size)
+    plugin.OPTION_SHOW_ANNOYING_INDICES_IN_MENU = False
+    results = {'symbols': size}
+
+    def refresh(use_cache=False):
+        plugin.OPTION_USE_QUOTE_CACHE = use_cache
+        return plugin.render_menu_text(data_file)
+
+    results['cold'], _ = timed(refresh)
+    results['warm'] = statistics.median(timed(refresh)[0] for _ in range(args.runs))
+    refresh(use_cache=True)
+    results['cached'] = statistics.median(timed(refresh, True)[0] for _ in range(args.runs))
+
+    state = plugin.open_local_state()
+    registry = plugin.SymbolRegistry(plugin.watch_symbols, state)
+    registry.fetch()
+    state.conn.close()
+
+    # cold as in a one-shot xbar run, warm with the daemon's cache kept from the previous render
+    kept = plugin.RenderCache(enabled=True)
+
+    def render(cold):
+        plugin.RENDER_CACHE = plugin.RenderCache() if cold else kept
+        return timed(lambda: '\n'.join(plugin.menu_lines(registry, [])))[0]
+
+    render(False)
+    for label, cold in (('render_cold', True), ('render_warm', False)):
+        results[label] = statistics.median(render(cold) for _ in range(max(args.runs, 5)))
+
+    tracemalloc.start()
+    refresh()
+    results['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    scheduler = plugin.FETCH_SCHEDULER
+    results['scaling'] = {}
+    for workers in args.workers:
+        plugin.FETCH_SCHEDULER = plugin.FetchScheduler(max_workers=workers, rate=1e6, burst=1e6)
+        results['scaling'][str(workers)] = statistics.median(timed(refresh)[0] for _ in range(args.runs))
+    plugin.FETCH_SCHEDULER = scheduler
+
+    results['requests'] = client.totals['requests']
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    return results
+
+
+# Run each size in a fresh interpreter
+def run_size(args, size):
+    argv = [sys.executable, os.path.abspath(__file__), '--worker', str(size), '--backend', args.backend,
+            '--runs', str(args.runs), '--latency', args.latency, '--error-rate', str(args.error_rate),
+            '--workers', ','.join(map(str, args.workers)), '--plugin', args.plugin]
+    output = subprocess.run(argv, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def report(all_results, args):
+    print('backend {}, {}s per request, {:.0%} errors, median of {} runs'.format(
+        args.backend, args.latency, args.error_rate, args.runs))
+    print('{:>8} {:>9} {:>9} {:>9} {:>11} {:>11} {:>8} {:>8} {:>9}'.format(
+        'symbols', 'cold s', 'warm s', 'cached s', 'render ms', 'render ms', 'peak MB', 'RSS MB', 'requests'))
+    print('{:>8} {:>9} {:>9} {:>9} {:>11} {:>11}'.format('', '', '', '', 'cold', 'unchanged'))
+    for results in all_results:
+        print('{symbols:>8} {cold:>9.2f} {warm:>9.2f} {cached:>9.3f} {render_cold_ms:>11.1f} {render_warm_ms:>11.1f} {peak_mb:>8.1f} '
+              '{max_rss_mb:>8.1f} {requests:>9}'.format(render_cold_ms=results['render_cold'] * 1000,
+                                                      render_warm_ms=results['render_warm'] * 1000, **results))
+    print()
+    print('warm refresh by fetch workers, rate limiter lifted (s):')
+    print('{:>8} '.format('symbols') + ' '.join('{:>7}'.format(workers) for workers in args.workers))
+    for results in all_results:
+        print('{:>8} '.format(results['symbols']) + ' '.join(
+            '{:>7.2f}'.format(results['scaling'][str(workers)]) for workers in args.workers))
+
+
+# Every gated figure that is worse than the baseline's by more than the tolerance
+def regressions(all_results, baseline, tolerance):
+    previous = {results['symbols']: results for results in baseline}
+    for results in all_results:
+        before = previous.get(results['symbols'])
+        if not before:
+            continue
+        for metric in GATED_METRICS:
+            if metric in before and results[metric] > before[metric] * (1 + tolerance):
+                yield '{} symbols: {} {:.4g} -> {:.4g}'.format(results['symbols'], metric, before[metric], results[metric])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmarks for stocks-advanced.py')
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--backend', default='synthetic', help='synthetic, or replay:DIR for recorded fixtures')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', default='0.15', help='seconds per request, or a range LOW:HIGH')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=lambda text: [int(n) for n in text.split(',')], default=[1, 2, 4, 8])
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--check', help='compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--plugin', default=default_plugin_path())
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measure(args, args.worker)))
+        return
+
+    sizes = [0] if args.backend.startswith('replay:') else [int(n) for n in args.sizes.split(',')]
+    all_results = [run_size(args, size) for size in sizes]
+    report(all_results, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_results, f, indent=1)
+    if args.check:
+        with open(args.check) as f:
+            worse = list(regressions(all_results, json.load(f), args.tolerance))
+        for line in worse:
+            print('REGRESSION ' + line)
+        sys.exit(1 if worse else 0)
+
+
+if __name__ == '__main__':
+    main()
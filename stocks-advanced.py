@@ -16,6 +16,33 @@
 
 #HISTORY:
 
+# Oct 17 2026:
+# * Optional streaming quotes in the daemon (OPTION_USE_STREAMING): it subscribes to Yahoo's websocket price feed for every symbol once and lays the pushed prices over the polled quotes, which are then only polled every STREAMING_POLL_SECONDS; polling takes over while the stream is down. tools/yahoo_stream.py records the feed and replays it (or synthesizes one) from a local websocket server
+# * TOP_MOVERS_COUNT: show only the top N stocks of each category by SORT_BY, picked with a heap instead of a full sort, and list the rest one line each under a collapsed "More…" item, so huge categories stay quick to render and for xbar to display
+# * Streaming technical indicators (ROC and ROC bands, EMA and SMA fans, Bollinger Bands, volume-at-price compression) kept per symbol in the .sqlite file and advanced only by each refresh's new 1-minute bars; shown in the submenu with OPTION_SHOW_INDICATORS, and alerted on by the new FAN, BAND, ROC and VAP price limits
+# * Price history: each refresh's price of every symbol is appended to a fixed-size memory-mapped ring buffer file per symbol in a hidden .history folder (OPTION_KEEP_PRICE_HISTORY, PRICE_HISTORY_SIZE), with O(1) appends and no file kept open between them; an optional sparkline of them in each submenu (OPTION_SHOW_SPARKLINE)
+# * Price limits are checked by a vectorized NumPy rule engine in one pass, and three new limit types join BUY and SELL: PCT (move from the previous close), CROSS (alerts on every crossing of a level, with LIMIT_CROSS_HYSTERESIS so a hovering price doesn't re-alert) and TRAIL (trailing stop). CROSS sides and TRAIL highs persist in the .sqlite file
+# * Incremental rendering: each symbol's menu lines are reused from the previous refresh while its quote and note are unchanged, and categories are only re-sorted when a sort key changed (in the daemon, which keeps them between refreshes)
+# * Built-in NYSE market calendar (holidays, Good Friday, early closes, pre/regular/post hours): US quotes are cached until the session actually changes, so nights, weekends and holidays make no requests, and the menu bar session icon no longer depends on the first symbol's quote (OPTION_USE_MARKET_CALENDAR)
+# * Per-phase timing and cache/request/byte counters for each refresh, shown in an optional Performance item under the timestamp (OPTION_SHOW_PERFORMANCE_SUBMENU) and appended as JSON lines to a metrics log (OPTION_WRITE_METRICS_LOG, STOCKS_METRICS_FILE); STOCKS_PROFILE=1 saves a cProfile of each refresh
+# * Offline Yahoo stand-ins in tools/yahoo_replay.py (record real responses as fixtures, replay them, or synthesize any number of symbols, with injected latency and errors) and an end-to-end benchmark suite for 10/100/1,000 symbols. See benchmarks/bench_suite.py
+# * All Yahoo calls share one pooled HTTP session, so connections and the cookie/crumb handshake are reused across symbols (and across refreshes in the daemon); request, handshake and connection reuse counts are shown in debug mode
+# * Fetch failures no longer blank the menu with an error dialog: requests are retried with jittered backoff, symbols that keep failing are skipped for a while by a per-symbol circuit breaker, and their last known quote is shown marked with ICON_STALE
+# * Quotes are compact slotted Quote records holding raw floats, formatted only when a line is rendered, instead of nested raw/fmt dicts; the .info dict is only kept for symbols with the debug submenu on
+# * Debug submenu is generated lazily with depth and line caps (DEBUG_MAX_DEPTH, DEBUG_MAX_LINES), reuses its formatting in the daemon while a symbol's quote is unchanged, and can be limited to a few symbols with DEBUG_SYMBOLS
+# * The menu is built as a stream of lines from precompiled templates and written to stdout in one buffered write instead of hundreds of print() calls. See benchmarks/bench_render.py
+# * Triggered price limits no longer block the menu: alerts are queued in the .sqlite file and shown by a background notify-worker process, merged per symbol and de-duplicated. NOTIFY_BACKEND picks the osascript dialog or a log file
+# * Price limits moved from the hidden .db text file to an indexed table in the .sqlite state file: symbols match exactly (V no longer matches every line with a capital V), each symbol's check is one lookup, and removals are atomic. An existing .db file is migrated on first run and renamed to .db.migrated
+# * Lazy imports: yfinance, pandas and numpy are only imported by code paths that fetch, so 'remove' and 'clear' start in milliseconds; STOCKS_HEADLESS=1 skips all dialogs. See benchmarks/bench_startup.py
+# * Optional resident daemon (OPTION_USE_DAEMON) that keeps quotes warm and serves the rendered menu over a Unix socket; xbar runs become a thin client and menu clicks are forwarded to it. It quits when the script is edited or upgraded, so the next run starts one with the new settings
+# * Lean quotes: only the ~15 fields the menu uses are requested, names and currency are cached for a week, and the full .info payload is only fetched when OPTION_SHOW_DEBUG_SUBMENU is on
+# * Regular-session closes for a whole batch are computed in one vectorized NumPy pass, using each exchange's own session hours instead of US hours for everything
+# * Incremental intraday bar store: 1-minute bars are kept in the .sqlite file and each refresh only downloads bars newer than the last one stored; past sessions' regular closes are kept permanently
+# * Persistent quote cache in a hidden .sqlite file with per-session TTLs (QUOTE_CACHE_TTL), plus a "Refresh now" menu item to bypass it
+# * Symbols listed in several categories are fetched once per refresh through a per-run SymbolRegistry, and price limits are checked once per unique symbol
+# * Concurrent fetch scheduler: a bounded worker pool with a token-bucket rate limiter (FETCH_MAX_WORKERS, FETCH_RATE_PER_SECOND, FETCH_RATE_BURST) replaces the fixed sleeps, and per-request latency is shown in debug mode
+# * Batched quote fetching: all watchlist symbols are fetched through Yahoo's bulk quote endpoint and a single multi-ticker yf.download() per batch, instead of one .info + .history() per symbol with a 1 second sleep in between
+
 # Feb 24 2026:
 # * Refactor to use categorized watchlist to allow separate menu sections for multiple watchlists
 # * Enhanced Menu Bar Icon with options to display icon and/or session icons
@@ -25,7 +52,7 @@
 # * Timestamp at top of menu to show last update
 # * Standardized variable names to Python standards 
 # * Changed default POST and CLOSED session icons. These may change again
-# * move yfinance import to top of script so doesn't keep recalling it. 
+# * move yfinance import to top of script so doesn't keep recalling it. (Oct 2026: now imported lazily, on first use.)
 # * Added option to restore original script's annoying constantly-updating index ticker in the menubar instead of an icon
 
 # Changes from original longpdo version as of mid-February 2026:
@@ -45,20 +72,26 @@
 # * Rate limiting between API calls
 # * Xbar metadata tags. The plugin metadata uses <xbar.*> tags instead of the legacy <bitbar.*> 
 
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from textwrap import fill, wrap
+from collections import deque
 from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from itertools import islice
+import heapq
 import json
+import math
+import mmap
 import os
+import random
 import re
+import sqlite3
+import struct
 import sys
 import subprocess
+import threading
 import time
-try:
-    import yfinance as yf
-except ImportError:
-    alert('Error', 'Please install yfinance: pip3 install yfinance')
-    sys.exit()
+# yfinance, pandas and numpy take over a second to import, so they're only imported by the code paths that need them (see LazyModule below). Removing a limit never loads them.
 
 # ---------------------------------------------------------------------------------------------------------------------
 # BEGIN USER SETTINGS #
@@ -126,6 +159,7 @@ ICON_ALERT = '⚠️'
 ICON_ARROW_UP='▲'
 ICON_ARROW_DOWN='▼'
 ICON_MAIN_MENU='💲'
+ICON_STALE='⌛' # Quote couldn't be refreshed, the last known one is shown
 # # Session Icons
 ICON_SESSION_PRE='🌅' # Price indicator for AM premarket session
 ICON_SESSION_REGULAR='' # Price indicator for day session, default no icon
@@ -137,7 +171,7 @@ ICON_SESSION_CLOSED='😴' # Price indicator for market closed
 OPTION_SHOW_MENU_ICON = False
 
 # # Set this to True if you want to show the session icon in the menu icon
-#NOTE: This currently uses the first ticker in your first category. If you set this to true, for that first ticker, use a symbol that is updated in all sessions, like ^GSPC or GOOG, not one that only shows during the regular session, like ^VIX, or you won't get get PRE and POST session icons. Maybe later I'll put in an option for which ticker to calculate this from, but for now, this is what you get. 
+#NOTE: With OPTION_USE_MARKET_CALENDAR on (the default) this is the US market session from the built-in calendar. With it off, this uses the first ticker in your first category; then use a symbol that is updated in all sessions, like ^GSPC or GOOG, not one that only shows during the regular session, like ^VIX, or you won't get get PRE and POST session icons.
 OPTION_SHOW_SESSION_IN_MENU_ICON = True
 
 # # Enter the order how you want to sort the stock list within each category in the dropbown menu:
@@ -149,14 +183,27 @@ OPTION_SHOW_SESSION_IN_MENU_ICON = True
 # '' or other values         : Sort by your custom order from the symbols array above
 SORT_BY = 'market_change_winners'
 
+# # Set this to a number to show only that many stocks per category, the first ones by SORT_BY (e.g. the 10 biggest winners with 'market_change_winners', or the 10 most volatile with 'market_change_volatility'). The rest of the category is listed under a collapsed "More…" item at its end, one line each without their detail submenus. 0 shows every stock in full. Handy for categories with hundreds of symbols, which xbar is slow to display.
+TOP_MOVERS_COUNT = 0
+
 # # Set this True or False to turn on or off Debug submenu under each ticker's detail info. Capitalization counts.
 OPTION_SHOW_DEBUG_SUBMENU = False
+# # Only show the Debug submenu (and only fetch the full info) for these symbols, e.g. ['AAPL']. Leave empty for every symbol.
+DEBUG_SYMBOLS = []
+# # The Debug submenu summarizes anything nested deeper than DEBUG_MAX_DEPTH levels and stops after DEBUG_MAX_LINES lines per section, so a huge payload can't swamp xbar. Set either to None for no limit.
+DEBUG_MAX_DEPTH = 4
+DEBUG_MAX_LINES = 250
+
+# # Set this True to show a Performance item under the timestamp, with how long each phase of the refresh took (opening the local state, fetching, checking limits, rendering) and counters for cache hits, requests and bytes fetched.
+OPTION_SHOW_PERFORMANCE_SUBMENU = False
+# # Set this True to append the same timings as one JSON line per refresh to a hidden .metrics.log file next to this script, for charting refresh latency over time. The STOCKS_METRICS_FILE environment variable turns this on with a file of your choosing. For deep dives, STOCKS_PROFILE=1 saves a full cProfile of each refresh to a hidden .prof file (or to the path given instead of 1).
+OPTION_WRITE_METRICS_LOG = False
 
 #ANNOYING LIVE INDICES TICKER IN MENUBAR OPTION
 # # To have huge annoying live index ticker updates flash in your menu bar instead the menu icons, set this True
 OPTION_SHOW_ANNOYING_INDICES_IN_MENU = False
 
-# # This is number of seconds it waits before annoying updates if OPTION_SHOW_ANNOYING_INDICES_IN_MENU is True; must be > 0
+# # This used to be the number of seconds it waited between annoying index requests. Indices are now fetched in one batch and paced by the FETCH_RATE_* settings, so this is no longer used.
 OPTION_SHOW_ANNOYING_INDICES_IN_MENU_INTERVAL = 5
 
 # # This is the indices list shown in your menu bar if OPTION_SHOW_ANNOYING_INDICES_IN_MENU is True
@@ -177,6 +224,67 @@ MENU_FONT_SIZE = "12" # Main menu
 NOTES_FONT = "Monaco" #Notes in submenu, when present
 NOTES_FONT_SIZE = "11" #Notes in submenu, when present
 
+# NETWORK OPTIONS
+# # Number of symbols fetched per bulk quote request. All your watchlist symbols are fetched in batches of this size, with a 1 second pause between batches.
+QUOTE_BATCH_SIZE = 50
+
+# # Yahoo requests run in parallel on a small worker pool, paced by a token bucket so bursts stay under Yahoo's throttling limits.
+FETCH_MAX_WORKERS = 4 # Max requests in flight at once
+FETCH_RATE_PER_SECOND = 2 # Sustained requests per second, 0 for no limit
+FETCH_RATE_BURST = 4 # Requests allowed back to back before the per-second rate kicks in
+
+# # Failed requests are retried FETCH_RETRIES times, waiting a random time of up to FETCH_RETRY_BACKOFF * 2^attempt seconds in between, so retries don't line up and make throttling worse.
+FETCH_RETRIES = 2
+FETCH_RETRY_BACKOFF = 0.5
+# # A symbol that fails FETCH_BREAKER_FAILURES refreshes in a row isn't requested again for FETCH_BREAKER_COOLDOWN seconds (doubling while it keeps failing, up to a day). Its last known quote is shown instead, marked with ICON_STALE.
+FETCH_BREAKER_FAILURES = 3
+FETCH_BREAKER_COOLDOWN = 15 * 60
+
+# # Quotes are cached in a hidden .sqlite file next to this script. A cached quote is reused until it is older than the number of seconds below for the market session it was fetched in, so nights and weekends barely touch the network. Click "Refresh now" under the timestamp to bypass it.
+OPTION_USE_QUOTE_CACHE = True
+QUOTE_CACHE_TTL = {
+    'REGULAR': 60,
+    'PRE': 300,
+    'POST': 300,
+    'CLOSED': 4 * 3600,
+}
+
+# # US stocks, ETFs and indices follow a built-in NYSE calendar (weekends, holidays including Good Friday, 1pm early closes; pre-market from 4:00, regular session 9:30-16:00, after hours until 20:00 New York time). Their cached quotes are refreshed at the QUOTE_CACHE_TTL rate of the session the market is actually in, always right after a session starts or ends, and not at all while the market is closed, so nights, weekends and holidays cost no requests. The menu bar session icon comes from the calendar too. Set False to go by the market state Yahoo reports for each quote instead. Futures, currencies, crypto and foreign listings always go by QUOTE_CACHE_TTL.
+OPTION_USE_MARKET_CALENDAR = True
+
+
+# PRICE HISTORY OPTIONS
+# # Each refresh's price of every symbol is appended to a small fixed-size history file per symbol in a hidden .history folder next to this script. Once a file holds PRICE_HISTORY_SIZE prices (24 bytes each), the oldest are overwritten. A price is only recorded when it differs from the last one, so cached quotes and closed markets don't take up room. Set False to keep no history.
+OPTION_KEEP_PRICE_HISTORY = True
+PRICE_HISTORY_SIZE = 4096
+# # Set this True to show a sparkline of each symbol's last SPARKLINE_POINTS recorded prices in its submenu
+OPTION_SHOW_SPARKLINE = False
+SPARKLINE_POINTS = 30
+
+
+# TECHNICAL INDICATOR OPTIONS
+# # Set this True to show technical indicators in each ticker's submenu, computed from the 1-minute bars kept in the .sqlite file: rate of change (ROC) with its bands, EMA and SMA fans, Bollinger Bands and a volume-at-price compression score. They're updated with each refresh's new bars only, never recomputed from scratch. The FAN, BAND, ROC and VAP price limits use them whether this is on or not.
+OPTION_SHOW_INDICATORS = False
+INDICATOR_EMA_PERIODS = (8, 21, 55) # EMA fan, in 1-minute bars, shortest first
+INDICATOR_SMA_PERIODS = (10, 20, 50) # SMA fan, shortest first
+INDICATOR_BOLLINGER = (20, 2) # Bollinger Bands: period, standard deviations
+INDICATOR_ROC = (12, 60, 2) # ROC period, number of ROC values its bands are taken over, standard deviations
+INDICATOR_VAP = (120, 0.1) # Volume-at-price window in bars, price bin size in percent
+
+
+# PRICE ALERT OPTIONS
+# # How triggered price limits reach you. Alerts are queued and shown by a separate background process, so a triggered limit never holds up the menu. 'osascript' plays the alert sound and shows a dialog that stays until dismissed. 'file' appends one line per alert to a hidden .alerts.log file next to this script instead, which is handy for testing. The STOCKS_NOTIFY_BACKEND environment variable overrides this, and runs with STOCKS_HEADLESS=1 default to 'file'.
+NOTIFY_BACKEND = 'osascript'
+# # CROSS limits alert every time the price crosses their level, but only once it is more than this percentage of the level past it, so a price hovering around the level doesn't alert over and over.
+LIMIT_CROSS_HYSTERESIS = 0.5
+
+# BACKGROUND DAEMON OPTION
+# # Set this True to keep a background process running that refreshes quotes on its own every DAEMON_REFRESH_SECONDS. Each xbar refresh then just prints the daemon's latest menu, which is nearly instant. The daemon is started automatically on the first refresh.
+OPTION_USE_DAEMON = False
+DAEMON_REFRESH_SECONDS = 60
+# # With the daemon on, set this True to also subscribe to Yahoo's streaming price feed for every symbol in your watchlist and INDICES_DICT. Prices, the session, day range and bid/ask then follow the trades as they happen and show at the next refresh, while the full quotes (names, 52 week range, regular-session close) are only polled every STREAMING_POLL_SECONDS. If the stream drops, polling takes over as usual until it reconnects.
+OPTION_USE_STREAMING = False
+STREAMING_POLL_SECONDS = 15 * 60
 
 # END USER SETTINGS
 
@@ -197,9 +305,9 @@ SESSION_INFO = {
         'greenArrow':ANSI_GREEN + ICON_ARROW_UP,
         'noArrow':' ',
         'redArrow':ANSI_RED + ICON_ARROW_DOWN,
-        'chgPctKeyName':'preMarketChangePercent',
+        'chgPctKeyName':'pre_market_change_percent',
         'icon':ICON_SESSION_PRE,
-        'offHoursPriceName':'preMarketPrice',
+        'offHoursPriceName':'pre_market_price',
         'menuicon':ICON_SESSION_PRE
     },
     'REGULAR':{
@@ -207,7 +315,7 @@ SESSION_INFO = {
         'greenArrow':ANSI_GREEN + ICON_ARROW_UP,
         'noArrow':' ',
         'redArrow':ANSI_RED + ICON_ARROW_DOWN,
-        'chgPctKeyName':'regularMarketChangePercent',
+        'chgPctKeyName':'regular_market_change_percent',
         'icon':ICON_SESSION_REGULAR,
         'offHoursPriceName':'',
         'menuicon':''
@@ -217,9 +325,9 @@ SESSION_INFO = {
         'greenArrow':ANSI_GREEN + ICON_ARROW_UP,
         'noArrow':' ',
         'redArrow':ANSI_RED + ICON_ARROW_DOWN,
-        'chgPctKeyName':'postMarketChangePercent',
+        'chgPctKeyName':'post_market_change_percent',
         'icon':ICON_SESSION_POST,
-        'offHoursPriceName':'postMarketPrice',
+        'offHoursPriceName':'post_market_price',
         'menuicon':ICON_SESSION_POST
     },
     'CLOSED':{
@@ -227,7 +335,7 @@ SESSION_INFO = {
         'greenArrow':ANSI_GRAY + ICON_ARROW_UP,
         'noArrow':ANSI_GRAY + ' ',
         'redArrow':ANSI_GRAY + ICON_ARROW_DOWN,
-        'chgPctKeyName':'regularMarketChangePercent',
+        'chgPctKeyName':'regular_market_change_percent',
         'icon':ICON_SESSION_CLOSED,
         'offHoursPriceName':'',
         'menuicon':ICON_SESSION_CLOSED
@@ -239,11 +347,69 @@ categories = list(watch_symbols)
 FONT = "| font="+MENU_FONT+" size="+MENU_FONT_SIZE
 FONT_SMALL = "| font="+NOTES_FONT+" size="+NOTES_FONT_SIZE
 
+# Menu line templates, built once per run instead of once per ticker. The bound .format methods are the precompiled templates.
+LDOTS = "........................."
+STOCK_LINE_FORMATS = {
+    '': ('{:<5} {:>10} {:<10}' + FONT).format,
+    'note': ('{:<5} {:>10} {:<10} ' + ICON_NOTES + FONT).format,
+    'alert': ('{:<5} {:>10} {:<10}' + ICON_ALERT + FONT).format,
+}
+STOCK_SUBMENU_FORMAT = ('{:<20.20} {:<17}' + FONT).format
+STOCK_SUBMENU_VALUE_FORMAT = ('{:<17}' + FONT).format
+# Submenu labels already padded and cut to the 20 columns STOCK_SUBMENU_FORMAT gives them
+STOCK_SUBMENU_LABELS = {label: '{:<20.20} '.format('--' + label + ':' + LDOTS)
+                        for label in ('Previous Close', 'Open', 'Regular Close', 'Bid', 'Ask', "Day's Range", '52 Week Range', 'History',
+                                      'ROC', 'EMA Fan', 'SMA Fan', 'Bollinger', 'VAP Compression')}
+PRICE_LIMIT_FORMAT = '{:<6} {:<4} {:<10}'.format
+MORE_STOCKS_FORMAT = ('More… ({})' + FONT).format
+FETCH_LATENCY_FORMAT = ('----{:<24.24} {:>7.3f}s{}' + FONT).format
+PERFORMANCE_PHASE_FORMAT = ('--{:<24.24} {:>7.3f}s' + FONT).format
+PERFORMANCE_COUNTER_FORMAT = ('--{:<24.24} {:>8}' + FONT).format
+PERFORMANCE_ERROR_FORMAT = ('--{}: {:.80}' + FONT).format
+# Suffix of every menu item that reruns this script with parameters
+COMMAND_PARAMETERS = FONT + " refresh=true terminal='false' bash='" + __file__ + "'"
+
+YAHOO_QUOTE_URL = 'https://query1.finance.yahoo.com/v7/finance/quote'
+# The only quote fields the menu reads. SLOW_QUOTE_FIELDS are cached for SYMBOL_META_TTL seconds and only requested when missing.
+LEAN_QUOTE_FIELDS = ['marketState', 'regularMarketPrice', 'regularMarketTime', 'regularMarketPreviousClose', 'regularMarketOpen',
+                     'regularMarketDayHigh', 'regularMarketDayLow', 'fiftyTwoWeekHigh', 'fiftyTwoWeekLow', 'bid', 'ask',
+                     'preMarketPrice', 'postMarketPrice', 'exchange', 'exchangeTimezoneName']
+SLOW_QUOTE_FIELDS = ['shortName', 'longName', 'currency', 'quoteType']
+SYMBOL_META_TTL = 7 * 24 * 3600
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Lazy imports ---------------------------------------------------------------------------------------------------------
+# Stands in for a module and imports it on first attribute access, so `yf.download(...)` works as usual but only costs the import on the code paths that actually fetch. A missing package shows an alert instead of a traceback.
+class LazyModule:
+    def __init__(self, name, install_hint):
+        self._name = name
+        self._install_hint = install_hint
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                import importlib
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                alert('Error', 'Please install ' + self._name + ': ' + self._install_hint)
+                sys.exit()
+        return getattr(self._module, attr)
+
+
+yf = LazyModule('yfinance', 'pip3 install yfinance')
+
+# Set STOCKS_HEADLESS=1 to run without any dialogs (benchmarks, test runs): alerts take their confirm button, prompts behave as if cancelled
+HEADLESS = bool(os.environ.get('STOCKS_HEADLESS'))
+
 # ---------------------------------------------------------------------------------------------------------------------
 
 # macOS Alerts, Prompts and Notifications -----------------------------------------------------------------------------
 # Display a macOS specific alert dialog to get confirmation from user to continue
 def alert(alert_title='', alert_text='', alert_buttons=['Cancel', 'OK']):
+    if HEADLESS:
+        return alert_buttons[1]
     try:
         d = locals()
         user_input = subprocess.check_output(['osascript', '-l', 'JavaScript', '-e', '''
@@ -265,6 +431,8 @@ def alert(alert_title='', alert_text='', alert_buttons=['Cancel', 'OK']):
 
 # Display a macOS specific prompt dialog to get text input from the user
 def prompt(prompt_text=''):
+    if HEADLESS:
+        sys.exit()
     try:
         d = locals()
         user_input = subprocess.check_output(['osascript', '-l', 'JavaScript', '-e', '''
@@ -286,6 +454,8 @@ def prompt(prompt_text=''):
 
 # Display a macOS specific prompt dialog prompting user for a choice from a list
 def prompt_selection(prompt_text='', choices=''):
+    if HEADLESS:
+        sys.exit()
     try:
         d = locals()
         user_selection = subprocess.check_output(['osascript', '-l', 'JavaScript', '-e', '''
@@ -340,164 +510,1872 @@ def notify(text, title, subtitle, sound='Glass'):
 # ---------------------------------------------------------------------------------------------------------------------
 
 
-# Methods to read, write, remove data from the hidden .db file --------------------------------------------------------
+# Legacy .db price limit file ------------------------------------------------------------------------------------------
+# Before Oct 2026 limits were lines of 'TYPE SYMBOL PRICE' in a hidden .db text file. They now live in the price_limits table of the state database (see PriceLimitStore); the old file is only read once, to migrate it.
 def read_data_file(data_file):
     with open(data_file, 'r') as f:
         content = f.readlines()
-    f.close()
     content = [x.strip() for x in content]
     return content
 
 
-def write_data_file(data_file, limit_type, symbol, price):
-    with open(data_file, 'a') as f:
-        f.write(limit_type + ' ' + symbol + ' ' + price + '\n')
-    f.close()
+# Limits are shown and passed to 'remove' in the format: TYPE SYMBOL PRICE. For PCT and TRAIL limits PRICE is a percentage.
+def format_limit_entry(limit_type, symbol, price):
+    return limit_type + ' ' + symbol + ' ' + price
 
 
-def remove_line_from_data_file(data_file, line_to_be_removed):
-    with open(data_file, 'r') as f:
-        content = f.readlines()
-    with open(data_file, 'w') as f:
-        for line in content:
-            if line.strip('\n') != line_to_be_removed:
-                f.write(line)
-    f.close()
+def parse_limit_entry(limit_entry):
+    fields = limit_entry.split()
+    if len(fields) != 3 or fields[0] not in LIMIT_TYPES:
+        return None
+    try:
+        float(fields[2])
+    except ValueError:
+        return None
+    return tuple(fields)
 # ---------------------------------------------------------------------------------------------------------------------
 
-def get_regular_session_close(t):
+# Regular session closes -----------------------------------------------------------------------------------------------
+# Regular session hours (open, close) in local exchange time, looked up by the quote's Yahoo exchange code first, then by its exchange timezone. Anything unknown gets US hours.
+EXCHANGE_SESSION_HOURS = {
+    'GER': ('09:00', '17:30'), # XETRA
+    'FRA': ('08:00', '20:00'),
+    'LSE': ('08:00', '16:30'),
+    'PAR': ('09:00', '17:30'),
+    'AMS': ('09:00', '17:30'),
+    'MIL': ('09:00', '17:30'),
+    'TOR': ('09:30', '16:00'),
+    'JPX': ('09:00', '15:30'),
+    'HKG': ('09:30', '16:00'),
+    'ASX': ('10:00', '16:00'),
+}
+TIMEZONE_SESSION_HOURS = {
+    'America/New_York': ('09:30', '16:00'),
+    'America/Toronto': ('09:30', '16:00'),
+    'Europe/London': ('08:00', '16:30'),
+    'Europe/Berlin': ('09:00', '17:30'),
+    'Europe/Paris': ('09:00', '17:30'),
+    'Europe/Amsterdam': ('09:00', '17:30'),
+    'Europe/Zurich': ('09:00', '17:30'),
+    'Asia/Tokyo': ('09:00', '15:30'),
+    'Asia/Hong_Kong': ('09:30', '16:00'),
+    'Australia/Sydney': ('10:00', '16:00'),
+}
+DEFAULT_SESSION = ('America/New_York', 9 * 60 + 30, 16 * 60)
+
+
+def minutes_after_midnight(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+# (timezone, open minute, close minute) of a symbol's regular session, from its quote/.info dict
+def session_spec(info):
+    tz = info.get('exchangeTimezoneName') or DEFAULT_SESSION[0]
+    hours = EXCHANGE_SESSION_HOURS.get(info.get('exchange')) or TIMEZONE_SESSION_HOURS.get(tz)
+    if not hours:
+        return (tz,) + DEFAULT_SESSION[1:]
+    return (tz, minutes_after_midnight(hours[0]), minutes_after_midnight(hours[1]))
+
+
+# Last regular-session close of the most recent day of every symbol at once. `closes` is a wide frame of 1-minute closes (tz-aware index, one column per symbol, NaN where a symbol has no bar), `sessions` maps symbol -> session_spec(). Columns are grouped by timezone, so the per-row work is one tz conversion per exchange timezone and the rest is NumPy on the whole block.
+# Returns {symbol: (close, day)} for every symbol with any bars; close is None if its last day has no regular-session bars, day counts days since 1970-01-01 in local exchange time. With before={symbol: day}, bars on or after that day are ignored, which gives the previous session.
+def regular_session_closes(closes, sessions, before=None):
+    import numpy as np
+    results = {}
+    if closes is None or closes.empty:
+        return results
+    by_tz = {}
+    for symbol in closes.columns:
+        by_tz.setdefault(sessions.get(symbol, DEFAULT_SESSION)[0], []).append(symbol)
+    for tz, symbols in by_tz.items():
+        wall = epoch_seconds(closes.index.tz_convert(tz), wall_clock=True) // 60 # local minutes since epoch
+        day = wall // 1440
+        minute = wall % 1440
+        values = closes[symbols].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        if before:
+            cutoff = np.array([before.get(symbol, np.iinfo(np.int64).max) for symbol in symbols])
+            valid &= day[:, None] < cutoff[None, :]
+        last = len(day) - 1
+        has_bars = valid.any(axis=0)
+        last_day = day[last - valid[::-1].argmax(axis=0)]
+        opens = np.array([sessions.get(symbol, DEFAULT_SESSION)[1] for symbol in symbols])
+        shuts = np.array([sessions.get(symbol, DEFAULT_SESSION)[2] for symbol in symbols])
+        regular = valid & (day[:, None] == last_day[None, :]) & (minute[:, None] >= opens) & (minute[:, None] <= shuts)
+        has_close = regular.any(axis=0)
+        rows = last - regular[::-1].argmax(axis=0)
+        for j, symbol in enumerate(symbols):
+            if has_bars[j]:
+                results[symbol] = (float(values[rows[j], j]) if has_close[j] else None, int(last_day[j]))
+    return results
+
+
+# Seconds since the epoch for every entry of a tz-aware DatetimeIndex, regardless of the index's resolution (pandas 2+ doesn't always store nanoseconds). With wall_clock=True, counts local wall-clock time in the index's own timezone instead of UTC.
+def epoch_seconds(index, wall_clock=False):
+    import pandas as pd
+    naive = index.tz_localize(None) if wall_clock else index.tz_convert('UTC').tz_localize(None)
+    return ((naive - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)).to_numpy()
+
+
+# Wide frame of one field (e.g. 'Close') with one column per symbol from a yf.download()/history() result, whether or not it has per-ticker column levels
+def field_frame(intraday, field, symbols):
+    import pandas as pd
+    if intraday is None or intraday.empty:
+        return None
+    if hasattr(intraday.columns, 'levels'):
+        present = [symbol for symbol in symbols if symbol in intraday.columns.get_level_values(0)]
+        return pd.DataFrame({symbol: intraday[symbol][field] for symbol in present}, index=intraday.index)
+    return pd.DataFrame({symbols[0]: intraday[field]}, index=intraday.index)
+
+
+def get_regular_session_close(t, session=DEFAULT_SESSION):
 
     intraday = t.history(period="2d", interval="1m", auto_adjust=False)
     if intraday is None or intraday.empty:
         return 0
 
-    intraday = intraday.sort_index()
-    last_day = intraday.index[-1].date()
-    day = intraday[intraday.index.date == last_day]
-
-    regular = day.between_time("09:30", "16:00")
-    if regular.empty:
+    close = regular_session_closes(field_frame(intraday, 'Close', ['close']), {'close': session}).get('close', (None,))[0]
+    if close is None:
         # fallback to daily
         daily = t.history(period="10d", interval="1d", auto_adjust=False)
         return float(daily["Close"].iloc[-1]) if not daily.empty else 0
 
-    return float(regular["Close"].iloc[-1])
+    return close
 
+# ---------------------------------------------------------------------------------------------------------------------
 
-def get_stock_data(symbol):
-    
-    try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        """
-        NOTE: .info isn't the greatest way to do this... .download() would fetch more at once, but then you have to calculate current prices and I *just* got all this working the way I wanted to. .fast_info is also supposedly more reliable, but I haven't had any problems, so, leaving it. 
-        """
-        
-        # Get current price and other data
-        regular_market_price = info.get('currentPrice') or info.get('regularMarketPrice', 0)
-        #need to jump through hoops with a function to get today's regular session close. 
-        regular_market_price = get_regular_session_close(ticker)
+
+# Market calendar ------------------------------------------------------------------------------------------------------
+# Local NYSE calendar: which session US markets are in at any moment, worked out from the clock instead of asked of Yahoo. Fixed-date holidays move to the Friday before or the Monday after when they fall on a weekend, except New Year's Day on a Saturday, which isn't made up. Good Friday follows Easter. The day before Independence Day, the day after Thanksgiving and Christmas Eve close at 1pm, with after hours until 5pm. One-off closures (national days of mourning and the like) aren't known.
+MARKET_TIMEZONE = 'America/New_York'
+# (session, start minute) in New York time, for a normal and an early-close trading day
+MARKET_SESSIONS = (('CLOSED', 0), ('PRE', 4 * 60), ('REGULAR', 9 * 60 + 30), ('POST', 16 * 60), ('CLOSED', 20 * 60))
+EARLY_CLOSE_SESSIONS = (('CLOSED', 0), ('PRE', 4 * 60), ('REGULAR', 9 * 60 + 30), ('POST', 13 * 60), ('CLOSED', 17 * 60))
+# Symbols on New York time that trade around the clock anyway
+ROUND_THE_CLOCK_QUOTE_TYPES = ('FUTURE', 'CURRENCY', 'CRYPTOCURRENCY')
+
+
+# Easter Sunday, anonymous Gregorian algorithm (Meeus/Jones/Butcher)
+def easter(year):
+    a, b, c = year % 19, year // 100, year % 100
+    g = (b - (b + 8) // 25 + 1) // 3
+    h = (19 * a + b - b // 4 - g + 15) % 30
+    l = (32 + 2 * (b % 4) + 2 * (c // 4) - h - c % 4) % 7
+    n = h + l - 7 * ((a + 11 * h + 22 * l) // 451) + 114
+    return date(year, n // 31, n % 31 + 1)
+
+
+# n-th given weekday (Monday = 0) of a month; n = -1 for the last one
+def nth_weekday(year, month, weekday, n):
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+# Saturday holidays are observed on Friday, Sunday ones on Monday
+def observed(day):
+    return day + timedelta(days={5: -1, 6: 1}.get(day.weekday(), 0))
+
+
+# (holidays, early closes) of one year, as sets of dates
+def nyse_holidays(year):
+    if year not in NYSE_HOLIDAY_CACHE:
+        holidays = {
+            nth_weekday(year, 1, 0, 3), # Martin Luther King Jr. Day
+            nth_weekday(year, 2, 0, 3), # Washington's Birthday
+            easter(year) - timedelta(days=2), # Good Friday
+            nth_weekday(year, 5, 0, -1), # Memorial Day
+            observed(date(year, 7, 4)),
+            nth_weekday(year, 9, 0, 1), # Labor Day
+            nth_weekday(year, 11, 3, 4), # Thanksgiving
+            observed(date(year, 12, 25)),
+        }
+        if date(year, 1, 1).weekday() != 5:
+            holidays.add(observed(date(year, 1, 1)))
+        if year >= 2022:
+            holidays.add(observed(date(year, 6, 19))) # Juneteenth
+        early_closes = {nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+        for day in (date(year, 7, 3), date(year, 12, 24)):
+            if day.weekday() <= 3: # Monday to Thursday; on a Friday it's the observed holiday itself
+                early_closes.add(day)
+        NYSE_HOLIDAY_CACHE[year] = (holidays, early_closes - holidays)
+    return NYSE_HOLIDAY_CACHE[year]
+
+
+NYSE_HOLIDAY_CACHE = {}
+
+
+class MarketCalendar:
+    def __init__(self, timezone=MARKET_TIMEZONE):
+        from zoneinfo import ZoneInfo
+        self.tz = ZoneInfo(timezone)
+
+    def trading_day(self, day):
+        return day.weekday() < 5 and day not in nyse_holidays(day.year)[0]
+
+    # [(session, start minute)] of one calendar day in market time
+    def sessions(self, day):
+        if not self.trading_day(day):
+            return (('CLOSED', 0),)
+        return EARLY_CLOSE_SESSIONS if day in nyse_holidays(day.year)[1] else MARKET_SESSIONS
+
+    def epoch(self, day, minute):
+        return datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=self.tz).timestamp()
+
+    # (session, epoch seconds it started) at time ts. A closed stretch starts where the last trading day's after hours ended, however many nights, weekends or holidays back that was.
+    def current(self, ts=None):
+        local = datetime.fromtimestamp(time.time() if ts is None else ts, self.tz)
+        day, minute = local.date(), local.hour * 60 + local.minute
+        session, start = [(name, begin) for name, begin in self.sessions(day) if begin <= minute][-1]
+        if session != 'CLOSED' or start > 0:
+            return session, self.epoch(day, start)
+        for _ in range(14):
+            day -= timedelta(days=1)
+            if self.trading_day(day):
+                return 'CLOSED', self.epoch(day, self.sessions(day)[-1][1])
+        return 'CLOSED', self.epoch(local.date(), 0)
+
+    def session_at(self, ts=None):
+        return self.current(ts)[0]
+
+    # Whether a quote fetched at fetched_at is still good at now: not if a session started or ended since, never otherwise while closed, and for ttl[session] seconds while trading
+    def quote_fresh(self, fetched_at, now, ttl):
+        session, started = self.current(now)
+        if fetched_at < started:
+            return False
+        return session == 'CLOSED' or now - fetched_at < ttl.get(session, 0)
+
+
+MARKET_CALENDAR = MarketCalendar()
+
+
+# US stocks, ETFs, funds and indices keep NYSE hours; futures, currencies, crypto and foreign listings don't
+def follows_market_calendar(symbol, info):
+    return (info.get('exchangeTimezoneName') == MARKET_TIMEZONE and info.get('quoteType') not in ROUND_THE_CLOCK_QUOTE_TYPES
+            and not symbol.endswith(('=F', '=X')))
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# One symbol's quote as the menu uses it. Prices are stored once as raw floats and only formatted when a line is rendered (see fmt). raw_data, the .info dict the quote was built from, is only kept for symbols with the debug submenu on.
+class Quote:
+    __slots__ = ('symbol', 'short_name', 'long_name', 'currency', 'market_state', 'regular_market_time',
+                 'current_price', 'regular_market_price', 'regular_market_previous_close', 'regular_market_open',
+                 'pre_market_price', 'post_market_price', 'regular_market_change_percent', 'pre_market_change_percent',
+                 'post_market_change_percent', 'day_high', 'day_low', 'fifty_two_week_high', 'fifty_two_week_low',
+                 'bid', 'ask', 'market_calendar', 'raw_data', 'stale_since')
+
+    # Build a quote from a yfinance .info style dict
+    @classmethod
+    def from_info(cls, symbol, info, regular_market_price):
+        q = cls()
 
         # WAS, BUT CHAGPT SAYS NOT RIGHT, regularMarketPreviousClose IS MORE RELIABLE. previous_close = info.get('previousClose', 0)
         previous_close = info.get('regularMarketPreviousClose') or info.get('previousClose', 0)
-        
+
         # Get pre-market and post-market data
         pre_market_price = info.get('preMarketPrice', 0)
         post_market_price = info.get('postMarketPrice', 0)
-        
-        if info.get('marketState', 'CLOSED') == "PRE" and pre_market_price:
+        market_state = info.get('marketState', 'CLOSED')
+
+        if market_state == "PRE" and pre_market_price:
             current_price = pre_market_price
-        elif info.get('marketState', 'CLOSED') == "POST" and post_market_price:
+        elif market_state == "POST" and post_market_price:
             current_price = post_market_price
         else:
             current_price = regular_market_price
-                
-        if previous_close > 0:
-            change_percent = ((regular_market_price - previous_close) / previous_close) * 100
-            pre_change_percent = ((pre_market_price - previous_close) / previous_close) * 100 if pre_market_price > 0 else 0
-            post_change_percent = ((post_market_price - regular_market_price) / regular_market_price) * 100 if post_market_price > 0 else 0
-            post_change_percent_since_yesterday = ((post_market_price - previous_close) / previous_close) * 100 if post_market_price > 0 else 0
 
+        if previous_close > 0:
+            q.regular_market_change_percent = ((regular_market_price - previous_close) / previous_close) * 100
+            q.pre_market_change_percent = ((pre_market_price - previous_close) / previous_close) * 100 if pre_market_price > 0 else 0
+            # post-market change is shown since yesterday's close, a total-day-plus-after-hours return
+            q.post_market_change_percent = ((post_market_price - previous_close) / previous_close) * 100 if post_market_price > 0 else 0
         else:
-            change_percent = 0
-            pre_change_percent = 0
-            post_change_percent = 0
-        
-        # Create a compatible data structure matching the original format
-        stock_data = {
-            'price': {
-                'symbol': symbol,
-                'shortName': info.get('shortName', symbol),
-                'longName': info.get('longName', info.get('shortName', symbol)),
-                'currentPrice': {'raw': current_price, 'fmt': f"{current_price:.2f}"},
-                'regularMarketPrice': {'raw': regular_market_price, 'fmt': f"{regular_market_price:.2f}"},
-                'regularMarketTime': int(info.get('regularMarketTime', 0)),
-                'regularMarketChangePercent': {'raw': change_percent, 'fmt': f"{change_percent:.2f}%"},
-                'regularMarketChange': {'raw': regular_market_price - previous_close, 'fmt': f"{regular_market_price - previous_close:.2f}"},
-                'regularMarketOpen': {'raw': info.get('regularMarketOpen', 0), 'fmt': f"{info.get('regularMarketOpen', 0):.2f}"},
-                'regularMarketPreviousClose': {'raw': previous_close, 'fmt': f"{previous_close:.2f}"},
-                'marketState': info.get('marketState', 'CLOSED'),
-                'currency': info.get('currency', 'USD'),
-                # Add pre-market and post-market data
-                'preMarketPrice': {'raw': pre_market_price, 'fmt': f"{pre_market_price:.2f}"},
-                'preMarketChangePercent': {'raw': pre_change_percent, 'fmt': f"{pre_change_percent:.2f}%"},
-                'postMarketPrice': {'raw': post_market_price, 'fmt': f"{post_market_price:.2f}"},
-                'postMarketChangePercent': {'raw': post_change_percent_since_yesterday, 'fmt': f"{post_change_percent_since_yesterday:.2f}%"}
-            },
-            'summaryDetail': {
-                'regularMarketDayHigh': {'raw': info.get('dayHigh', 0), 'fmt': f"{info.get('dayHigh', 0):.2f}"},
-                'regularMarketDayLow': {'raw': info.get('dayLow', 0), 'fmt': f"{info.get('dayLow', 0):.2f}"},
-                'fiftyTwoWeekHigh': {'raw': info.get('fiftyTwoWeekHigh', 0), 'fmt': f"{info.get('fiftyTwoWeekHigh', 0):.2f}"},
-                'fiftyTwoWeekLow': {'raw': info.get('fiftyTwoWeekLow', 0), 'fmt': f"{info.get('fiftyTwoWeekLow', 0):.2f}"},
-                'bid': {'raw': info.get('bid', 0), 'fmt': f"{info.get('bid', 0):.2f}" if info.get('bid') else 'N/A'},
-                'ask': {'raw': info.get('ask', 0), 'fmt': f"{info.get('ask', 0):.2f}" if info.get('ask') else 'N/A'}
-            },
-                'rawData': info
-        }
-        
-        return stock_data
-        
+            q.regular_market_change_percent = 0
+            q.pre_market_change_percent = 0
+            q.post_market_change_percent = 0
+
+        q.symbol = symbol
+        q.short_name = info.get('shortName', symbol)
+        q.long_name = info.get('longName', info.get('shortName', symbol))
+        q.currency = info.get('currency', 'USD')
+        q.market_state = market_state
+        q.regular_market_time = int(info.get('regularMarketTime', 0))
+        q.current_price = current_price
+        q.regular_market_price = regular_market_price
+        q.regular_market_previous_close = previous_close
+        q.regular_market_open = info.get('regularMarketOpen', 0)
+        q.pre_market_price = pre_market_price
+        q.post_market_price = post_market_price
+        q.day_high = info.get('dayHigh', 0)
+        q.day_low = info.get('dayLow', 0)
+        q.fifty_two_week_high = info.get('fiftyTwoWeekHigh', 0)
+        q.fifty_two_week_low = info.get('fiftyTwoWeekLow', 0)
+        q.bid = info.get('bid', 0)
+        q.ask = info.get('ask', 0)
+        q.market_calendar = follows_market_calendar(symbol, info)
+        q.raw_data = info if debug_enabled_for(symbol) else None
+        q.stale_since = None # set to the time it was fetched when a refresh fails and this quote is shown instead
+        return q
+
+    # Effective market state: PRE, REGULAR, POST or CLOSED
+    @property
+    def session(self):
+        return get_eff_market_state(self.market_state)
+
+    # A field formatted for the menu, e.g. fmt('current_price') -> '123.45'
+    def fmt(self, field):
+        return QUOTE_FIELD_FORMATS.get(field, PRICE_FORMAT)(getattr(self, field))
+
+    # Every field the menu shows, for telling whether a symbol's rendered lines are still current
+    def fingerprint(self):
+        return tuple(getattr(self, name) for name in self.__slots__ if name != 'raw_data')
+
+    # A copy with a streaming price update (see QuoteStream) laid over it: price, session, bid/ask, the day's open and range during the regular session, and the changes worked out from them. Everything else stays as polled.
+    def with_stream(self, update):
+        q = Quote.from_dict(self.to_dict())
+        session = STREAM_MARKET_HOURS.get(update['market_hours'], 'CLOSED')
+        price = update['price']
+        q.market_state = session
+        if session == 'PRE':
+            q.pre_market_price = price
+        elif session == 'POST':
+            q.post_market_price = price
+        elif session == 'REGULAR':
+            q.regular_market_price = price
+            q.regular_market_time = int(update['time']) // 1000
+            for name, key in (('regular_market_open', 'open_price'), ('day_high', 'day_high'), ('day_low', 'day_low')):
+                if update.get(key):
+                    setattr(q, name, update[key])
+        for name, key in (('regular_market_previous_close', 'previous_close'), ('bid', 'bid'), ('ask', 'ask')):
+            if update.get(key):
+                setattr(q, name, update[key])
+        q.current_price = {'PRE': q.pre_market_price, 'POST': q.post_market_price}.get(session) or q.regular_market_price
+        previous_close = q.regular_market_previous_close
+        if previous_close > 0:
+            q.regular_market_change_percent = ((q.regular_market_price - previous_close) / previous_close) * 100
+            q.pre_market_change_percent = ((q.pre_market_price - previous_close) / previous_close) * 100 if q.pre_market_price > 0 else 0
+            q.post_market_change_percent = ((q.post_market_price - previous_close) / previous_close) * 100 if q.post_market_price > 0 else 0
+        return q
+
+    # Plain dict of every field, for the quote cache and the debug submenu
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # Inverse of to_dict. Raises KeyError for anything else, e.g. a cache entry written by an older version.
+    @classmethod
+    def from_dict(cls, d):
+        q = cls()
+        for name in cls.__slots__:
+            setattr(q, name, d[name])
+        return q
+
+
+PRICE_FORMAT = '{:.2f}'.format
+PERCENT_FORMAT = '{:.2f}%'.format
+QUOTE_FIELD_FORMATS = {
+    'regular_market_change_percent': PERCENT_FORMAT,
+    'pre_market_change_percent': PERCENT_FORMAT,
+    'post_market_change_percent': PERCENT_FORMAT,
+    'bid': lambda x: PRICE_FORMAT(x) if x else 'N/A',
+    'ask': lambda x: PRICE_FORMAT(x) if x else 'N/A',
+}
+
+
+# Single-symbol lookup (e.g. the 'set' dialog), through the same lean batch path as the menu. None if it can't be fetched.
+def get_stock_data(symbol, state=None):
+    return get_stock_data_batch([symbol], state).get(symbol)
+
+
+# Fallback for symbols the bulk quote endpoint doesn't return: .fast_info comes from the chart endpoint, which knows more symbols. It has no session, pre/post or bid/ask fields, so these show as CLOSED. Raises if the symbol can't be fetched either way.
+def get_fallback_stock_data(symbol, state=None):
+    ticker = YAHOO_CLIENT.ticker(symbol)
+    fast_info = FETCH_SCHEDULER.timed(symbol + ' fast_info', lambda: ticker.fast_info)
+    """
+    NOTE: .info isn't the greatest way to do this... it fetches and parses hundreds of fields to use 15 of them. The menu goes through the bulk quote endpoint with only the fields it needs (see fetch_quote_batch), this is only the last resort, and full .info is only fetched in debug mode.
+    """
+    info = fast_info_to_info(symbol, fast_info)
+    
+    #need to jump through hoops with a function to get today's regular session close. 
+    regular_market_price = None
+    if state is not None:
+        state.bars.update([symbol])
+        regular_market_price = state.bars.regular_session_closes([symbol], {symbol: session_spec(info)})[symbol]
+    if regular_market_price is None:
+        regular_market_price = FETCH_SCHEDULER.timed(symbol + ' history', get_regular_session_close, ticker, session_spec(info))
+    return Quote.from_info(symbol, info, regular_market_price)
+
+
+# .info style dict from a yfinance FastInfo; keys it can't produce are left out so Quote.from_info uses its defaults
+def fast_info_to_info(symbol, fast_info):
+    info = {'symbol': symbol}
+    for fast_key, info_key in (('lastPrice', 'regularMarketPrice'), ('regularMarketPreviousClose', 'regularMarketPreviousClose'),
+                               ('previousClose', 'previousClose'), ('open', 'regularMarketOpen'), ('dayHigh', 'dayHigh'),
+                               ('dayLow', 'dayLow'), ('yearHigh', 'fiftyTwoWeekHigh'), ('yearLow', 'fiftyTwoWeekLow'),
+                               ('currency', 'currency'), ('timezone', 'exchangeTimezoneName'), ('exchange', 'exchange')):
+        try:
+            value = fast_info[fast_key]
+        except Exception:
+            continue
+        if value is not None:
+            info[info_key] = value
+    return info
+
+
+# Full .info for the debug submenu; the only place the complete quoteSummary payload is still needed
+def fetch_full_info(symbol):
+    try:
+        return FETCH_SCHEDULER.timed(symbol + ' info', lambda: YAHOO_CLIENT.ticker(symbol).info)
     except Exception as e:
-        alert('Error', f'Failed to fetch data for {symbol}: {str(e)}')
-        sys.exit()              
-
-# Check a given stock symbol against the price limit list
-def check_price_limits(symbol_to_be_checked, current_price, price_limit_list, data_file):
-    for limit_entry in price_limit_list:
-        if symbol_to_be_checked in limit_entry:
-            # Get the limit price, limits are saved in the format: TYPE SYMBOL PRICE
-            limit_price = float(limit_entry.split()[2])
-            notification_text = symbol_to_be_checked + ' current price is: ' + str(current_price)
-            notification_title = 'Price Alarm'
-
-            # Notify user if current price is lower than the BUY limit, then remove the limit from list
-            if 'BUY' in limit_entry and current_price < limit_price:
-                notification_subtitle = 'BUY Limit: ' + str(limit_price)
-                notify(notification_text, notification_title,
-                       notification_subtitle)
-                remove_line_from_data_file(data_file, limit_entry)
-
-            # Notify user if current price is higher than the SELL limit, then remove the limit from list
-            if 'SELL' in limit_entry and current_price > limit_price:
-                notification_subtitle = 'SELL Limit: ' + str(limit_price)
-                notify(notification_text, notification_title,
-                       notification_subtitle)
-                remove_line_from_data_file(data_file, limit_entry)
-
-
-
-def print_index(s, name): 
+        return {'error': str(e)}
+
+
+# Local state database -------------------------------------------------------------------------------------------------
+# Hidden SQLite file next to the plugin holding state that should survive between xbar runs. Each feature adds its CREATE statements to STATE_DB_SCHEMA.
+STATE_DB_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS quote_cache (
+        symbol TEXT PRIMARY KEY,
+        market_state TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        payload TEXT NOT NULL
+    )''',
+]
+
+
+def state_file_path(suffix):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), '.' + os.path.basename(__file__) + suffix)
+
+
+def open_state_db(path=None):
+    conn = sqlite3.connect(path or state_file_path('.sqlite'), timeout=10, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL') # readers (xbar) and writers (clicks on menu items) don't block each other
+    for statement in STATE_DB_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+# Quote cache: the last Quote fetched for each symbol, fresh for QUOTE_CACHE_TTL[session] seconds after it was fetched, where session is the effective market state of the quote itself. With OPTION_USE_MARKET_CALENDAR, quotes of US symbols go by the calendar instead (see MarketCalendar.quote_fresh). Weekend and overnight runs are then served from disk.
+class QuoteCache:
+    def __init__(self, conn, ttl=None, lock=None):
+        self.conn = conn
+        self.ttl = ttl or QUOTE_CACHE_TTL
+        self.lock = lock or threading.RLock()
+
+    # {symbol: Quote} for every symbol with a fresh entry; with max_age, any entry fetched less than max_age seconds ago is fresh
+    def get_fresh(self, symbols, now=None, max_age=None):
+        now = now or time.time()
+        fresh = {}
+        with self.lock:
+            for symbol in symbols:
+                row = self.conn.execute('SELECT market_state, fetched_at, payload FROM quote_cache WHERE symbol = ?', (symbol,)).fetchone()
+                if not row or row[0] == 'INVALIDATED':
+                    continue
+                try:
+                    quote = Quote.from_dict(json.loads(row[2]))
+                except KeyError:
+                    continue # written by an older version; refetch
+                if max_age is not None:
+                    if now - row[1] < max_age:
+                        fresh[symbol] = quote
+                elif OPTION_USE_MARKET_CALENDAR and quote.market_calendar:
+                    if MARKET_CALENDAR.quote_fresh(row[1], now, self.ttl):
+                        fresh[symbol] = quote
+                elif now - row[1] < self.ttl.get(row[0], 0):
+                    fresh[symbol] = quote
+        return fresh
+
+    def put(self, quotes, now=None):
+        now = now or time.time()
+        rows = [(symbol, quote.session, now, json.dumps(quote.to_dict(), default=str))
+                for symbol, quote in quotes.items()]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO quote_cache (symbol, market_state, fetched_at, payload) VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    # Last known Quote for each symbol, however old, with stale_since set to when it was fetched. Shown when a refresh fails.
+    def get_last(self, symbols):
+        last = {}
+        with self.lock:
+            for symbol in symbols:
+                row = self.conn.execute('SELECT fetched_at, payload FROM quote_cache WHERE symbol = ?', (symbol,)).fetchone()
+                try:
+                    quote = Quote.from_dict(json.loads(row[1])) if row else None
+                except KeyError:
+                    continue
+                if quote:
+                    quote.stale_since = row[0]
+                    last[symbol] = quote
+        return last
+
+    # Forced refresh: the next run goes to the network. Entries are only marked unfresh (no QUOTE_CACHE_TTL entry matches 'INVALIDATED'), so get_last() still finds them.
+    def invalidate(self):
+        with self.lock:
+            self.conn.execute("UPDATE quote_cache SET market_state = 'INVALIDATED'")
+            self.conn.commit()
+
+
+# Names and currency hardly ever change, so they're kept apart from the quote cache for SYMBOL_META_TTL seconds and left out of the quote request while cached
+STATE_DB_SCHEMA.append('''CREATE TABLE IF NOT EXISTS symbol_meta (
+        symbol TEXT PRIMARY KEY,
+        fetched_at REAL NOT NULL,
+        payload TEXT NOT NULL
+    )''')
+
+
+class SymbolMetaCache:
+    def __init__(self, conn, ttl=None, lock=None):
+        self.conn = conn
+        self.ttl = ttl or SYMBOL_META_TTL
+        self.lock = lock or threading.RLock()
+
+    def get_fresh(self, symbols, now=None):
+        now = now or time.time()
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol, fetched_at, payload FROM symbol_meta WHERE symbol IN (%s)'
+                                     % ','.join('?' * len(symbols)), list(symbols)).fetchall()
+        return {symbol: json.loads(payload) for symbol, fetched_at, payload in rows if now - fetched_at < self.ttl}
+
+    # Remember the slow fields of every quote that has them
+    def put(self, infos, now=None):
+        now = now or time.time()
+        rows = [(symbol, now, json.dumps({field: info[field] for field in SLOW_QUOTE_FIELDS if field in info}))
+                for symbol, info in infos.items() if any(field in info for field in SLOW_QUOTE_FIELDS)]
+        if rows:
+            with self.lock:
+                self.conn.executemany('INSERT OR REPLACE INTO symbol_meta (symbol, fetched_at, payload) VALUES (?, ?, ?)', rows)
+                self.conn.commit()
+
+
+# Price limits, indexed by symbol so checking a symbol is one lookup with an exact match instead of a substring scan of every line. Prices are kept as the text the user typed, so the 'remove' parameter round-trips exactly.
+STATE_DB_SCHEMA.append('''CREATE TABLE IF NOT EXISTS price_limits (
+        symbol TEXT NOT NULL,
+        limit_type TEXT NOT NULL,
+        price TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (symbol, limit_type, price)
+    )''')
+
+
+# What the limit engine remembers about a limit between runs: which side of a CROSS level the price was last seen on (1 above, -1 below) and the highest price seen since a TRAIL limit was set
+STATE_DB_SCHEMA.append('''CREATE TABLE IF NOT EXISTS price_limit_state (
+        symbol TEXT NOT NULL,
+        limit_type TEXT NOT NULL,
+        price TEXT NOT NULL,
+        side INTEGER,
+        high_water REAL,
+        PRIMARY KEY (symbol, limit_type, price)
+    )''')
+
+
+class PriceLimitStore:
+    def __init__(self, conn, lock=None):
+        self.conn = conn
+        self.lock = lock or threading.RLock()
+
+    # [(limit_type, symbol, price)] in the order they were set
+    def entries(self):
+        with self.lock:
+            return self.conn.execute('SELECT limit_type, symbol, price FROM price_limits ORDER BY created_at, rowid').fetchall()
+
+    # [(limit_type, symbol, price, side, high_water)] for the limit engine; side and high_water are None until first evaluated
+    def rules(self):
+        with self.lock:
+            return self.conn.execute('SELECT l.limit_type, l.symbol, l.price, s.side, s.high_water FROM price_limits l '
+                                     'LEFT JOIN price_limit_state s USING (symbol, limit_type, price) '
+                                     'ORDER BY l.created_at, l.rowid').fetchall()
+
+    # rows of (symbol, limit_type, price, side, high_water)
+    def save_state(self, rows):
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO price_limit_state (symbol, limit_type, price, side, high_water) '
+                                  'VALUES (?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def add(self, limit_type, symbol, price, now=None):
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO price_limits (symbol, limit_type, price, created_at) VALUES (?, ?, ?, ?)',
+                              (symbol, limit_type, price, now or time.time()))
+            self.conn.commit()
+
+    # True if this call removed the limit, so a limit triggered by two runs at once only notifies once
+    def remove(self, limit_type, symbol, price):
+        with self.lock:
+            removed = self.conn.execute('DELETE FROM price_limits WHERE symbol = ? AND limit_type = ? AND price = ?',
+                                        (symbol, limit_type, price)).rowcount
+            self.conn.execute('DELETE FROM price_limit_state WHERE symbol = ? AND limit_type = ? AND price = ?',
+                              (symbol, limit_type, price))
+            self.conn.commit()
+        return removed > 0
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM price_limits')
+            self.conn.execute('DELETE FROM price_limit_state')
+            self.conn.commit()
+
+    # Move the limits of a pre-Oct 2026 .db text file into the table, then rename the file to .db.migrated so this only happens once. Malformed lines are dropped.
+    def import_legacy_file(self, data_file):
+        try:
+            lines = read_data_file(data_file)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        rows = [(fields[1], fields[0], fields[2], now + n * 1e-6) # keep the file's order
+                for n, fields in enumerate(filter(None, map(parse_limit_entry, lines)))]
+        with self.lock:
+            self.conn.executemany('INSERT OR IGNORE INTO price_limits (symbol, limit_type, price, created_at) VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+        try:
+            os.replace(data_file, data_file + '.migrated')
+        except FileNotFoundError: # another run migrated it first
+            pass
+
+
+# The price limit store, with any legacy .db file migrated into it. Pass the connection (and lock) of an open LocalState to share them.
+def open_price_limits(data_file, conn=None, lock=None):
+    limits = PriceLimitStore(conn or open_state_db(), lock)
+    limits.import_legacy_file(data_file)
+    return limits
+
+
+# Price alert queue ----------------------------------------------------------------------------------------------------
+# Triggered limits are queued here and shown by a separate 'notify-worker' process, because the osascript dialog blocks until it's dismissed and the menu has to get back to xbar right away. While an alert for a symbol is waiting, later alerts for that symbol are merged into it, and an alert already shown in the last ALERT_DEDUP_SECONDS is dropped.
+ALERT_DEDUP_SECONDS = 300
+NOTIFY_PID_FILE = state_file_path('.notify.pid')
+NOTIFY_LOG_FILE = state_file_path('.alerts.log')
+
+STATE_DB_SCHEMA.extend([
+    '''CREATE TABLE IF NOT EXISTS alert_queue (
+        id INTEGER PRIMARY KEY,
+        symbol TEXT NOT NULL,
+        title TEXT NOT NULL,
+        subtitle TEXT NOT NULL,
+        text TEXT NOT NULL,
+        queued_at REAL NOT NULL,
+        sent_at REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS alert_queue_pending ON alert_queue (symbol) WHERE sent_at IS NULL',
+])
+
+
+class AlertQueue:
+    def __init__(self, conn, lock=None):
+        self.conn = conn
+        self.lock = lock or threading.RLock()
+
+    # Queue an alert, merging it into the symbol's waiting alert if there is one. Returns False if it was dropped as a duplicate.
+    def put(self, symbol, title, subtitle, text, now=None):
+        now = now or time.time()
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE') # the worker and other runs use the queue too
+            recent = self.conn.execute('SELECT subtitle FROM alert_queue WHERE symbol = ? AND sent_at > ?',
+                                       (symbol, now - ALERT_DEDUP_SECONDS)).fetchall()
+            if any(subtitle in row[0].split(', ') for row in recent):
+                return False
+            waiting = self.conn.execute('SELECT id, subtitle FROM alert_queue WHERE symbol = ? AND sent_at IS NULL', (symbol,)).fetchone()
+            if waiting:
+                subtitles = waiting[1].split(', ')
+                if subtitle not in subtitles:
+                    subtitles.append(subtitle)
+                self.conn.execute('UPDATE alert_queue SET subtitle = ?, text = ? WHERE id = ?', (', '.join(subtitles), text, waiting[0]))
+            else:
+                self.conn.execute('INSERT INTO alert_queue (symbol, title, subtitle, text, queued_at) VALUES (?, ?, ?, ?, ?)',
+                                  (symbol, title, subtitle, text, now))
+        return True
+
+    # Take the oldest waiting alert. It's marked sent before it's shown, so nothing gets merged into a dialog that's already on screen.
+    def claim(self, now=None):
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute('SELECT id, title, subtitle, text FROM alert_queue WHERE sent_at IS NULL ORDER BY id LIMIT 1').fetchone()
+            if row:
+                self.conn.execute('UPDATE alert_queue SET sent_at = ? WHERE id = ?', (now or time.time(), row[0]))
+        return row and {'title': row[1], 'subtitle': row[2], 'text': row[3]}
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM alert_queue WHERE sent_at IS NULL').fetchone()[0]
+
+    # Forget alerts shown before the given time
+    def prune(self, before):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM alert_queue WHERE sent_at < ?', (before,))
+
+
+# Alert backend that appends to a log file instead of showing anything, for headless runs and tests
+def notify_to_file(text, title, subtitle, sound=None):
+    with open(os.environ.get('STOCKS_NOTIFY_FILE') or NOTIFY_LOG_FILE, 'a') as f:
+        f.write(datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ' ' + title + ': ' + text + ' (' + subtitle + ')\n')
+
+
+NOTIFY_BACKENDS = {
+    'osascript': notify,
+    'file': notify_to_file,
+}
+
+
+def notify_backend():
+    name = os.environ.get('STOCKS_NOTIFY_BACKEND') or ('file' if HEADLESS else NOTIFY_BACKEND)
+    return NOTIFY_BACKENDS.get(name, notify)
+
+
+# Exclusive lock on a pid file, held until the returned file is closed or the process exits. None if another process holds it.
+def lock_pid_file(path):
+    import fcntl
+    pid_file = open(path, 'a+')
+    try:
+        fcntl.flock(pid_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        pid_file.close()
+        return None
+    pid_file.seek(0)
+    pid_file.truncate()
+    pid_file.write(str(os.getpid()))
+    pid_file.flush()
+    return pid_file
+
+
+# 'notify-worker': show queued alerts one after another until the queue is empty. Only one worker runs at a time.
+def run_notify_worker():
+    pid_file = lock_pid_file(NOTIFY_PID_FILE)
+    if pid_file is None:
+        return
+    deliver = notify_backend()
+    alerts = AlertQueue(open_state_db())
+    while True:
+        queued = alerts.claim()
+        if queued is None:
+            time.sleep(1) # a run that's still checking limits may queue more
+            queued = alerts.claim()
+            if queued is None:
+                break
+        try:
+            deliver(queued['text'], queued['title'], queued['subtitle'])
+        except Exception:
+            pass
+    alerts.prune(time.time() - 24 * 3600)
+    pid_file.close()
+    # an alert queued just now saw the lock still held and didn't start a worker of its own
+    if alerts.pending():
+        run_notify_worker()
+
+
+def start_notify_worker():
+    subprocess.Popen([sys.executable, os.path.realpath(__file__), 'notify-worker'], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Symbols that keep failing to fetch. Each failed refresh counts against the symbol; from FETCH_BREAKER_FAILURES in a row on it isn't requested until retry_after, and any success resets it.
+STATE_DB_SCHEMA.append('''CREATE TABLE IF NOT EXISTS fetch_failures (
+        symbol TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        last_error TEXT,
+        retry_after REAL NOT NULL
+    )''')
+
+
+class FetchCircuitBreaker:
+    def __init__(self, conn, lock=None):
+        self.conn = conn
+        self.lock = lock or threading.RLock()
+
+    # The symbols that are cooling down and shouldn't be requested now
+    def open_symbols(self, symbols, now=None):
+        now = now or time.time()
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol FROM fetch_failures WHERE retry_after > ? AND symbol IN (%s)'
+                                     % ','.join('?' * len(symbols)), [now] + list(symbols)).fetchall()
+        return {row[0] for row in rows}
+
+    # failures: {symbol: error text}
+    def record(self, successes, failures, now=None):
+        now = now or time.time()
+        with self.lock:
+            self.conn.executemany('DELETE FROM fetch_failures WHERE symbol = ?', [(symbol,) for symbol in successes])
+            for symbol, error in failures.items():
+                row = self.conn.execute('SELECT failures FROM fetch_failures WHERE symbol = ?', (symbol,)).fetchone()
+                count = (row[0] if row else 0) + 1
+                retry_after = 0
+                if count >= FETCH_BREAKER_FAILURES:
+                    retry_after = now + min(FETCH_BREAKER_COOLDOWN * 2 ** (count - FETCH_BREAKER_FAILURES), 24 * 3600)
+                self.conn.execute('INSERT OR REPLACE INTO fetch_failures (symbol, failures, last_error, retry_after) VALUES (?, ?, ?, ?)',
+                                  (symbol, count, error, retry_after))
+            self.conn.commit()
+
+
+# Everything kept in the state database for one run, sharing one connection and one lock (fetch batches use it from worker threads). quotes is None when the quote cache is off or bypassed; last_quotes always keeps the latest quote of each symbol, to show when a refresh fails.
+class LocalState:
+    def __init__(self, conn, use_quote_cache=True):
+        self.conn = conn
+        self.lock = threading.RLock()
+        self.last_quotes = QuoteCache(conn, lock=self.lock)
+        self.quotes = self.last_quotes if use_quote_cache else None
+        self.breaker = FetchCircuitBreaker(conn, lock=self.lock)
+        self.meta = SymbolMetaCache(conn, lock=self.lock)
+        self.bars = IntradayBarStore(conn, lock=self.lock)
+        self.indicators = IndicatorStore(conn, lock=self.lock)
+        self.stream = None # QuoteStream, started by the daemon with OPTION_USE_STREAMING
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Price history ring buffers -------------------------------------------------------------------------------------------
+# Each symbol's recorded prices live in their own fixed-size ring buffer file in a hidden .history folder: a 32-byte header (magic, record size, capacity, number of records ever appended) followed by `capacity` 24-byte (timestamp, price, session code) records, the oldest overwritten first. Files are memory-mapped, so an append writes one record and then the count in place, never rewriting the file. A ring is only opened and mapped for one append or read and closed again straight after, so however long the watchlist no history file stays open (macOS allows a process 256 open files by default, and a ring open for good would hold two of them); latest() therefore returns a copy of its records. A price equal to the last one recorded in the same session isn't appended again, so quote cache hits and closed markets don't fill the buffer with repeats. Appends hold an flock on the file, as the daemon and a one-off xbar run may both write; readers don't lock, and since the count is written after the record they never see a half-written one.
+PRICE_HISTORY_DIR = state_file_path('.history')
+PRICE_RING_MAGIC = b'SAPH'
+PRICE_RING_HEADER = struct.Struct('<4sII') # magic, record size, capacity
+PRICE_RING_COUNT = struct.Struct('<Q') # records appended since the file was created, at PRICE_RING_COUNT_OFFSET
+PRICE_RING_COUNT_OFFSET = 16
+PRICE_RING_HEADER_SIZE = 32
+PRICE_RING_RECORD = struct.Struct('<ddb7x') # timestamp, price, session code
+SESSION_CODES = {'CLOSED': 0, 'PRE': 1, 'REGULAR': 2, 'POST': 3}
+
+
+class PriceRing:
+    def __init__(self, path, capacity):
+        self.file = open(path, 'a+b')
+        try:
+            with self.locked():
+                self.capacity = self.open_file(capacity)
+                self.map = mmap.mmap(self.file.fileno(), self.file_size(self.capacity))
+        except BaseException:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    @staticmethod
+    def file_size(capacity):
+        return PRICE_RING_HEADER_SIZE + capacity * PRICE_RING_RECORD.size
+
+    @contextmanager
+    def locked(self):
+        import fcntl
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+
+    # Check the header, and start the file over if it's new, unreadable or sized for another capacity. On a capacity change the latest records are carried over. Returns the capacity.
+    def open_file(self, capacity):
+        self.file.seek(0)
+        header = self.file.read(PRICE_RING_HEADER_SIZE)
+        records = b''
+        count = 0
+        if len(header) == PRICE_RING_HEADER_SIZE:
+            magic, record_size, old_capacity = PRICE_RING_HEADER.unpack_from(header)
+            if magic == PRICE_RING_MAGIC and record_size == PRICE_RING_RECORD.size and old_capacity > 0 \
+                    and os.fstat(self.file.fileno()).st_size == self.file_size(old_capacity):
+                if old_capacity == capacity:
+                    return capacity
+                old_count = PRICE_RING_COUNT.unpack_from(header, PRICE_RING_COUNT_OFFSET)[0]
+                body = self.file.read(old_capacity * PRICE_RING_RECORD.size)
+                split = (old_count % old_capacity) * PRICE_RING_RECORD.size
+                kept = min(old_count, old_capacity, capacity) * PRICE_RING_RECORD.size
+                records = (body[split:] + body[:split] if old_count >= old_capacity else body[:split])[-kept:] if kept else b''
+                count = len(records) // PRICE_RING_RECORD.size
+        self.file.truncate(0)
+        self.file.write(PRICE_RING_HEADER.pack(PRICE_RING_MAGIC, PRICE_RING_RECORD.size, capacity).ljust(PRICE_RING_COUNT_OFFSET, b'\0'))
+        self.file.write(PRICE_RING_COUNT.pack(count).ljust(PRICE_RING_HEADER_SIZE - PRICE_RING_COUNT_OFFSET, b'\0'))
+        self.file.write(records)
+        self.file.truncate(self.file_size(capacity))
+        self.file.flush()
+        return capacity
+
+    @property
+    def count(self):
+        return PRICE_RING_COUNT.unpack_from(self.map, PRICE_RING_COUNT_OFFSET)[0]
+
+    def offset(self, n):
+        return PRICE_RING_HEADER_SIZE + (n % self.capacity) * PRICE_RING_RECORD.size
+
+    # Append one record unless it repeats the last one's price and session. Returns whether it was appended.
+    def append(self, ts, price, session):
+        with self.locked():
+            count = self.count
+            if count:
+                _, last_price, last_session = PRICE_RING_RECORD.unpack_from(self.map, self.offset(count - 1))
+                if last_price == price and last_session == session:
+                    return False
+            PRICE_RING_RECORD.pack_into(self.map, self.offset(count), ts, price, session)
+            PRICE_RING_COUNT.pack_into(self.map, PRICE_RING_COUNT_OFFSET, count + 1)
+        return True
+
+    # The latest n records (all of them by default), oldest first, as a NumPy structured array with fields ts, price and session. A copy, so it outlives the mapping.
+    def latest(self, n=None):
+        import numpy as np
+        dtype = np.dtype({'names': ['ts', 'price', 'session'], 'formats': ['<f8', '<f8', 'i1'],
+                          'offsets': [0, 8, 16], 'itemsize': PRICE_RING_RECORD.size})
+        records = np.frombuffer(self.map, dtype=dtype, count=self.capacity, offset=PRICE_RING_HEADER_SIZE)
+        count = self.count
+        n = min(count, self.capacity, self.capacity if n is None else n)
+        end = (count - 1) % self.capacity + 1 if count else 0
+        if n <= end:
+            return records[end - n:end].copy()
+        return np.concatenate((records[end - n:], records[:end]))
+
+
+# Every symbol's PriceRing, each opened only for the append or read at hand
+class PriceHistory:
+    def __init__(self, directory=None, capacity=None):
+        self.directory = directory or PRICE_HISTORY_DIR
+        self.capacity = capacity or PRICE_HISTORY_SIZE
+        self.versions = {} # symbol -> ring count, see version()
+
+    def path(self, symbol):
+        return os.path.join(self.directory, symbol.replace('%', '%25').replace('/', '%2F') + '.ring')
+
+    # The symbol's ring, opened for a `with` block (which closes it), or None if it has no history file and create is False
+    def ring(self, symbol, create=True):
+        path = self.path(symbol)
+        if not create and not os.path.exists(path):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        return PriceRing(path, self.capacity)
+
+    # Append each quote's current price, stamped with the refresh time. Stale quotes (the last known ones, shown when a refresh failed) are old prices and are skipped. Returns how many were appended.
+    def record(self, quotes, now=None):
+        now = now or time.time()
+        appended = 0
+        for symbol, quote in quotes.items():
+            if quote.stale_since is None and quote.current_price == quote.current_price: # not None or NaN
+                with self.ring(symbol) as ring:
+                    appended += ring.append(now, quote.current_price, SESSION_CODES[quote.session])
+                    self.versions[symbol] = ring.count
+        return appended
+
+    # How many prices the symbol's ring has ever had appended, for telling whether its history changed without reading it. Kept from this process's own appends, so the file is only read the first time a symbol is asked about.
+    def version(self, symbol):
+        if symbol not in self.versions:
+            ring = self.ring(symbol, create=False)
+            if ring is None:
+                return 0
+            with ring:
+                self.versions[symbol] = ring.count
+        return self.versions[symbol]
+
+    def latest(self, symbol, n=None):
+        ring = self.ring(symbol, create=False)
+        if ring is None:
+            return None
+        with ring:
+            return ring.latest(n)
+
+
+PRICE_HISTORY = PriceHistory()
+SPARKLINE_BARS = '▁▂▃▄▅▆▇█'
+
+
+# Prices as a row of block characters, lowest to highest
+def sparkline(prices):
+    import numpy as np
+    low, high = prices.min(), prices.max()
+    if high == low:
+        return SPARKLINE_BARS[0] * len(prices)
+    levels = np.rint((prices - low) / (high - low) * (len(SPARKLINE_BARS) - 1)).astype(int)
+    return ''.join(SPARKLINE_BARS[level] for level in levels)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Fetch scheduler ------------------------------------------------------------------------------------------------------
+# Token bucket: holds up to `burst` tokens, refilled at `rate` per second. Every Yahoo request takes one, waiting if the bucket is empty. A rate of 0 (or less) means no rate limit, and `burst` is at least 1.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Bounded worker pool for Yahoo requests. map() keeps results in input order so the sort and print code downstream doesn't care which request finished first; timed() wraps each individual request with the rate limiter and records its latency.
+class FetchScheduler:
+    def __init__(self, max_workers=FETCH_MAX_WORKERS, rate=FETCH_RATE_PER_SECOND, burst=FETCH_RATE_BURST,
+                 retries=FETCH_RETRIES, backoff=FETCH_RETRY_BACKOFF):
+        self.max_workers = max(1, int(max_workers))
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.latencies = [] # (label, seconds, ok) per request
+        self.lock = threading.Lock()
+
+    # Run one request, retrying failures with full-jitter exponential backoff. Every attempt waits for a token, so retries count against the rate limit like any other request.
+    def timed(self, label, fn, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            except Exception:
+                if attempt == self.retries:
+                    raise
+            finally:
+                with self.lock:
+                    self.latencies.append((label if attempt == 0 else label + ' retry ' + str(attempt), time.perf_counter() - start, ok))
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    # Forget the previous refresh's latencies (the daemon reuses one scheduler)
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+
+    def map(self, fn, items):
+        items = list(items)
+        if len(items) <= 1 or self.max_workers == 1:
+            return [fn(item) for item in items]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            return list(pool.map(fn, items))
+
+
+FETCH_SCHEDULER = FetchScheduler()
+
+# yf.download() keeps its per-call results in module level state in some yfinance versions, so two downloads must never overlap
+DOWNLOAD_LOCK = threading.Lock()
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Refresh instrumentation ----------------------------------------------------------------------------------------------
+# Named timers around each phase of a refresh and counters for cache hits, fallbacks and the like. Phases timed inside the fetch workers (quote requests, bar downloads) add up across workers, so they can exceed the fetch phase's wall time. Per-request latencies are kept by FETCH_SCHEDULER, bytes and request counts by YAHOO_CLIENT.
+METRICS_LOG_FILE = state_file_path('.metrics.log')
+PROFILE_FILE = state_file_path('.prof')
+
+
+class RefreshMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.phases = {} # name -> seconds, in the order each phase first ran
+            self.counters = {}
+            self.errors = {} # name -> last error message
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name, n=1):
+        if n:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    # Count a failure that was handled, keeping its message for the metrics log and the Performance item
+    def error(self, name, exception):
+        self.count(name)
+        with self.lock:
+            self.errors[name] = type(exception).__name__ + ': ' + str(exception)
+
+    # One refresh as a JSON-able dict: the metrics log line
+    def snapshot(self, scheduler=None, client=None):
+        with self.lock:
+            record = {'time': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                      'total': round(time.time() - self.started, 4),
+                      'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+                      'counters': dict(self.counters)}
+            if self.errors:
+                record['errors'] = dict(self.errors)
+        if scheduler is not None:
+            latencies = list(scheduler.latencies)
+            record['requests'] = len(latencies)
+            record['failed_requests'] = sum(not ok for _, _, ok in latencies)
+            record['slowest'] = [[label, round(seconds, 4)] for label, seconds, _ in sorted(latencies, key=lambda entry: -entry[1])[:5]]
+        if client is not None:
+            record['http'] = dict(client.run)
+        return record
+
+
+METRICS = RefreshMetrics()
+
+
+def metrics_log_file():
+    return os.environ.get('STOCKS_METRICS_FILE') or (METRICS_LOG_FILE if OPTION_WRITE_METRICS_LOG else None)
+
+
+def log_refresh_metrics():
+    path = metrics_log_file()
+    if not path:
+        return
+    try:
+        with open(path, 'a') as f:
+            f.write(json.dumps(METRICS.snapshot(FETCH_SCHEDULER, YAHOO_CLIENT)) + '\n')
+    except OSError:
+        pass
+
+
+# Run fn(*args) under cProfile when STOCKS_PROFILE is set, saving the stats for `python3 -m pstats`. The daemon overwrites the file on every refresh, so it always holds the latest one.
+def profiled(fn, *args):
+    path = os.environ.get('STOCKS_PROFILE')
+    if not path:
+        return fn(*args)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        profiler.dump_stats(PROFILE_FILE if path == '1' else path)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Shared Yahoo session -------------------------------------------------------------------------------------------------
+# Every Yahoo call (the bulk quote request, yf.download, Ticker.fast_info/.history/.info) goes through one HTTP session with keep-alive connection pooling, so the TLS connections and Yahoo's cookie and crumb are set up once per process instead of once per symbol. The daemon keeps them across refreshes. The client also counts requests, cookie/crumb handshakes and new connections, shown in the debug submenu.
+YAHOO_HANDSHAKE_URLS = ('/v1/test/getcrumb', 'fc.yahoo.com', 'guce.yahoo.com', 'consent.yahoo.com')
+
+
+class YahooClient:
+    COUNTERS = ('requests', 'handshakes', 'crumb_fetches', 'new_connections', 'bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._session = None
+        self._connects_info = None
+        self.totals = dict.fromkeys(self.COUNTERS, 0) # for the life of the process
+        self.run = dict.fromkeys(self.COUNTERS, 0) # since reset_run(), i.e. this refresh
+
+    # The session yfinance's YfData singleton holds (it keeps the cookie and crumb), set up on first use so commands that never fetch don't import yfinance
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                from yfinance.data import YfData
+                session = YfData()._session
+                try:
+                    # curl_cffi: have each response report how many new connections it needed (0 = reused)
+                    from curl_cffi.const import CurlInfo
+                    if CurlInfo.NUM_CONNECTS not in session.curl_infos:
+                        session.curl_infos.append(CurlInfo.NUM_CONNECTS)
+                    self._connects_info = CurlInfo.NUM_CONNECTS
+                except (ImportError, AttributeError):
+                    pass # requests backend: connection reuse isn't reported
+                send = session.request
+
+                def counted_request(method, url, *args, **kwargs):
+                    response = send(method, url, *args, **kwargs)
+                    self.record(url, response)
+                    return response
+
+                session.request = counted_request
+                self._session = session
+            return self._session
+
+    def record(self, url, response):
+        new_connections = 0
+        if self._connects_info is not None:
+            new_connections = (getattr(response, 'infos', None) or {}).get(self._connects_info) or 0
+        try:
+            size = len(response.content or b'')
+        except Exception:
+            size = 0 # streamed or failed response
+        with self.lock:
+            for counters in (self.totals, self.run):
+                counters['requests'] += 1
+                counters['handshakes'] += any(part in url for part in YAHOO_HANDSHAKE_URLS)
+                counters['crumb_fetches'] += '/v1/test/getcrumb' in url
+                counters['new_connections'] += new_connections
+                counters['bytes'] += size
+
+    def reset_run(self):
+        with self.lock:
+            self.run = dict.fromkeys(self.COUNTERS, 0)
+
+    # Fraction of requests that went out on an already open connection, or None if unknown
+    def reuse_ratio(self, counters):
+        if self._connects_info is None or not counters['requests']:
+            return None
+        return max(0.0, 1 - counters['new_connections'] / counters['requests'])
+
+    def get_json(self, url, params=None):
+        from yfinance.data import YfData
+        self.session # installs the counters on first use
+        return YfData().get_raw_json(url, params=params)
+
+    def ticker(self, symbol):
+        return yf.Ticker(symbol, session=self.session)
+
+    def download(self, symbols, **kwargs):
+        return yf.download(symbols, session=self.session, **kwargs)
+
+
+YAHOO_CLIENT = YahooClient()
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Batched quotes -------------------------------------------------------------------------------------------------------
+# Yahoo's v7 quote endpoint takes a comma separated list of symbols and returns the same session fields .info gets them from, so a whole batch costs one request instead of one per symbol.
+def chunked(seq, size):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+# The quote endpoint names a few fields differently than .info does; fill in the .info names so Quote.from_info works on both
+def quote_to_info(quote):
+    info = dict(quote)
+    info.setdefault('dayHigh', quote.get('regularMarketDayHigh', 0))
+    info.setdefault('dayLow', quote.get('regularMarketDayLow', 0))
+    info.setdefault('previousClose', quote.get('regularMarketPreviousClose', 0))
+    return info
+
+
+# Only the fields the menu reads are requested. Names and currency are only requested for symbols not in the meta cache.
+def fetch_quote_batch(symbols, meta=None):
+    cached_meta = meta.get_fresh(symbols) if meta else {}
+    METRICS.count('name cache hits', len(cached_meta))
+    fields = LEAN_QUOTE_FIELDS if len(cached_meta) == len(symbols) else LEAN_QUOTE_FIELDS + SLOW_QUOTE_FIELDS
+    response = FETCH_SCHEDULER.timed('quote x' + str(len(symbols)), YAHOO_CLIENT.get_json, YAHOO_QUOTE_URL,
+                                     params={'symbols': ','.join(symbols), 'fields': ','.join(fields), 'formatted': 'false'})
+    results = (response or {}).get('quoteResponse', {}).get('result') or []
+    infos = {}
+    for quote in results:
+        if 'symbol' not in quote:
+            continue
+        info = quote_to_info(quote)
+        for field, value in cached_meta.get(quote['symbol'], {}).items():
+            info.setdefault(field, value)
+        infos[quote['symbol']] = info
+    if meta:
+        meta.put({symbol: info for symbol, info in infos.items() if symbol not in cached_meta})
+    return infos
+
+
+# One yf.download() call for the 1-minute bars of a whole batch. Pass period= or start= (epoch seconds) through **range_kwargs.
+def download_intraday(symbols, **range_kwargs):
+    with DOWNLOAD_LOCK:
+        return FETCH_SCHEDULER.timed('bars x' + str(len(symbols)), YAHOO_CLIENT.download, symbols, interval="1m",
+                                     group_by='ticker', auto_adjust=False, ignore_tz=False, progress=False, threads=True,
+                                     **range_kwargs)
+
+
+def download_regular_session_closes(symbols, sessions):
+    closes = field_frame(download_intraday(symbols, period="2d"), 'Close', symbols)
+    return {symbol: close for symbol, (close, _) in regular_session_closes(closes, sessions).items() if close is not None}
+
+
+# Incremental intraday bar store ---------------------------------------------------------------------------------------
+# Keeps the 1-minute bars already downloaded for each symbol in the state database, so each refresh only asks Yahoo for bars newer than the last one stored instead of two full days. Once a newer session shows up, the regular-session close of each older session is written to session_closes for good and its bars are dropped.
+STATE_DB_SCHEMA.extend([
+    '''CREATE TABLE IF NOT EXISTS intraday_bars (
+        symbol TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        close REAL NOT NULL,
+        volume REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (symbol, ts)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS session_closes (
+        symbol TEXT NOT NULL,
+        session_date TEXT NOT NULL,
+        close REAL NOT NULL,
+        PRIMARY KEY (symbol, session_date)
+    ) WITHOUT ROWID''',
+])
+
+
+class IntradayBarStore:
+    # Stored bars older than this are too stale to extend incrementally; the symbol is downloaded from scratch
+    MAX_GAP_SECONDS = 4 * 24 * 3600
+
+    def __init__(self, conn, lock=None):
+        self.conn = conn
+        self.lock = lock or threading.RLock() # fetch batches update the store from worker threads
+
+    def last_timestamps(self, symbols):
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol, MAX(ts) FROM intraday_bars WHERE symbol IN (%s) GROUP BY symbol'
+                                     % ','.join('?' * len(symbols)), list(symbols)).fetchall()
+        return {symbol: ts for symbol, ts in rows if ts is not None}
+
+    # Download only what's missing: symbols with no (or stale) bars get the usual two days, the rest only bars from their last stored one on. The last stored bar is requested again because it may have been an unfinished minute.
+    def update(self, symbols):
+        symbols = list(symbols)
+        if not symbols:
+            return
+        last = self.last_timestamps(symbols)
+        now = time.time()
+        known = [symbol for symbol in symbols if symbol in last and now - last[symbol] < self.MAX_GAP_SECONDS]
+        unknown = [symbol for symbol in symbols if symbol not in known]
+        METRICS.count('bars: full 2 days', len(unknown))
+        METRICS.count('bars: new only', len(known))
+        if unknown:
+            self.store(download_intraday(unknown, period="2d"), unknown)
+        if known:
+            self.store(download_intraday(known, start=int(min(last[symbol] for symbol in known))), known)
+
+    def store(self, intraday, symbols):
+        import numpy as np
+        closes = field_frame(intraday, 'Close', symbols)
+        if closes is None or closes.empty:
+            return
+        volumes = field_frame(intraday, 'Volume', list(closes.columns)).reindex(columns=closes.columns)
+        ts = epoch_seconds(closes.index)
+        values = closes.to_numpy(dtype=float)
+        volume_values = np.nan_to_num(volumes.to_numpy(dtype=float))
+        rows_idx, cols_idx = np.nonzero(~np.isnan(values))
+        rows = [(closes.columns[c], int(ts[r]), float(values[r, c]), float(volume_values[r, c])) for r, c in zip(rows_idx, cols_idx)]
+        if rows:
+            with self.lock:
+                self.conn.executemany('INSERT OR REPLACE INTO intraday_bars (symbol, ts, close, volume) VALUES (?, ?, ?, ?)', rows)
+                self.conn.commit()
+
+    # Wide frame of stored closes, one column per symbol, UTC index
+    def close_frame(self, symbols):
+        import pandas as pd
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol, ts, close FROM intraday_bars WHERE symbol IN (%s)'
+                                     % ','.join('?' * len(symbols)), list(symbols)).fetchall()
+        if not rows:
+            return None
+        frame = pd.DataFrame(rows, columns=['symbol', 'ts', 'close']).pivot(index='ts', columns='symbol', values='close').sort_index()
+        frame.index = pd.to_datetime(frame.index, unit='s', utc=True)
+        return frame
+
+    # Regular-session close of the latest stored session for every symbol, computed in one vectorized pass. Older sessions still in the store are finalized into session_closes on the way and their bars pruned. Symbols with nothing usable stored fall back to their last recorded session close.
+    def regular_session_closes(self, symbols, sessions):
+        symbols = list(symbols)
+        frame = self.close_frame(symbols)
+        latest = regular_session_closes(frame, sessions)
+        before = {symbol: day for symbol, (_, day) in latest.items()}
+        finished = []
+        while before:
+            # only the symbols still being walked back; one without a cutoff would have all its bars counted again
+            earlier = regular_session_closes(frame[list(before)], sessions, before)
+            finished.extend((symbol, epoch_day_to_iso(day), close) for symbol, (close, day) in earlier.items() if close is not None)
+            before = {symbol: day for symbol, (_, day) in earlier.items()}
+        with self.lock:
+            if finished:
+                self.conn.executemany('INSERT OR IGNORE INTO session_closes (symbol, session_date, close) VALUES (?, ?, ?)', finished)
+            # no session lasts a day, so anything over 24h older than a symbol's newest bar is summarized above already
+            self.conn.execute('DELETE FROM intraday_bars WHERE symbol IN (%s) AND ts < (SELECT MAX(b.ts) FROM intraday_bars b WHERE b.symbol = intraday_bars.symbol) - 86400'
+                              % ','.join('?' * len(symbols)), symbols)
+            self.conn.commit()
+        closes = {}
+        for symbol in symbols:
+            close = latest.get(symbol, (None,))[0]
+            closes[symbol] = close if close is not None else self.last_session_close(symbol)
+        return closes
+
+    def last_session_close(self, symbol):
+        with self.lock:
+            row = self.conn.execute('SELECT close FROM session_closes WHERE symbol = ? ORDER BY session_date DESC LIMIT 1', (symbol,)).fetchone()
+        return row[0] if row else None
+
+
+def epoch_day_to_iso(day):
+    return (date(1970, 1, 1) + timedelta(days=day)).isoformat()
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Technical indicators -------------------------------------------------------------------------------------------------
+# Streaming indicators over each symbol's stored 1-minute bars: ROC with ROC bands, EMA and SMA fans, Bollinger Bands and a volume-at-price (VAP) compression score. Each symbol's rolling state is kept in indicator_state as JSON: the EMAs, the windows of recent closes, ROC values and (price bin, volume) pairs. Each new finished bar advances it in O(1) (EMAs update in place, windows add one value and drop the oldest, with running sums), so a refresh only costs the bars that arrived since the last one, never the whole history. The newest stored bar may be an unfinished minute that is downloaded again next time, so it's left for the next update. A symbol seen for the first time is warmed up on its latest INDICATOR_WARMUP_BARS bars.
+# The VAP score is the share of the VAP window's volume traded in its busiest band of prices VAP_BAND_PERCENT wide: 100 when the window traded flat or coiled within the band, low when volume is spread over a range many bands wide. It doesn't depend on how wide the window's range is, so one stray print far from the coil barely moves it.
+STATE_DB_SCHEMA.append('''CREATE TABLE IF NOT EXISTS indicator_state (
+        symbol TEXT PRIMARY KEY,
+        last_ts INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        snapshot TEXT NOT NULL
+    )''')
+INDICATOR_WARMUP_BARS = 600
+VAP_BAND_PERCENT = 0.5
+
+
+# Fixed-size window of the latest values with their running sum and sum of squares. The sums are recomputed exactly whenever a window is loaded, so float drift can't build up across refreshes.
+class RollingWindow:
+    __slots__ = ('values', 'total', 'squares')
+
+    def __init__(self, size, values=()):
+        self.values = deque(values, maxlen=size)
+        self.total = math.fsum(self.values)
+        self.squares = math.fsum(value * value for value in self.values)
+
+    def push(self, value):
+        if len(self.values) == self.values.maxlen:
+            oldest = self.values[0]
+            self.total -= oldest
+            self.squares -= oldest * oldest
+        self.values.append(value)
+        self.total += value
+        self.squares += value * value
+
+    @property
+    def full(self):
+        return len(self.values) == self.values.maxlen
+
+    def mean(self):
+        return self.total / len(self.values)
+
+    # mean -/+ deviations standard deviations
+    def bands(self, deviations):
+        mean = self.mean()
+        spread = deviations * math.sqrt(max(self.squares / len(self.values) - mean * mean, 0))
+        return mean - spread, mean + spread
+
+
+class IndicatorState:
+    def __init__(self, state=None):
+        state = state or {}
+        ema = state.get('ema') or []
+        self.ema = ema if len(ema) == len(INDICATOR_EMA_PERIODS) else [None] * len(INDICATOR_EMA_PERIODS)
+        sma = state.get('sma') or []
+        self.sma = [RollingWindow(period, sma[n] if n < len(sma) else ()) for n, period in enumerate(INDICATOR_SMA_PERIODS)]
+        self.bollinger = RollingWindow(INDICATOR_BOLLINGER[0], state.get('bollinger', ()))
+        self.roc_closes = deque(state.get('roc_closes', ()), maxlen=INDICATOR_ROC[0] + 1)
+        self.rocs = RollingWindow(INDICATOR_ROC[1], state.get('rocs', ()))
+        self.vap = deque(state.get('vap', ()), maxlen=INDICATOR_VAP[0]) # (price bin, volume) per bar
+        self.vap_volume = {}
+        for price_bin, volume in self.vap:
+            self.vap_volume[price_bin] = self.vap_volume.get(price_bin, 0) + volume
+
+    def to_dict(self):
+        return {'ema': self.ema, 'sma': [list(window.values) for window in self.sma], 'bollinger': list(self.bollinger.values),
+                'roc_closes': list(self.roc_closes), 'rocs': list(self.rocs.values), 'vap': [list(pair) for pair in self.vap]}
+
+    # Fold one finished bar into every indicator
+    def push(self, close, volume):
+        for n, period in enumerate(INDICATOR_EMA_PERIODS):
+            previous = self.ema[n]
+            self.ema[n] = close if previous is None else previous + (close - previous) * 2 / (period + 1)
+        for window in self.sma:
+            window.push(close)
+        self.bollinger.push(close)
+        self.roc_closes.append(close)
+        if len(self.roc_closes) == self.roc_closes.maxlen and self.roc_closes[0] > 0:
+            self.rocs.push((close / self.roc_closes[0] - 1) * 100)
+        if len(self.vap) == self.vap.maxlen:
+            old_bin, old_volume = self.vap[0]
+            self.vap_volume[old_bin] -= old_volume
+            if self.vap_volume[old_bin] <= 0:
+                del self.vap_volume[old_bin]
+        price_bin = math.floor(math.log(close) / math.log1p(INDICATOR_VAP[1] / 100)) if close > 0 else 0
+        self.vap.append((price_bin, volume))
+        if volume > 0:
+            self.vap_volume[price_bin] = self.vap_volume.get(price_bin, 0) + volume
+
+    # The indicator values, None where a window isn't full yet. Fans are 1 when the shorter averages are all above the longer ones, -1 when all below, 0 otherwise.
+    def snapshot(self):
+        ema = self.ema if None not in self.ema else None
+        sma = [window.mean() for window in self.sma] if all(window.full for window in self.sma) else None
+        return {
+            'roc': self.rocs.values[-1] if self.rocs.full else None,
+            'roc_bands': self.rocs.bands(INDICATOR_ROC[2]) if self.rocs.full else None,
+            'ema': ema,
+            'ema_fan': fan_direction(ema),
+            'sma': sma,
+            'sma_fan': fan_direction(sma),
+            'bollinger': self.bollinger.bands(INDICATOR_BOLLINGER[1]) if self.bollinger.full else None,
+            'vap': self.vap_compression() if len(self.vap) == self.vap.maxlen else None,
+        }
+
+    # Slides a band of adjacent price bins over the occupied ones, in order, keeping the busiest band's volume
+    def vap_compression(self):
+        total = sum(self.vap_volume.values())
+        if not total:
+            return None
+        width = max(1, round(VAP_BAND_PERCENT / INDICATOR_VAP[1]))
+        bins = sorted(self.vap_volume)
+        held = busiest = 0
+        first = 0
+        for price_bin in bins:
+            held += self.vap_volume[price_bin]
+            while price_bin - bins[first] >= width:
+                held -= self.vap_volume[bins[first]]
+                first += 1
+            busiest = max(busiest, held)
+        return 100 * busiest / total
+
+
+# Moving averages listed by increasing period -> 1, -1 or 0 (see IndicatorState.snapshot)
+def fan_direction(averages):
+    if not averages or len(averages) < 2:
+        return 0
+    pairs = list(zip(averages, averages[1:]))
+    if all(short > long for short, long in pairs):
+        return 1
+    if all(short < long for short, long in pairs):
+        return -1
+    return 0
+
+
+# Indicator state of every symbol, advanced from the IntradayBarStore's bars in the same database
+class IndicatorStore:
+    def __init__(self, conn, lock=None):
+        self.conn = conn
+        self.lock = lock or threading.RLock() # the connection is shared with the fetch workers
+
+    # Fold every finished bar stored since each symbol's last update
+    def update(self, symbols):
+        symbols = list(symbols)
+        if not symbols:
+            return
+        with self.lock:
+            known = {symbol: (last_ts, state) for symbol, last_ts, state in self.conn.execute(
+                'SELECT symbol, last_ts, state FROM indicator_state WHERE symbol IN (%s)' % ','.join('?' * len(symbols)), symbols)}
+            bars = {symbol: self.conn.execute('SELECT ts, close, volume FROM intraday_bars WHERE symbol = ? AND ts > ? ORDER BY ts',
+                                              (symbol, known[symbol][0] if symbol in known else 0)).fetchall()[:-1]
+                    for symbol in symbols}
+        rows = []
+        for symbol, new_bars in bars.items():
+            if symbol not in known:
+                new_bars = new_bars[-INDICATOR_WARMUP_BARS:]
+            if not new_bars:
+                continue
+            state = IndicatorState(json.loads(known[symbol][1]) if symbol in known else None)
+            for _, close, volume in new_bars:
+                state.push(close, volume)
+            rows.append((symbol, new_bars[-1][0], json.dumps(state.to_dict()), json.dumps(state.snapshot())))
+        METRICS.count('indicator bars', sum(len(new_bars) for new_bars in bars.values()))
+        if rows:
+            with self.lock:
+                self.conn.executemany('INSERT OR REPLACE INTO indicator_state (symbol, last_ts, state, snapshot) VALUES (?, ?, ?, ?)', rows)
+                self.conn.commit()
+
+    # {symbol: snapshot dict} for the symbols that have indicator state
+    def snapshots(self, symbols):
+        symbols = list(symbols)
+        if not symbols:
+            return {}
+        with self.lock:
+            rows = self.conn.execute('SELECT symbol, snapshot FROM indicator_state WHERE symbol IN (%s)'
+                                     % ','.join('?' * len(symbols)), symbols).fetchall()
+        return {symbol: json.loads(snapshot) for symbol, snapshot in rows}
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Quotes and regular-session closes for one batch of symbols: {symbol: Quote} for every symbol the bulk endpoints returned. With a bar store, only new bars are downloaded. Raises if the quote request itself keeps failing.
+def fetch_stock_data_batch(batch, state=None):
+    with METRICS.phase('quote requests'):
+        infos = fetch_quote_batch(batch, state.meta if state else None)
+    sessions = {symbol: session_spec(info) for symbol, info in infos.items()}
+    try:
+        with METRICS.phase('bar downloads'):
+            if not infos:
+                closes = {}
+            elif state is None:
+                closes = download_regular_session_closes(list(infos), sessions)
+            else:
+                state.bars.update(infos)
+                closes = state.bars.regular_session_closes(infos, sessions)
+    except Exception:
+        closes = {}
+    stock_data = {}
+    for symbol, info in infos.items():
+        # no regular-session bars (e.g. ^VIX premarket): the quote's own regularMarketPrice saves the extra daily history() call
+        regular_market_price = closes.get(symbol) or info.get('regularMarketPrice') or 0
+        stock_data[symbol] = Quote.from_info(symbol, info, regular_market_price)
+    return stock_data
+
+
+# Fetch every symbol in as few requests as possible. Returns {symbol: Quote} in the order given. With a LocalState, symbols with a fresh cached quote skip the network entirely and intraday bars are fetched incrementally. Batches run concurrently on FETCH_SCHEDULER; symbols the bulk endpoints don't know about fall back to get_fallback_stock_data(), also concurrently. Full .info is only fetched in debug mode.
+# Failures never stop the menu: a symbol that can't be fetched gets its last known quote, marked stale, or is left out of the result if there is none. A bulk request that fails outright is most likely throttling, so its symbols aren't retried one by one and don't count against their circuit breakers.
+def get_stock_data_batch(symbols, state=None):
+    symbols = list(dict.fromkeys(symbols))
+    cache = state.quotes if state else None
+    with METRICS.phase('quote cache'):
+        fetched = cache.get_fresh(symbols) if cache else {}
+        # Symbols the streaming feed keeps current only need polling now and then, for the fields it doesn't carry
+        streamed = state.stream.live_symbols([symbol for symbol in symbols if symbol not in fetched]) if cache and state.stream else []
+        if streamed:
+            fetched.update(cache.get_fresh(streamed, max_age=STREAMING_POLL_SECONDS))
+    to_fetch = [symbol for symbol in symbols if symbol not in fetched]
+    cooling_down = state.breaker.open_symbols(to_fetch) if state and to_fetch else set()
+    to_fetch = [symbol for symbol in to_fetch if symbol not in cooling_down]
+    if cache:
+        METRICS.count('quote cache hits', len(fetched))
+        METRICS.count('quote cache misses', len(symbols) - len(fetched))
+    METRICS.count('circuit breaker skips', len(cooling_down))
+    unreachable = list(cooling_down)
+    new_data = {}
+
+    def fetch_batch(batch):
+        try:
+            return batch, fetch_stock_data_batch(batch, state)
+        except Exception:
+            return batch, None
+
+    for batch, batch_data in FETCH_SCHEDULER.map(fetch_batch, chunked(to_fetch, QUOTE_BATCH_SIZE)):
+        if batch_data is None:
+            unreachable.extend(batch)
+            METRICS.count('failed batches')
+        else:
+            new_data.update(batch_data)
+
+    def fetch_fallback(symbol):
+        try:
+            return get_fallback_stock_data(symbol, state)
+        except Exception as e:
+            return str(e) or type(e).__name__
+
+    missing = [symbol for symbol in to_fetch if symbol not in new_data and symbol not in unreachable]
+    failed = {}
+    results = []
+    if missing:
+        with METRICS.phase('fallback fetches'):
+            results = FETCH_SCHEDULER.map(fetch_fallback, missing)
+    for symbol, result in zip(missing, results):
+        if isinstance(result, Quote):
+            new_data[symbol] = result
+        else:
+            failed[symbol] = result
+    METRICS.count('fallback fetches', len(missing))
+    METRICS.count('failed symbols', len(failed))
+    # Advance the indicators once, over every symbol whose bars were just updated. A failure is recorded rather than raised: the quotes are still good, only the indicator limits miss this refresh.
+    if state and new_data:
+        try:
+            with METRICS.phase('indicators'):
+                state.indicators.update(new_data)
+        except (sqlite3.Error, ValueError, KeyError, TypeError) as e:
+            METRICS.error('indicator failures', e)
+    debug_symbols = [symbol for symbol in new_data if debug_enabled_for(symbol)]
+    if debug_symbols:
+        with METRICS.phase('full info'):
+            for symbol, info in zip(debug_symbols, FETCH_SCHEDULER.map(fetch_full_info, debug_symbols)):
+                new_data[symbol].raw_data = info
+    if state:
+        with METRICS.phase('quote cache'):
+            if new_data:
+                state.last_quotes.put(new_data)
+            state.breaker.record(new_data, failed)
+            stale = state.last_quotes.get_last(unreachable + list(failed))
+        METRICS.count('stale quotes shown', len(stale))
+        fetched.update(stale)
+    fetched.update(new_data)
+    fetched = {symbol: fetched[symbol] for symbol in symbols if symbol in fetched}
+    if state and state.stream:
+        fetched = state.stream.apply(fetched)
+    return fetched
+
+
+# Per-run registry of every symbol the menu needs. Symbols listed in several categories (or also in INDICES_DICT) are registered once, fetched once by fetch(), and every category reads the same result.
+class SymbolRegistry:
+    def __init__(self, watchlist=None, state=None):
+        self.categories = {} # symbol -> categories it appears in, in watchlist order
+        self.data = {} # symbol -> Quote, filled by fetch()
+        self.indicators = {} # symbol -> indicator snapshot, filled by fetch() when there's a LocalState
+        self.state = state # optional LocalState
+        for category, symdict in (watchlist or {}).items():
+            for symbol in symdict:
+                self.add(symbol, category)
+
+    def add(self, symbol, category=None):
+        categories = self.categories.setdefault(symbol, [])
+        if category is not None and category not in categories:
+            categories.append(category)
+
+    @property
+    def symbols(self):
+        return list(self.categories)
+
+    # Fetch everything not fetched yet in one get_stock_data_batch() call
+    def fetch(self):
+        missing = [symbol for symbol in self.categories if symbol not in self.data]
+        if missing:
+            self.data.update(get_stock_data_batch(missing, self.state))
+        if self.state:
+            self.indicators = self.state.indicators.snapshots(self.data)
+        return self.data
+
+    def __getitem__(self, symbol):
+        return self.data[symbol]
+
+    # False for a symbol that couldn't be fetched and has no last known quote either
+    def __contains__(self, symbol):
+        return symbol in self.data
+
+
+# Price limit engine ---------------------------------------------------------------------------------------------------
+# Every limit is loaded into NumPy arrays (symbol index, threshold, rule type, last seen side, high-water mark) and all of them are checked against the vector of current prices in one pass. Rule types:
+#   BUY    price below the limit (one-shot: removed when it triggers)
+#   SELL   price above the limit (one-shot)
+#   PCT    move from the previous close of at least this many percent, e.g. 5 for up 5% or -3 for down 3% (one-shot)
+#   CROSS  price crosses the level, either way. Stays set and alerts on every crossing, but the price has to get LIMIT_CROSS_HYSTERESIS percent past the level to count, so hovering at it doesn't re-alert. The first check only notes which side the price is on.
+#   TRAIL  trailing stop: price falls this many percent below the highest price seen since the limit was set (one-shot)
+# and on the technical indicators (see IndicatorState), all one-shot. For FAN, BAND and ROC the limit is a direction, 1 for up or -1 for down:
+#   FAN    the EMA fan opens that way: every shorter EMA above (1) or below (-1) the longer ones
+#   BAND   price above the upper (1) or below the lower (-1) Bollinger Band
+#   ROC    ROC above its upper (1) or below its lower (-1) band
+#   VAP    volume-at-price compression score of at least the limit (above 0, up to 100)
+LIMIT_TYPES = ('BUY', 'SELL', 'PCT', 'CROSS', 'TRAIL', 'FAN', 'BAND', 'ROC', 'VAP')
+ONE_SHOT_LIMIT_TYPES = ('BUY', 'SELL', 'PCT', 'TRAIL', 'FAN', 'BAND', 'ROC', 'VAP')
+DIRECTION_LIMIT_TYPES = ('FAN', 'BAND', 'ROC')
+LIMIT_TYPE_CODES = {limit_type: code for code, limit_type in enumerate(LIMIT_TYPES)}
+# Values each limit type accepts when set from the menu: (pattern, range check, description for the error dialog). Prices can have no leading digit or 4 decimals, for penny stocks, but need at least one digit. Zero is out for every type: a BUY, SELL or CROSS at 0 and a PCT of 0 would never trigger, and a TRAIL or VAP of 0 would trigger on its first check.
+LIMIT_DECIMAL = r'(\d+(\.\d{1,4})?|\.\d{1,4})'
+LIMIT_VALUES = {
+    'BUY': (LIMIT_DECIMAL, lambda value: value > 0, 'prices above 0 with up to 4 decimals, e.g. 25.70'),
+    'SELL': (LIMIT_DECIMAL, lambda value: value > 0, 'prices above 0 with up to 4 decimals, e.g. 25.70'),
+    'CROSS': (LIMIT_DECIMAL, lambda value: value > 0, 'prices above 0 with up to 4 decimals, e.g. 25.70'),
+    'PCT': ('-?' + LIMIT_DECIMAL, lambda value: value != 0, 'moves in percent other than 0, e.g. 5 for up 5% or -3 for down 3%'),
+    'TRAIL': (LIMIT_DECIMAL, lambda value: 0 < value < 100, 'percentages above 0 and below 100, e.g. 7.5'),
+    'FAN': ('-?1', lambda value: True, '1 for up or -1 for down'),
+    'BAND': ('-?1', lambda value: True, '1 for up or -1 for down'),
+    'ROC': ('-?1', lambda value: True, '1 for up or -1 for down'),
+    'VAP': (LIMIT_DECIMAL, lambda value: 0 < value <= 100, 'scores above 0 up to 100, e.g. 80'),
+}
+
+
+# The error message for a limit value the limit type doesn't accept, or None if it's valid
+def limit_value_error(limit_type, value):
+    pattern, in_range, description = LIMIT_VALUES[limit_type]
+    if re.fullmatch(pattern, value) and in_range(float(value)):
+        return None
+    return 'You entered an invalid value: ' + value + ' - valid ' + limit_type + ' values are ' + description + '!'
+
+
+class LimitEngine:
+    def __init__(self, rules):
+        import numpy as np
+        self.rules = rules
+        self.symbols = list(dict.fromkeys(symbol for _, symbol, _, _, _ in rules))
+        index = {symbol: n for n, symbol in enumerate(self.symbols)}
+        self.symbol_index = np.array([index[symbol] for _, symbol, _, _, _ in rules], dtype=np.intp)
+        self.kind = np.array([LIMIT_TYPE_CODES[limit_type] for limit_type, _, _, _, _ in rules], dtype=np.int8)
+        self.threshold = np.array([float(price) for _, _, price, _, _ in rules])
+        self.side = np.array([side or 0 for _, _, _, side, _ in rules], dtype=np.int8)
+        self.high_water = np.array([np.nan if high_water is None else high_water for _, _, _, _, high_water in rules])
+
+    # One pass over every rule. quotes maps symbol -> Quote; symbols missing from it (not fetched, or stale) are skipped. indicators maps symbol -> indicator snapshot; indicator rules of symbols without one don't trigger. Returns (triggered mask, new side, new high-water mark, price per rule).
+    def evaluate(self, quotes, indicators=None):
+        import numpy as np
+        prices = np.array([quotes[symbol].current_price if symbol in quotes else np.nan for symbol in self.symbols], dtype=float)
+        previous_closes = np.array([quotes[symbol].regular_market_previous_close if symbol in quotes else np.nan
+                                    for symbol in self.symbols], dtype=float)
+        snapshots = [(indicators or {}).get(symbol) or {} for symbol in self.symbols]
+        ema_fans = np.array([snapshot.get('ema_fan') or 0 for snapshot in snapshots], dtype=np.int8)
+        bollinger = np.array([snapshot.get('bollinger') or (np.nan, np.nan) for snapshot in snapshots], dtype=float).reshape(-1, 2)
+        roc_sides = np.array([band_side(snapshot.get('roc'), snapshot.get('roc_bands')) for snapshot in snapshots], dtype=np.int8)
+        vap_scores = np.array([np.nan if snapshot.get('vap') is None else snapshot['vap'] for snapshot in snapshots], dtype=float)
+        price = prices[self.symbol_index]
+        previous_close = previous_closes[self.symbol_index]
+        kind, threshold = self.kind, self.threshold
+        direction = np.sign(threshold)
+        seen = ~np.isnan(price)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = np.where(previous_close > 0, (price / previous_close - 1) * 100, np.nan)
+            band = np.abs(threshold) * LIMIT_CROSS_HYSTERESIS / 100
+            side = np.where(price > threshold + band, 1, np.where(price < threshold - band, -1, self.side)).astype(np.int8)
+            side = np.where(seen & (kind == LIMIT_TYPE_CODES['CROSS']), side, self.side)
+            high_water = np.where(seen & (kind == LIMIT_TYPE_CODES['TRAIL']), np.fmax(self.high_water, price), self.high_water)
+            lower, upper = bollinger[self.symbol_index, 0], bollinger[self.symbol_index, 1]
+            bollinger_side = np.where(price > upper, 1, np.where(price < lower, -1, 0))
+
+            triggered = (
+                ((kind == LIMIT_TYPE_CODES['BUY']) & (price < threshold)) |
+                ((kind == LIMIT_TYPE_CODES['SELL']) & (price > threshold)) |
+                ((kind == LIMIT_TYPE_CODES['PCT']) & (((threshold > 0) & (change >= threshold)) | ((threshold < 0) & (change <= threshold)))) |
+                ((kind == LIMIT_TYPE_CODES['CROSS']) & (self.side != 0) & (side != self.side)) |
+                ((kind == LIMIT_TYPE_CODES['TRAIL']) & (price <= high_water * (1 - threshold / 100))) |
+                ((kind == LIMIT_TYPE_CODES['FAN']) & (ema_fans[self.symbol_index] == direction)) |
+                ((kind == LIMIT_TYPE_CODES['BAND']) & (bollinger_side == direction)) |
+                ((kind == LIMIT_TYPE_CODES['ROC']) & (roc_sides[self.symbol_index] == direction)) |
+                ((kind == LIMIT_TYPE_CODES['VAP']) & (vap_scores[self.symbol_index] >= threshold))
+            ) & seen
+        return triggered, side, high_water, price
+
+
+# 1 if value is above the upper of bands (lower, upper), -1 if below the lower, 0 if between or either is missing
+def band_side(value, bands):
+    if value is None or not bands:
+        return 0
+    return 1 if value > bands[1] else -1 if value < bands[0] else 0
+
+
+# Alert subtitle of a triggered rule; alerts with the same subtitle within ALERT_DEDUP_SECONDS are only shown once
+def limit_alert_subtitle(limit_type, price, side, high_water):
+    if limit_type == 'PCT':
+        return 'PCT Limit: ' + ('+' if float(price) > 0 else '') + str(float(price)) + '%'
+    if limit_type == 'CROSS':
+        return 'CROSS Limit: ' + str(float(price)) + (' (up)' if side > 0 else ' (down)')
+    if limit_type == 'TRAIL':
+        return 'TRAIL Limit: ' + str(float(price)) + '% below ' + PRICE_FORMAT(high_water)
+    if limit_type in DIRECTION_LIMIT_TYPES:
+        return limit_type + ' Limit: ' + ('up' if float(price) > 0 else 'down')
+    return limit_type + ' Limit: ' + str(float(price))
+
+
+# Check every price limit against the registry's fresh quotes (stale quotes never trigger) and indicator snapshots. One-shot limits that trigger are removed, CROSS and TRAIL state is saved, and alerts are queued; returns True if any were.
+def check_price_limits(registry, limits, alerts):
+    import numpy as np
+    rules = limits.rules()
+    if not rules:
+        return False
+    engine = LimitEngine(rules)
+    quotes = {symbol: registry[symbol] for symbol in engine.symbols
+              if symbol in registry and registry[symbol].stale_since is None}
+    if not quotes:
+        return False
+    triggered, side, high_water, price = engine.evaluate(quotes, registry.indicators)
+
+    # Only rules whose side or high-water mark moved are written back
+    changed = (side != engine.side) | ~(np.isnan(high_water) | (high_water == engine.high_water))
+    limits.save_state([(rules[n][1], rules[n][0], rules[n][2], int(side[n]), None if np.isnan(high_water[n]) else float(high_water[n]))
+                       for n in changed.nonzero()[0]])
+
+    queued = False
+    for n in triggered.nonzero()[0]:
+        limit_type, symbol, limit_price, _, _ = rules[n]
+        # remove() is atomic, so a limit triggered by two runs at once only alerts once
+        if limit_type in ONE_SHOT_LIMIT_TYPES and not limits.remove(limit_type, symbol, limit_price):
+            continue
+        queued = alerts.put(symbol, 'Price Alarm', limit_alert_subtitle(limit_type, limit_price, side[n], high_water[n]),
+                            symbol + ' current price is: ' + str(float(price[n]))) or queued
+    return queued
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+def index_line(s, name):
 #restored from older version as of v2.0; I've made turning it on or off it a user option
-    market_state = index['price']['marketState']
-    effective_market_state = get_eff_market_state(market_state)
+    market_state = s.market_state
+    effective_market_state = s.session
     #NOTE: yfinance sometimes returns PREPRE and POSTPOST sessions, but no dedicated info for these sessions. effective_market_state ensures anything but PRE, POST, or REGULAR is handled as CLOSED.
     off_name = SESSION_INFO.get(effective_market_state, {}).get('offHoursPriceName') 
-    change = index['price']['regularMarketChangePercent']['raw']
-    raw_price = (
-        s.get('price', {})
-         .get(off_name, {})
-         .get('raw')
-    ) #get() allows nonexistent keys, not every session has s['price'][SESSION_INFO[market_state]['offHoursPriceName']]['raw'], which is how raw_price would be looked up if those keys never failed
+    change = s.regular_market_change_percent
+    raw_price = getattr(s, off_name) if off_name else None #not every session has an off-hours price
 
     color=''
     
@@ -513,20 +2391,20 @@ def print_index(s, name):
             color = SESSION_INFO[effective_market_state]['noArrow']
         # Format change to decimal with a precision of two and reset ansi color at the end
         change_in_percent = '(' + \
-            s['price'][SESSION_INFO[effective_market_state]['chgPctKeyName']]['fmt'] + ')'
+            s.fmt(SESSION_INFO[effective_market_state]['chgPctKeyName']) + ')'
         colored_change = SESSION_INFO[effective_market_state]['icon'] + ' ' + color + change_in_percent + ANSI_RESET
     else: #market_state == 'CLOSED':
         # Set change with a moon emoji for closed markets
         colored_change = ICON_SESSION_CLOSED + \
-            '(' + index['price'][SESSION_INFO[effective_market_state]['chgPctKeyName']]['fmt'] + ') '
+            '(' + s.fmt(SESSION_INFO[effective_market_state]['chgPctKeyName']) + ') '
 
-    # Print the index info only to the menu bar
-    print(name, colored_change, '| dropdown=false', sep=' ')
+    # The index info only goes to the menu bar
+    return name + ' ' + colored_change + ' | dropdown=false'
 
 
 # Custom indenting to print debug info if desired
 
-def dashed_json_no_brackets(
+def dashed_json_lines(
     obj,
     base="------",
     step="--",
@@ -536,9 +2414,11 @@ def dashed_json_no_brackets(
     wrap_width=None,                 # e.g. 120 (None disables wrapping)
     long_value_on_next_line=False,   # if True and value length > wrap_width, put value on next line
     wrap_long_values_only=True,      # wrap only strings by default (not numbers/bools/null)
+    max_depth=None,                  # containers nested deeper than this are summarized, e.g. {...12 keys}
+    max_lines=None,                  # stop after this many lines, with a note saying so
 ):
     """
-    Dashed nesting per level with optional wrapping for long values.
+    Dashed nesting per level with optional wrapping for long values, yielded one line at a time.
 
     Structure:
     - Dict key lines:  <prefix>"key": <value>   OR   <prefix>"key":
@@ -550,6 +2430,9 @@ def dashed_json_no_brackets(
     - If wrap_width is not None, long scalar values can be wrapped.
     - If long_value_on_next_line is True, long values are printed starting on the next line
       at one additional nesting level (adds one extra `step`), and wrapped lines keep that level.
+
+    Caps:
+    - Lines are generated lazily, so with max_lines set the rest of a huge payload is never walked.
     """
 
     def is_listlike(x):
@@ -611,16 +2494,14 @@ def dashed_json_no_brackets(
             )
 
         return chunks if chunks else [""]
-        
-    lines = []
 
     def emit_wrapped_json_token(level: int, token: str):
         """Emit a pre-rendered JSON token, wrapped; all continuation lines keep the same level."""
         if wrap_width is None or len(token) <= wrap_width:
-            lines.append(p(level) + token)
+            yield p(level) + token
             return
         for chunk in wrap_text(token, wrap_width):
-            lines.append(p(level) + chunk)
+            yield p(level) + chunk
 
     def emit_key_value(k, v, level: int):
         # # suppress empty containers
@@ -633,8 +2514,8 @@ def dashed_json_no_brackets(
 
         # container values => submenu
         if isinstance(v, Mapping) or is_listlike(v):
-            lines.append(p(level) + f"{ktxt}:")
-            walk(v, level + 1)
+            yield p(level) + f"{ktxt}:"
+            yield from walk(v, level + 1)
             return
 
         # scalar value
@@ -642,71 +2523,210 @@ def dashed_json_no_brackets(
 
         if should_wrap_value(v) and long_value_on_next_line:
             # key line only, value starts on next line with extra indent level
-            lines.append(p(level) + f"{ktxt}:")
-            emit_wrapped_json_token(level + 1, vtok)
+            yield p(level) + f"{ktxt}:"
+            yield from emit_wrapped_json_token(level + 1, vtok)
         elif should_wrap_value(v):
             # keep key + first part on same line if possible by wrapping the *whole* "key: value" token
             # so every wrapped continuation line has the SAME prefix level
             whole = f"{ktxt}: {vtok}"
-            emit_wrapped_json_token(level, whole)
+            yield from emit_wrapped_json_token(level, whole)
         else:
-            lines.append(p(level) + f"{ktxt}: {vtok}")
+            yield p(level) + f"{ktxt}: {vtok}"
 
     def walk(x, level: int):
         # Scalars at root / list items
         if is_scalar(x):
-            emit_wrapped_json_token(level, jd(x))
+            yield from emit_wrapped_json_token(level, jd(x))
+            return
+
+        # Too deep: one summary line instead of the subtree
+        if max_depth is not None and level >= max_depth and (isinstance(x, Mapping) or is_listlike(x)):
+            if len(x):
+                yield p(level) + ("{...%d keys}" if isinstance(x, Mapping) else "[...%d items]") % len(x)
             return
 
         # Dict
         if isinstance(x, Mapping):
             if not x:
                 return
-            lines.append(p(level) + "{")
+            yield p(level) + "{"
             items = x.items()
             if sort_keys:
                 items = sorted(items, key=lambda kv: str(kv[0]))
             for k, v in items:
-                emit_key_value(k, v, level)
-            lines.append(p(level) + "}")    
+                yield from emit_key_value(k, v, level)
+            yield p(level) + "}"
             return
 
         # List
         if is_listlike(x):
             if len(x) == 0:
                 return
-            lines.append(p(level) + "[")    
+            yield p(level) + "["
             for i, item in enumerate(x):
-                lines.append(p(level) + f"[{i}]:")
-                walk(item, level + 1)
-            lines.append(p(level) + "]")
+                yield p(level) + f"[{i}]:"
+                yield from walk(item, level + 1)
+            yield p(level) + "]"
             return
 
         # Fallback (unexpected types)
-        emit_wrapped_json_token(level, jd(str(x)))
+        yield from emit_wrapped_json_token(level, jd(str(x)))
+
+    lines = walk(obj, 0)
+    if max_lines is None:
+        yield from lines
+        return
+    yield from islice(lines, max_lines)
+    if next(lines, None) is not None:
+        yield base + "... more not shown (DEBUG_MAX_LINES)"
+
+
+def dashed_json_no_brackets(obj, **options):
+    return "\n".join(dashed_json_lines(obj, **options))
+
+
+# Formatted debug trees, kept per (symbol, section) and keyed by the quote's fingerprint, so an unchanged quote (a cache hit, or a daemon refresh with no news) isn't reformatted. Like RENDER_CACHE, only the daemon keeps them; a one-shot run formats each tree once and has nothing to reuse.
+DEBUG_LINES_CACHE = {}
+
+
+def debug_enabled_for(symbol):
+    return OPTION_SHOW_DEBUG_SUBMENU and (not DEBUG_SYMBOLS or symbol in DEBUG_SYMBOLS)
+
+
+def cached_debug_lines(symbol, section, payload, fingerprint):
+    lines = dashed_json_lines(payload, wrap_width=60, long_value_on_next_line=True,
+                              max_depth=DEBUG_MAX_DEPTH, max_lines=DEBUG_MAX_LINES)
+    if not RENDER_CACHE.enabled:
+        return lines
+    cached = DEBUG_LINES_CACHE.get((symbol, section))
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    lines = list(lines)
+    DEBUG_LINES_CACHE[(symbol, section)] = (fingerprint, lines)
+    return lines
+
+
+# Rendered stock blocks -----------------------------------------------------------------------------------------------
+# The previous refresh's lines for each symbol, reused while its quote and note are unchanged, which between two refreshes is most symbols (quote cache hits, closed markets, quiet tickers). Blocks are keyed by symbol and note, so a symbol listed in several categories with the same note is also rendered once per refresh. Each category's sorted order (or TOP_MOVERS_COUNT pick) is kept too and reused while none of its sort keys changed, and so are the one-line entries of the "More…" submenus. Blocks and orders a refresh didn't use are dropped when its menu is done. Only the daemon keeps them across refreshes (RENDER_CACHE.enabled): a one-shot xbar run starts with nothing to reuse, so it skips the fingerprints and sort keys and only shares blocks within its own menu, dropping them all when it's done. With OPTION_SHOW_SPARKLINE, a block's fingerprint includes how many prices the symbol's history ring has had appended (PriceHistory.version), so a new price redraws the sparkline even when the quote fields look the same. Symbols with the debug submenu go through DEBUG_LINES_CACHE instead.
+STOCK_SORT_KEYS = {
+    'name': (lambda k: k.short_name, False),
+    'symbol': (lambda k: k.symbol, False),
+    'market_change_winners': (lambda k: k.regular_market_change_percent, True),
+    'market_change_losers': (lambda k: k.regular_market_change_percent, False),
+    'market_change_volatility': (lambda k: abs(k.regular_market_change_percent), True),
+}
+
+
+class RenderCache:
+    def __init__(self, enabled=False):
+        self.enabled = enabled # keep blocks and orders across refreshes, i.e. in the daemon
+        self.blocks = {} # (symbol, note) -> (quote fingerprint, lines)
+        self.orders = {} # category -> (sort keys in watchlist order, symbols in sorted order)
+        self.summaries = {} # (symbol, note) -> (quote fingerprint, dropdown line), for the "More…" submenus
+        self.used_blocks = set()
+        self.used_orders = set()
+        self.used_summaries = set()
+
+    def stock_lines(self, stock, category, indicators=None):
+        if debug_enabled_for(stock.symbol):
+            return stock_lines(stock, category, indicators)
+        key = (stock.symbol, watch_symbols[category][stock.symbol])
+        fingerprint = self.fingerprint(stock, indicators)
+        self.used_blocks.add(key)
+        cached = self.blocks.get(key)
+        if cached and cached[0] == fingerprint:
+            METRICS.count('blocks reused')
+            return cached[1]
+        lines = list(stock_lines(stock, category, indicators))
+        self.blocks[key] = (fingerprint, lines)
+        METRICS.count('blocks rendered')
+        return lines
+
+    # Everything a block's lines depend on besides the symbol and note. Within one run without the cache kept, a symbol's quote can't change, so there's nothing to compare.
+    def fingerprint(self, stock, indicators):
+        if not self.enabled:
+            return None
+        return (stock.fingerprint(), indicators if OPTION_SHOW_INDICATORS else None,
+                PRICE_HISTORY.version(stock.symbol) if OPTION_SHOW_SPARKLINE else None)
+
+    # stocks (in watchlist order) sorted by SORT_BY, the same as sorted() would, but only sorted again when a key changed
+    def sorted_stocks(self, category, stocks, sort_key, reverse):
+        if not self.enabled:
+            return sorted(stocks, key=sort_key, reverse=reverse)
+        keys = tuple((stock.symbol, sort_key(stock)) for stock in stocks)
+        self.used_orders.add(category)
+        cached = self.orders.get(category)
+        if cached and cached[0] == keys:
+            by_symbol = {stock.symbol: stock for stock in stocks}
+            return [by_symbol[symbol] for symbol in cached[1]]
+        stocks = sorted(stocks, key=sort_key, reverse=reverse)
+        self.orders[category] = (keys, [stock.symbol for stock in stocks])
+        return stocks
+
+    # The first count stocks by SORT_BY, picked with a heap in O(n log count) instead of sorting the whole category (same result and order as sorted()[:count]), or the first count in watchlist order without a sort key. The rest are returned too, in watchlist order. The pick is reused while no sort key changed.
+    def top_stocks(self, category, stocks, count, sort_key=None, reverse=False):
+        keys = (count,) + tuple((stock.symbol, sort_key(stock) if sort_key else None) for stock in stocks) if self.enabled else None
+        self.used_orders.add(category)
+        cached = self.orders.get(category) if self.enabled else None
+        if cached and cached[0] == keys:
+            top_symbols = cached[1]
+        else:
+            if sort_key is None:
+                top = stocks[:count]
+            else:
+                top = (heapq.nlargest if reverse else heapq.nsmallest)(count, stocks, key=sort_key)
+            top_symbols = [stock.symbol for stock in top]
+            self.orders[category] = (keys, top_symbols)
+        by_symbol = {stock.symbol: stock for stock in stocks}
+        shown = set(top_symbols)
+        return [by_symbol[symbol] for symbol in top_symbols], [stock for stock in stocks if stock.symbol not in shown]
+
+    # Just the dropdown line of a stock, for the "More…" submenu: only the first line of stock_lines() is generated, and it's reused like a block while the quote is unchanged
+    def stock_summary(self, stock, category, indicators=None):
+        key = (stock.symbol, watch_symbols[category][stock.symbol])
+        fingerprint = self.fingerprint(stock, indicators)
+        self.used_summaries.add(key)
+        cached = self.summaries.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        line = next(stock_lines(stock, category, indicators))
+        self.summaries[key] = (fingerprint, line)
+        return line
+
+    def finish(self):
+        if self.enabled:
+            self.blocks = {key: block for key, block in self.blocks.items() if key in self.used_blocks}
+            self.orders = {category: order for category, order in self.orders.items() if category in self.used_orders}
+            self.summaries = {key: summary for key, summary in self.summaries.items() if key in self.used_summaries}
+        else:
+            self.blocks = {}
+            self.orders = {}
+            self.summaries = {}
+        self.used_blocks = set()
+        self.used_orders = set()
+        self.used_summaries = set()
+
+
+RENDER_CACHE = RenderCache()
+
+# ---------------------------------------------------------------------------------------------------------------------
 
-    walk(obj, 0)
-    return "\n".join(lines)
 
 # Set effective market state
 def get_eff_market_state(market_state):
     this_state = market_state if market_state in ('PRE','REGULAR','POST') else 'CLOSED'
     return this_state
 
-# Print the stock info in the dropdown menu with additional info in the submenu
-def print_stock(s,category):
-    market_state = s['price']['marketState']
-    change = s['price']['regularMarketChangePercent']['raw']
+# Menu lines of the stock info in the dropdown menu with additional info in the submenu. indicators is the symbol's indicator snapshot, if it has one.
+def stock_lines(s,category,indicators=None):
+    market_state = s.market_state
+    change = s.regular_market_change_percent
 
     # Setting color and emojis depending on the market state and the market change
     # Now using dict with info for sessions rather than separate conditionals as in original
-    effective_market_state = get_eff_market_state(market_state)
+    effective_market_state = s.session
     off_name = SESSION_INFO.get(effective_market_state, {}).get('offHoursPriceName') 
-    raw_price = (
-        s.get('price', {})
-         .get(off_name, {})
-         .get('raw')
-    ) #get() allows nonexistent keys, not every session has s['price'][SESSION_INFO[market_state]['offHoursPriceName']]['raw'], which is how raw_price would be looked up if those keys never failed
+    raw_price = getattr(s, off_name) if off_name else None #not every session has an off-hours price
     color = ''
     #NOTE: yfinance sometimes returns PREPRE and POSTPOST sessions, but no dedicated info for these sessions. effective_market_state ensures anything but PRE, POST, or REGULAR is handled as CLOSED.
     
@@ -722,184 +2742,302 @@ def print_stock(s,category):
             color = SESSION_INFO[effective_market_state]['noArrow']
         # Format change to decimal with a precision of two and reset ansi color at the end
         change_in_percent = '(' + \
-            s['price'][SESSION_INFO[effective_market_state]['chgPctKeyName']]['fmt'] + ')'
+            s.fmt(SESSION_INFO[effective_market_state]['chgPctKeyName']) + ')'
         colored_change = SESSION_INFO[effective_market_state]['icon'] + ' ' + color + change_in_percent + ANSI_RESET
     else: #if market_state == 'CLOSED':
         market = SESSION_INFO[effective_market_state]['marketStateName']
         # Set change with a moon emoji for closed markets
         colored_change = SESSION_INFO[effective_market_state]['icon'] + ' ' + \
-            '(' + s['price'][SESSION_INFO[effective_market_state]['chgPctKeyName']]['fmt'] + ') '
+            '(' + s.fmt(SESSION_INFO[effective_market_state]['chgPctKeyName']) + ') '
     
 
+    if s.stale_since is not None:
+        colored_change += ' ' + ICON_STALE
+
     # Remove appending stock exchange symbol for foreign exchanges, e.g. Apple stock symbol in Frankfurt: APC.F -> APC
-    symbol = s['price']['symbol'].split('.')[0]
+    symbol = s.symbol.split('.')[0]
+    note = watch_symbols[category][s.symbol]
     # Convert epoch to human readable time HH:MM:SS
-    time = datetime.fromtimestamp(
-        s['price']['regularMarketTime']).strftime('%X')
-
-    regular_market_day_high = s['summaryDetail']['regularMarketDayHigh']['raw']
-    regular_market_day_low = s['summaryDetail']['regularMarketDayLow']['raw']
-    regular_market_day_range = regular_market_day_high - regular_market_day_low
-
-    fifty_two_week_high = s['summaryDetail']['fiftyTwoWeekHigh']['raw']
-    fifty_two_week_low = s['summaryDetail']['fiftyTwoWeekLow']['raw']
-    fifty_two_week_range = fifty_two_week_high - fifty_two_week_low
-
-    # Print the stockf seen in the dropdown menu
-    stock_info = '{:<5} {:>10} {:<10}' + ((' '+ICON_NOTES if watch_symbols[category][symbol][0] != "!" else ICON_ALERT) if watch_symbols[category][symbol] != '' else '') + FONT
-    print(stock_info.format(
-        symbol, s['price']['currentPrice']['fmt'], colored_change))
-    # Print additional stock info in the submenu
-    LDOTS="........................."
-    stock_submenu = '{:<20.20} {:<17}' + FONT
-    print('--' + s['price']['shortName'] + FONT)
-    print('--' + s['price']['longName'] +
-          ' - Currency in ' + s['price']['currency'] + FONT)
-    print('--' + time + ' - Market is ' + market + FONT)
-    print('-----')
-    print(stock_submenu.format('--Previous Close:'+LDOTS,
-          s['price']['regularMarketPreviousClose']['fmt']))
-    print(stock_submenu.format(
-        '--Open:'+LDOTS, s['price']['regularMarketOpen']['fmt']))
+    time = datetime.fromtimestamp(s.regular_market_time).strftime('%X')
+
+    regular_market_day_range = s.day_high - s.day_low
+    fifty_two_week_range = s.fifty_two_week_high - s.fifty_two_week_low
+
+    # The stock line seen in the dropdown menu
+    stock_line = STOCK_LINE_FORMATS[('alert' if note[0] == '!' else 'note') if note != '' else '']
+    yield stock_line(symbol, s.fmt('current_price'), colored_change)
+    # Additional stock info in the submenu
+    labels = STOCK_SUBMENU_LABELS
+    value = STOCK_SUBMENU_VALUE_FORMAT
+    if s.stale_since is not None:
+        yield '--' + ICON_STALE + " Couldn't refresh, showing the quote from " + datetime.fromtimestamp(s.stale_since).strftime('%Y-%m-%d %H:%M') + FONT
+    yield '--' + s.short_name + FONT
+    yield '--' + s.long_name + ' - Currency in ' + s.currency + FONT
+    yield '--' + time + ' - Market is ' + market + FONT
+    yield '-----'
+    yield labels['Previous Close'] + value(s.fmt('regular_market_previous_close'))
+    yield labels['Open'] + value(s.fmt('regular_market_open'))
     if market_state in ("POST","CLOSED","PRE"):
-        print(stock_submenu.format('--Regular Close:'+LDOTS, s['price']['regularMarketPrice']['fmt'] + \
-            ' (' + s['price']['regularMarketChangePercent']['fmt'] + ')'))
-    print(stock_submenu.format('--Bid:'+LDOTS, s['summaryDetail']['bid']['fmt']))
-    print(stock_submenu.format('--Ask:'+LDOTS, s['summaryDetail']['ask']['fmt']))
-    print(stock_submenu.format('--Day\'s Range:'+LDOTS,
-          '{:.2f}'.format(regular_market_day_range)))
-    print(stock_submenu.format('--52 Week Range:'+LDOTS,
-          '{:.2f}'.format(fifty_two_week_range)))
-    print('-----')
-    if watch_symbols[category][symbol] != '':
-        theNote = fill('--'+ICON_NOTES+' Notes: '+ watch_symbols[category][symbol],width=60,subsequent_indent="--")
-        print('\n'.join(line + FONT_SMALL for line in theNote.splitlines())) 
-        #only way to suffix every line created with fill()
-        print('-----')
-    if OPTION_SHOW_DEBUG_SUBMENU:
-        print('--DEBUG')
-        print(stock_submenu.format('----postMarketPrice',s['price']['postMarketPrice']['raw']))
-        print('----raw yfinance info')
-        print(dashed_json_no_brackets(s['rawData'],wrap_width=60, long_value_on_next_line=True))
-        print('----script variables')
-        slocal = { 'price':s['price'], 'summaryDetail':s['summaryDetail'] }
-        print(dashed_json_no_brackets(slocal,wrap_width=60, long_value_on_next_line=True))
-
-# Print the price limits in the dropdown menu
-def print_price_limits(price_limit_list):
-    PARAMETERS = FONT + " refresh=true terminal='false' bash='" + __file__ + "'"
-
-    print('---')
-    print('Price Limits' + FONT)
-    # Print available price limits in the submenu
-    for limit_entry in price_limit_list:
-        # Split the limit entry, limits are saved in the format: TYPE SYMBOL PRICE
-        limit_type = limit_entry.split()[0]
-        symbol = limit_entry.split()[1]
-        limit_price = limit_entry.split()[2]
-        price_limit_submenu = '{:<6} {:<4} {:<10}'
-        # Print the price limit data into the submenu
+        yield labels['Regular Close'] + value(s.fmt('regular_market_price') + \
+            ' (' + s.fmt('regular_market_change_percent') + ')')
+    yield labels['Bid'] + value(s.fmt('bid'))
+    yield labels['Ask'] + value(s.fmt('ask'))
+    yield labels["Day's Range"] + value('{:.2f}'.format(regular_market_day_range))
+    yield labels['52 Week Range'] + value('{:.2f}'.format(fifty_two_week_range))
+    if OPTION_SHOW_SPARKLINE:
+        history = PRICE_HISTORY.latest(s.symbol, SPARKLINE_POINTS)
+        if history is not None and len(history) > 1:
+            yield labels['History'] + value(sparkline(history['price']))
+    yield '-----'
+    if OPTION_SHOW_INDICATORS and indicators:
+        indicator_text = list(indicator_lines(indicators))
+        if indicator_text:
+            yield from indicator_text
+            yield '-----'
+    if note != '':
+        theNote = fill('--'+ICON_NOTES+' Notes: '+ note,width=60,subsequent_indent="--")
+        for line in theNote.splitlines():
+            yield line + FONT_SMALL #only way to suffix every line created with fill()
+        yield '-----'
+    if debug_enabled_for(s.symbol):
+        yield '--DEBUG'
+        yield STOCK_SUBMENU_FORMAT('----postMarketPrice',s.post_market_price)
+        yield '----raw yfinance info'
+        fingerprint = s.fingerprint()
+        yield from cached_debug_lines(s.symbol, 'rawData', s.raw_data or {}, fingerprint)
+        yield '----script variables'
+        slocal = s.to_dict()
+        del slocal['raw_data']
+        yield from cached_debug_lines(s.symbol, 'script', slocal, fingerprint)
+
+# Submenu lines of a symbol's indicator snapshot, leaving out indicators whose window isn't full yet
+FAN_ICONS = {1: ICON_ARROW_UP, -1: ICON_ARROW_DOWN, 0: ''}
+
+
+def indicator_lines(snapshot):
+    labels = STOCK_SUBMENU_LABELS
+    value = STOCK_SUBMENU_VALUE_FORMAT
+    if snapshot['roc'] is not None:
+        yield labels['ROC'] + value('{:+.2f}% ({:+.2f}% / {:+.2f}%)'.format(snapshot['roc'], *snapshot['roc_bands']))
+    for name in ('ema', 'sma'):
+        if snapshot[name]:
+            yield labels[name.upper() + ' Fan'] + value(' / '.join(PRICE_FORMAT(average) for average in snapshot[name]) +
+                                                       ' ' + FAN_ICONS[snapshot[name + '_fan']])
+    if snapshot['bollinger']:
+        lower, upper = snapshot['bollinger']
+        yield labels['Bollinger'] + value(' / '.join(PRICE_FORMAT(band) for band in (lower, (lower + upper) / 2, upper)))
+    if snapshot['vap'] is not None:
+        yield labels['VAP Compression'] + value('{:.0f}'.format(snapshot['vap']))
+
+
+# Menu lines of the shared Yahoo session's counters, for this refresh and (in the daemon) since it started
+def http_metrics_lines(client):
+    for label, counters in (('this refresh', client.run), ('since start', client.totals)):
+        ratio = client.reuse_ratio(counters)
+        yield ('--HTTP ' + label + ': ' + str(counters['requests']) + ' requests, ' + str(counters['handshakes']) + ' handshake requests (' +
+               str(counters['crumb_fetches']) + ' crumb), ' + str(counters['new_connections']) + ' new connections' +
+               ('' if ratio is None else ', {:.0%} reused'.format(ratio)) + FONT)
+
+# Menu lines for a symbol that couldn't be fetched and has no last known quote
+def unavailable_stock_lines(symbol):
+    yield STOCK_LINE_FORMATS[''](symbol.split('.')[0], 'N/A', ICON_STALE)
+    yield "--Couldn't fetch " + symbol + ', will retry on a later refresh' + FONT
+
+# Menu lines of per-request fetch latency in a submenu, for tuning the FETCH_* settings against throttling
+def fetch_latency_lines(scheduler):
+    latencies = list(scheduler.latencies)
+    total = sum(seconds for _, seconds, _ in latencies)
+    yield '--Fetch latency: ' + str(len(latencies)) + ' requests, ' + '{:.2f}s'.format(total) + ' total' + FONT
+    for label, seconds, ok in latencies:
+        yield FETCH_LATENCY_FORMAT(label, seconds, '' if ok else ' FAILED')
+
+
+# The Performance item under the timestamp: time spent in each phase so far (rendering is still under way), then the counters
+def performance_lines(metrics, client=None):
+    snapshot = metrics.snapshot()
+    yield 'Performance: ' + '{:.2f}s'.format(snapshot['total']) + ' before rendering' + FONT
+    for name, seconds in snapshot['phases'].items():
+        yield PERFORMANCE_PHASE_FORMAT(name, seconds)
+    counters = dict(snapshot['counters'])
+    if client is not None:
+        counters['requests'] = client.run['requests']
+        counters['KB fetched'] = '{:.1f}'.format(client.run.get('bytes', 0) / 1024)
+    if counters:
+        yield '-----'
+    for name, value in counters.items():
+        yield PERFORMANCE_COUNTER_FORMAT(name, value)
+    for name, message in snapshot.get('errors', {}).items():
+        yield PERFORMANCE_ERROR_FORMAT(name, message.replace('|', '/'))
+
+
+# Menu lines of the price limits in the dropdown menu
+def price_limit_lines(price_limit_list):
+    yield '---'
+    yield 'Price Limits' + FONT
+    # Available price limits in the submenu
+    for limit_type, symbol, limit_price in price_limit_list:
+        limit_entry = format_limit_entry(limit_type, symbol, limit_price)
         # onClick will rerun this script with parameters 'remove' and the {limit_entry} to remove clicked the limit
-        print(price_limit_submenu.format('--' + limit_type, symbol, limit_price +
-              PARAMETERS + " param1='remove' param2='" + limit_entry + "'"))
-    print('-----')
-    print('--To remove a limit, click on it.' + FONT)
-    # Print the clickable fields to set new limits or clear all price limits
+        yield PRICE_LIMIT_FORMAT('--' + limit_type, symbol, limit_price +
+              COMMAND_PARAMETERS + " param1='remove' param2='" + limit_entry + "'")
+    yield '-----'
+    yield '--To remove a limit, click on it.' + FONT
+    # The clickable fields to set new limits or clear all price limits
     # onClick will rerun this script with parameters 'set' to set a new limit
-    print('Set new Price Limit...' + PARAMETERS + " param1='set'")
-    # onClick will rerun this script with parameters 'clear' to clear the hidden .db file
-    print('Clear all Price Limits...' + PARAMETERS + " param1='clear'")
+    yield 'Set new Price Limit...' + COMMAND_PARAMETERS + " param1='set'"
+    # onClick will rerun this script with parameters 'clear' to clear all price limits
+    yield 'Clear all Price Limits...' + COMMAND_PARAMETERS + " param1='clear'"
+
+
+# Every line of the menu for symbols already fetched into registry (anything that maps symbol -> Quote), with indicators {symbol: indicator snapshot} for OPTION_SHOW_INDICATORS. No network or database access, so the render cost can be measured on its own (see benchmarks/bench_render.py).
+def menu_lines(registry, price_limit_list, scheduler=None, client=None, metrics=None, indicators=None):
+    # The menu bar information
+    # restored for version 2.0; I've made turning it on or off it a user option. 
+    if OPTION_SHOW_ANNOYING_INDICES_IN_MENU:
+        for symbol, name in INDICES_DICT.items():
+            if symbol in registry:
+                yield index_line(registry[symbol], name)
+
+    # Icon in the menu bar
+
+    first_category_name, first_symdict = next(iter(watch_symbols.items()))
+    first_stock = next(iter(first_symdict))  # dict iterates over keys by default
+
+    if OPTION_USE_MARKET_CALENDAR:
+        menu_market_state = MARKET_CALENDAR.session_at()
+    else:
+        menu_market_state = registry[first_stock].session if first_stock in registry else 'CLOSED'
+    session_menu_icon=SESSION_INFO[menu_market_state]['menuicon'] 
+    yield (ICON_MAIN_MENU if (OPTION_SHOW_MENU_ICON or (OPTION_SHOW_SESSION_IN_MENU_ICON and not session_menu_icon)) else '') + (session_menu_icon if OPTION_SHOW_SESSION_IN_MENU_ICON else '')
+    # make sure to at least show menuicon if session menu icon is enabled but the menu icon for the current session is blank 
+
+    currtime = datetime.now()
+    yield "---"
+    yield "As of " + currtime.strftime("%Y-%m-%d %H:%M:%S")
+    # onClick will rerun this script with parameter 'refresh' to clear the quote cache, then xbar refreshes the menu
+    yield "--Refresh now, bypassing the quote cache" + COMMAND_PARAMETERS + " param1='refresh'"
+    if OPTION_SHOW_DEBUG_SUBMENU and scheduler is not None:
+        yield from fetch_latency_lines(scheduler)
+    if OPTION_SHOW_DEBUG_SUBMENU and client is not None:
+        yield from http_metrics_lines(client)
+    if OPTION_SHOW_PERFORMANCE_SUBMENU and metrics is not None:
+        yield from performance_lines(metrics, client)
+
+    for category in watch_symbols:
+        # Every category shares the registry's single fetch of each symbol
+        stocks = [registry[symbol] for symbol in watch_symbols[category] if symbol in registry]
+
+        # Set order of stocks; anything but the STOCK_SORT_KEYS names keeps the watchlist order. With TOP_MOVERS_COUNT only the top ones are picked, the rest go under "More…".
+        more_stocks = []
+        if TOP_MOVERS_COUNT and len(stocks) > TOP_MOVERS_COUNT:
+            stocks, more_stocks = RENDER_CACHE.top_stocks(category, stocks, TOP_MOVERS_COUNT, *STOCK_SORT_KEYS.get(SORT_BY, ()))
+        elif SORT_BY in STOCK_SORT_KEYS:
+            stocks = RENDER_CACHE.sorted_stocks(category, stocks, *STOCK_SORT_KEYS[SORT_BY])
+
+        # The stock information inside the dropdown menu, reusing the previous refresh's lines for unchanged symbols
+        yield '---'
+        if (category != ''):
+            yield category+":"+FONT
+        for stock in stocks:
+            yield from RENDER_CACHE.stock_lines(stock, category, (indicators or {}).get(stock.symbol))
+        if more_stocks:
+            yield MORE_STOCKS_FORMAT(len(more_stocks))
+            for stock in more_stocks:
+                yield '--' + RENDER_CACHE.stock_summary(stock, category, (indicators or {}).get(stock.symbol))
+        for symbol in watch_symbols[category]:
+            if symbol not in registry:
+                yield from unavailable_stock_lines(symbol)
+    RENDER_CACHE.finish()
+
+    # The price limit section inside the dropdown
+    yield from price_limit_lines(price_limit_list)
+
+
+# Fetch everything, check the price limits and return the whole menu as one string
+def render_menu_text(data_file, state=None):
+    METRICS.reset()
+    FETCH_SCHEDULER.reset()
+    YAHOO_CLIENT.reset_run()
+
+    with METRICS.phase('open state'):
+        # Local state: quote cache, unless bypassed with STOCKS_NO_CACHE=1 (the 'refresh' menu item clears it instead), names and stored intraday bars. The daemon passes its own, kept open between refreshes.
+        if state is None:
+            state = open_local_state()
+
+        # Price limits live in the same database; an old .db file is migrated on first run
+        try:
+            limits = open_price_limits(data_file, state.conn, state.lock) if state else open_price_limits(data_file)
+        except sqlite3.Error:
+            limits = None
 
+    # Every symbol the menu needs, each fetched exactly once no matter how many categories it's listed in
+    with METRICS.phase('fetch'):
+        registry = SymbolRegistry(watch_symbols, state)
+        if OPTION_SHOW_ANNOYING_INDICES_IN_MENU:
+            for symbol in INDICES_DICT:
+                registry.add(symbol)
+        registry.fetch()
+    METRICS.count('symbols', len(registry.symbols))
 
-if __name__ == '__main__':
-    data_file = os.path.join(os.path.dirname(os.path.realpath(
-        __file__)), '.' + os.path.basename(__file__) + '.db')
+    # Append the fresh prices to each symbol's history file. A full disk or unwritable folder costs the history, not the menu.
+    if OPTION_KEEP_PRICE_HISTORY:
+        with METRICS.phase('price history'):
+            try:
+                METRICS.count('prices recorded', PRICE_HISTORY.record(registry.data))
+            except OSError:
+                pass
 
-    # Normal execution by BitBar without any parameters
-    if len(sys.argv) == 1:
-       
-        # Check if hidden .db file exists
-        try:
-            price_limit_list = read_data_file(data_file)
-        except FileNotFoundError:
-            price_limit_list = []
+    # Check every limit against the fetched quotes in one pass. Alerts are shown by a background worker so the menu isn't held up. Stale quotes don't trigger limits.
+    with METRICS.phase('check limits'):
+        queued = check_price_limits(registry, limits, AlertQueue(limits.conn, limits.lock)) if limits else False
+    if queued:
+        with METRICS.phase('start notify worker'):
+            start_notify_worker()
 
-        # Print the menu bar information
-        # restored for version 2.0; I've made turning it on or off it a user option. 
-        if OPTION_SHOW_ANNOYING_INDICES_IN_MENU:
-            for symbol, name in INDICES_DICT.items():
-                time.sleep(OPTION_SHOW_ANNOYING_INDICES_IN_MENU_INTERVAL)  # 1 second delay between requests
-                index = get_stock_data(symbol)
-                print_index(index, name)
-
-        # Print icon in the menu bar
-        
-        first_category_name, first_symdict = next(iter(watch_symbols.items()))
-        first_stock = next(iter(first_symdict))  # dict iterates over keys by default
-
-
-        first_stock_data=get_stock_data(first_stock)
-        menu_market_state = get_eff_market_state(first_stock_data['price']['marketState'])
-        session_menu_icon=SESSION_INFO[menu_market_state]['menuicon'] 
-        print((ICON_MAIN_MENU if (OPTION_SHOW_MENU_ICON or (OPTION_SHOW_SESSION_IN_MENU_ICON and not session_menu_icon)) else '') + (session_menu_icon if OPTION_SHOW_SESSION_IN_MENU_ICON else ''))
-        # make sure to at least show menuicon if session menu icon is enabled but the menu icon for the current session is blank 
-
-        currtime = datetime.now()
-        print("---")
-        print("As of " + currtime.strftime("%Y-%m-%d %H:%M:%S"))
-
-        for category in watch_symbols:
-            category_symbols = watch_symbols[category].keys()
-            stocks = []
-                
-            # For each symbol: curl the data, check against the .db file for limits
-            for symbol in category_symbols:
-                time.sleep(1)  # 1 second delay between requests
-                stock = first_stock_data if first_stock_data else get_stock_data(symbol)
-                first_stock_data = {}
-                stocks.append(stock) 
-                check_price_limits(
-                    symbol, stock['price']['currentPrice']['raw'], price_limit_list, data_file)
-
-            
-            # Set order of stocks
-            if SORT_BY == 'name':
-                stocks = sorted(stocks, key=lambda k: k['price']['shortName'])
-            if SORT_BY == 'symbol':
-                stocks = sorted(stocks, key=lambda k: k['price']['symbol'])
-            if SORT_BY == 'market_change_winners':
-                stocks = sorted(
-                    stocks, key=lambda k: k['price']['regularMarketChangePercent']['raw'], reverse=True)
-            if SORT_BY == 'market_change_losers':
-                stocks = sorted(
-                    stocks, key=lambda k: k['price']['regularMarketChangePercent']['raw'])
-            if SORT_BY == 'market_change_volatility':
-                stocks = sorted(stocks, key=lambda k: abs(
-                    k['price']['regularMarketChangePercent']['raw']), reverse=True)
-
-            # Print the stock information inside the dropdown menu
-            print('---')
-            if (category != ''):
-                print (category+":"+FONT)
-            for stock in stocks:
-                print_stock(stock,category)
-
-        # Print the price limit section inside the dropdown
-        print_price_limits(price_limit_list)
+    # The price limit list is re-read so triggered limits are gone
+    with METRICS.phase('render'):
+        return '\n'.join(menu_lines(registry, limits.entries() if limits else [], FETCH_SCHEDULER, YAHOO_CLIENT, METRICS,
+                                    registry.indicators)) + '\n'
+
+
+# One whole refresh: render the menu, hand it to output (stdout, or the daemon's menu file) and log its metrics
+def refresh_menu(data_file, state, output):
+    text = render_menu_text(data_file, state)
+    with METRICS.phase('output'):
+        output(text)
+    log_refresh_metrics()
+    return text
 
+
+def write_stdout(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+# Normal execution by BitBar without any parameters: the whole menu goes to stdout in a single write
+def render_menu(data_file, state=None):
+    profiled(refresh_menu, data_file, state, write_stdout)
+
+
+# Script executions with parameters, from clicks on menu items
+def handle_command(argv, data_file):
     # Script execution with parameter 'set' to set new price limits
-    if len(sys.argv) == 2 and sys.argv[1] == 'set':
+    if len(argv) == 1 and argv[0] == 'set':
         # Run this until user does not want to continue
         while True:
-            # Get the user selection of whether he wants to set 'BUY' or 'SELL'
-            limit_type_prompt = 'Select the type of your limit: BUY (SELL) limits are triggered, when the price is lower (higher) than the limit.'
-            limit_type_choices = '["BUY", "SELL"]'
+            # Get the user selection of the limit type (see LIMIT_TYPES)
+            limit_type_prompt = ('Select the type of your limit: BUY (SELL) limits are triggered when the price is lower (higher) than the limit. '
+                                 'PCT: move of at least N percent from the previous close. CROSS: every time the price crosses a level. '
+                                 'TRAIL: price falls N percent below its high since the limit was set. '
+                                 'FAN, BAND, ROC: the EMA fan opens, the price leaves its Bollinger Bands, or ROC leaves its bands. '
+                                 'VAP: volume-at-price compression reaches a score.')
+            limit_type_choices = json.dumps(list(LIMIT_TYPES))
             limit_type = prompt_selection(
                 limit_type_prompt, limit_type_choices)
-                
+
             # begin generate symbols variable as appeared in the original script instead of watch_symbols before I added categories
-            symbols = sorted({sym for symdict in watch_symbols.values() for sym in symdict.keys()})
-            symbols_js = json.dumps(all_symbols) #safer than dumping a python list into JXA as done in prompt_selection
+            symbols = sorted(SymbolRegistry(watch_symbols).symbols)
+            symbols_js = json.dumps(symbols) #safer than dumping a python list into JXA as done in prompt_selection
 
             # Get the user selection of all tracked symbols
             symbol = prompt_selection('Select stock symbol:', symbols_js)
@@ -907,18 +3045,32 @@ if __name__ == '__main__':
             # Get the user input for a price limit, info message includes the current market price
             #price = prompt('Current price of ' + symbol + ' is ' + str(get_stock_data(
             #    symbol)['regularMarketPrice']) + '. Enter a value for your price limit.')
-            price = prompt('Current price of ' + symbol + ' is ' + str(get_stock_data(
-                symbol)['price']['currentPrice']['raw']) + '. Enter a value for your price limit.')
-
-            # Check if the user input are decimals with a precision of two
-            if not re.match(r'^\d*(\.\d{1,4})?$', price): # Prices can have no leading digit or 4 decimals, for penny stocks! Was re.match(r'^\d+(\.\d{1,2})?$', price):
+            quote = get_stock_data(symbol)
+            if limit_type == 'PCT':
+                price = prompt(symbol + ' is ' + (quote.fmt('regular_market_change_percent') if quote else 'unavailable') +
+                               ' from the previous close. Enter the move in percent to alert on, e.g. 5 for up 5% or -3 for down 3%.')
+            elif limit_type in DIRECTION_LIMIT_TYPES:
+                price = prompt('Enter 1 to alert when ' + symbol + ' turns up (' +
+                               {'FAN': 'shorter EMAs above the longer ones', 'BAND': 'price above the upper Bollinger Band',
+                                'ROC': 'ROC above its upper band'}[limit_type] + '), or -1 for down.')
+            elif limit_type == 'VAP':
+                price = prompt('Enter the volume-at-price compression score of ' + symbol + ' to alert at, above 0 (volume spread evenly) and up to 100 (all of it traded in one narrow price band).')
+            elif limit_type == 'TRAIL':
+                price = prompt('Current price of ' + symbol + ' is ' + (str(quote.current_price) if quote else 'unavailable') +
+                               '. Enter how many percent below its high the price may fall before alerting.')
+            else:
+                price = prompt('Current price of ' + symbol + ' is ' + (str(quote.current_price) if quote else 'unavailable') +
+                               '. Enter a value for your price limit.')
+
+            # Check the user input against what the limit type accepts (see LIMIT_VALUES)
+            error = limit_value_error(limit_type, price)
+            if error:
                 # Alert the user on invalid value and stop the script
-                alert('Error', 'You entered an invalid value: ' + price +
-                      ' - valid values are decimals with a precision of 2, e.g 25.70!')
+                alert('Error', error)
                 sys.exit()
 
-            # Write the limit to the hidden .db file
-            write_data_file(data_file, limit_type, symbol, price)
+            # Save the limit
+            open_price_limits(data_file).add(limit_type, symbol, price)
 
             # Ask user if he wants to add another limit
             add_another_limit = alert(
@@ -927,18 +3079,305 @@ if __name__ == '__main__':
             if add_another_limit is None:
                 sys.exit()
 
-    # Script execution with parameter 'clear' to clear the .db file
-    if len(sys.argv) == 2 and sys.argv[1] == 'clear':
+    # Script execution with the parameters 'set', SYMBOL, TYPE and VALUE to set a limit without any dialogs, e.g. from a shell: set AAPL BUY 150
+    if len(argv) == 4 and argv[0] == 'set':
+        symbol, limit_type, price = argv[1].upper(), argv[2].upper(), argv[3]
+        if limit_type not in LIMIT_TYPES:
+            error = 'You entered an invalid limit type: ' + limit_type + ' - valid types are ' + ', '.join(LIMIT_TYPES) + '!'
+        else:
+            error = limit_value_error(limit_type, price)
+        if error:
+            alert('Error', error)
+            sys.exit(1)
+        open_price_limits(data_file).add(limit_type, symbol, price)
+
+    # Script execution with parameter 'refresh' to throw away cached quotes before xbar reruns the plugin
+    if len(argv) == 1 and argv[0] == 'refresh':
+        try:
+            QuoteCache(open_state_db()).invalidate()
+        except sqlite3.Error:
+            pass
+
+    # Script execution with parameter 'clear' to clear all price limits
+    if len(argv) == 1 and argv[0] == 'clear':
         # Ask for user confirmation
         warning = alert(
             'Warning', 'This will clear your price limits! Do you want to continue?')
         if warning is None:
             sys.exit()
 
-        # Clear the file
-        open(data_file, 'w').close()
+        open_price_limits(data_file).clear()
+
+    # Script execution with the parameters 'remove' and the limit to be removed, in the format: TYPE SYMBOL PRICE
+    if len(argv) == 2 and argv[0] == 'remove':
+        limit_to_be_removed = parse_limit_entry(argv[1])
+        if limit_to_be_removed:
+            open_price_limits(data_file).remove(*limit_to_be_removed)
+
+
+def open_local_state():
+    try:
+        return LocalState(open_state_db(), OPTION_USE_QUOTE_CACHE and not os.environ.get('STOCKS_NO_CACHE'))
+    except sqlite3.Error:
+        return None
+
+
+# Streaming quotes -----------------------------------------------------------------------------------------------------
+# With OPTION_USE_STREAMING, the daemon subscribes once to Yahoo's streaming price feed for every symbol: base64 encoded protobuf PricingData messages over a websocket, decoded by yfinance's WebSocket. A background thread keeps each symbol's latest update in an in-memory table. Each refresh lays those updates over the polled quotes (Quote.with_stream). Symbols the stream is covering are only polled every STREAMING_POLL_SECONDS, for the fields it doesn't carry: names, the 52 week range and the regular-session close. When the feed drops, the thread reconnects with jittered backoff, and until then symbols are polled as usual. STOCKS_STREAM_URL points it at another server, e.g. the stand-in in tools/yahoo_stream.py.
+YAHOO_STREAM_URL = 'wss://streamer.finance.yahoo.com/?version=2'
+STREAM_RESUBSCRIBE_SECONDS = 15 # Yahoo stops sending to subscriptions that aren't renewed
+STREAM_MARKET_HOURS = {0: 'PRE', 1: 'REGULAR', 2: 'POST'} # PricingData.market_hours; anything else (3 is overnight trading) shows as CLOSED
+
+
+class QuoteStream:
+    def __init__(self, symbols, url=None):
+        self.symbols = sorted(set(symbols))
+        self.url = url or os.environ.get('STOCKS_STREAM_URL') or YAHOO_STREAM_URL
+        self.lock = threading.Lock()
+        self.updates = {} # symbol -> latest fields received, merged across messages, plus when
+        self.connection = None
+        self.connected_at = None # None while disconnected
+        self.counters = {'messages': 0, 'connects': 0, 'errors': 0}
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    # Connect, subscribe and listen until the connection fails, forever
+    def run(self):
+        failures = 0
+        while True:
+            connection = None
+            try:
+                connection = yf.WebSocket(url=self.url, verbose=False)
+                connection.subscribe(self.symbols)
+                with self.lock:
+                    self.connection = connection
+                    self.connected_at = time.time()
+                self.counters['connects'] += 1
+                failures = 0
+                threading.Thread(target=self.resubscribe, args=(connection,), daemon=True).start()
+                connection.listen(self.handle)
+            except Exception:
+                self.counters['errors'] += 1
+            with self.lock:
+                self.connection = None
+                self.connected_at = None
+            try:
+                if connection is not None:
+                    connection.close()
+            except Exception:
+                pass
+            failures += 1
+            time.sleep(random.uniform(0.5, 1) * min(2 ** failures, 60))
+
+    def resubscribe(self, connection):
+        while True:
+            time.sleep(STREAM_RESUBSCRIBE_SECONDS)
+            if self.connection is not connection:
+                return
+            try:
+                connection.subscribe(self.symbols)
+            except Exception:
+                return
+
+    # One decoded PricingData message. Fields left at their protobuf default are missing from it, so a missing market_hours means 0.
+    def handle(self, message):
+        symbol = message.get('id')
+        if not symbol or not message.get('price'):
+            return
+        with self.lock:
+            update = self.updates.setdefault(symbol, {})
+            update.update(message)
+            update['market_hours'] = message.get('market_hours', 0)
+            update['received'] = time.time()
+        self.counters['messages'] += 1
+
+    # The symbols the stream has sent an update for since it last connected
+    def live_symbols(self, symbols):
+        with self.lock:
+            if self.connected_at is None:
+                return []
+            return [symbol for symbol in symbols if symbol in self.updates and self.updates[symbol]['received'] >= self.connected_at]
+
+    # quotes with the latest update laid over each one the stream has something newer for. Stale quotes are left as they are.
+    def apply(self, quotes):
+        with self.lock:
+            updates = {symbol: dict(self.updates[symbol]) for symbol in quotes if symbol in self.updates}
+        applied = {}
+        for symbol, quote in quotes.items():
+            update = updates.get(symbol)
+            if update and quote.stale_since is None and int(update.get('time', 0)) // 1000 >= quote.regular_market_time:
+                quote = quote.with_stream(update)
+                METRICS.count('streamed quotes')
+            applied[symbol] = quote
+        return applied
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Resident daemon --------------------------------------------------------------------------------------------------------
+# With OPTION_USE_DAEMON on, 'daemon' runs forever: it refreshes every DAEMON_REFRESH_SECONDS with its state kept open and warm, writes the rendered menu to a hidden .menu file and answers requests on a hidden .sock Unix socket. Each xbar run is then a thin client that prints the latest render, and the set/clear/remove/refresh clicks are forwarded to the daemon, which refreshes right after handling them. The first client run starts the daemon if it isn't running. Settings and the watchlist live in this script, so the daemon quits as soon as it notices the script was edited or upgraded (at its next refresh or request), and the next client run starts a fresh one.
+DAEMON_MENU_FILE = state_file_path('.menu')
+DAEMON_SOCKET_FILE = state_file_path('.sock')
+DAEMON_PID_FILE = state_file_path('.pid')
+
+
+def script_mtime():
+    return os.path.getmtime(os.path.realpath(__file__))
+
+
+# Write-then-rename, so a client never reads a half written menu
+def write_file_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def run_daemon(data_file):
+    import socketserver
+
+    # One daemon per plugin file: hold an exclusive lock on the pid file for our lifetime
+    pid_file = lock_pid_file(DAEMON_PID_FILE)
+    if pid_file is None:
+        return
+
+    started_mtime = script_mtime()
+    stop = threading.Event()
+
+    def script_changed():
+        try:
+            return script_mtime() != started_mtime
+        except OSError:
+            return True
+
+    # None if the .sqlite file can't be opened: every refresh then tries again on its own, and there's nowhere to keep the stream
+    state = open_local_state()
+    RENDER_CACHE.enabled = True # keep rendered lines between refreshes
+    if OPTION_USE_STREAMING and state is not None:
+        state.stream = QuoteStream(SymbolRegistry(watch_symbols).symbols + list(INDICES_DICT)).start()
+    render_lock = threading.Lock()
+    latest = {'menu': ''}
+
+    def publish(menu):
+        latest['menu'] = menu
+        write_file_atomic(DAEMON_MENU_FILE, menu)
+
+    def refresh():
+        with render_lock:
+            profiled(refresh_menu, data_file, state, publish)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # an empty reply sends the client back to doing the work itself, with the new script
+            if script_changed():
+                stop.set()
+                return
+            try:
+                argv = json.loads(self.rfile.readline().decode('utf-8'))['argv']
+            except (ValueError, KeyError):
+                return
+            if not argv:
+                self.wfile.write(latest['menu'].encode('utf-8'))
+                return
+            try:
+                handle_command(argv, data_file)
+            except SystemExit:
+                pass # dialogs exit when the user cancels; the daemon keeps running
+            # re-render before replying: xbar reruns the plugin as soon as the click returns
+            try:
+                refresh()
+            except Exception:
+                pass
+            self.wfile.write(b'ok')
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(DAEMON_SOCKET_FILE):
+        os.remove(DAEMON_SOCKET_FILE)
+    server = Server(DAEMON_SOCKET_FILE, Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        while not script_changed():
+            try:
+                refresh()
+            except Exception:
+                pass # keep serving the last good menu
+            if stop.wait(DAEMON_REFRESH_SECONDS):
+                break
+    finally:
+        server.server_close()
+        os.remove(DAEMON_SOCKET_FILE)
+
+
+# Send argv to the daemon and return its reply, or None if no daemon is listening
+def daemon_request(argv, timeout=None):
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(DAEMON_SOCKET_FILE)
+            sock.sendall(json.dumps({'argv': argv}).encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8')
+    except OSError:
+        return None
+
+
+def start_daemon():
+    subprocess.Popen([sys.executable, os.path.realpath(__file__), 'daemon'], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# Thin client. Returns True if the daemon (or its last render) took care of this run, False to fall back to doing the work in-process.
+def daemon_client(argv, data_file):
+    if not argv:
+        menu = daemon_request([], timeout=2)
+        if menu is None:
+            start_daemon()
+            # the daemon's file may still be good enough while it starts up, unless the script changed since it was rendered
+            try:
+                menu_mtime = os.path.getmtime(DAEMON_MENU_FILE)
+                if time.time() - menu_mtime < 3 * DAEMON_REFRESH_SECONDS and menu_mtime > script_mtime():
+                    with open(DAEMON_MENU_FILE) as f:
+                        menu = f.read()
+            except OSError:
+                menu = None
+        if not menu:
+            return False
+        sys.stdout.write(menu)
+        return True
+    # menu clicks may open dialogs, so wait as long as the user takes; no reply at all means the daemon is quitting
+    return bool(daemon_request(argv))
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    data_file = os.path.join(os.path.dirname(os.path.realpath(
+        __file__)), '.' + os.path.basename(__file__) + '.db')
+
+    # Resident daemon: keeps refreshing in the background and serves the rendered menu
+    if len(sys.argv) == 2 and sys.argv[1] == 'daemon':
+        run_daemon(data_file)
+
+    # Background worker that shows queued price alerts, started by the run that triggered them
+    elif len(sys.argv) == 2 and sys.argv[1] == 'notify-worker':
+        run_notify_worker()
+
+    # Thin client: print the daemon's latest render, or hand the menu click over to it
+    elif OPTION_USE_DAEMON and daemon_client(sys.argv[1:], data_file):
+        pass
+
+    # Normal execution by BitBar without any parameters
+    elif len(sys.argv) == 1:
+        render_menu(data_file)
 
-    # Script execution with the parameters 'remove' and the line to be removed
-    if len(sys.argv) == 3 and sys.argv[1] == 'remove':
-        limit_to_be_removed = sys.argv[2]
-        remove_line_from_data_file(data_file, limit_to_be_removed)
+    else:
+        handle_command(sys.argv[1:], data_file)
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from plugin_loader import default_plugin_path, load_plugin # noqa: E402
+
+
+# The plugin imported from a temporary copy, so its hidden state files never touch the real ones
+@pytest.fixture(scope='session')
+def plugin(tmp_path_factory):
+    return load_plugin(default_plugin_path(), str(tmp_path_factory.mktemp('plugin')))
+
+
+# A fresh state database with every table, for one test
+@pytest.fixture
+def state_db(plugin, tmp_path):
+    conn = plugin.open_state_db(str(tmp_path / 'state.sqlite'))
+    yield conn
+    conn.close()
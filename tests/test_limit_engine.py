@@ -0,0 +1,150 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+def quote(price, previous_close=100.0):
+    return SimpleNamespace(current_price=price, regular_market_previous_close=previous_close, stale_since=None)
+
+
+# Evaluate one rule against one price; returns (triggered, side, high_water)
+def check(plugin, limit_type, threshold, price, side=None, high_water=None, indicators=None, previous_close=100.0):
+    engine = plugin.LimitEngine([(limit_type, 'AAPL', threshold, side, high_water)])
+    triggered, new_side, new_high_water, _ = engine.evaluate({'AAPL': quote(price, previous_close)}, indicators)
+    return bool(triggered[0]), int(new_side[0]), float(new_high_water[0])
+
+
+@pytest.mark.parametrize('limit_type, threshold, price, triggered', [
+    ('BUY', '100', 99.99, True), ('BUY', '100', 100.0, False), ('BUY', '100', 101.0, False),
+    ('SELL', '100', 100.01, True), ('SELL', '100', 100.0, False), ('SELL', '100', 99.0, False),
+    ('PCT', '5', 105.0, True), ('PCT', '5', 104.9, False), ('PCT', '5', 90.0, False),
+    ('PCT', '-3', 97.0, True), ('PCT', '-3', 97.5, False), ('PCT', '-3', 110.0, False),
+])
+def test_price_limits(plugin, limit_type, threshold, price, triggered):
+    assert check(plugin, limit_type, threshold, price)[0] == triggered
+
+
+def test_pct_needs_previous_close(plugin):
+    assert not check(plugin, 'PCT', '5', 200.0, previous_close=0)[0]
+
+
+def test_cross_first_check_only_notes_the_side(plugin):
+    assert check(plugin, 'CROSS', '100', 105.0)[:2] == (False, 1)
+    assert check(plugin, 'CROSS', '100', 95.0)[:2] == (False, -1)
+
+
+def test_cross_triggers_either_way(plugin):
+    assert check(plugin, 'CROSS', '100', 95.0, side=1)[:2] == (True, -1)
+    assert check(plugin, 'CROSS', '100', 105.0, side=-1)[:2] == (True, 1)
+    assert check(plugin, 'CROSS', '100', 105.0, side=1)[:2] == (False, 1)
+
+
+def test_cross_hysteresis(plugin):
+    band = 100 * plugin.LIMIT_CROSS_HYSTERESIS / 100
+    # hovering just past the level within the band doesn't count as a crossing
+    assert check(plugin, 'CROSS', '100', 100 - band / 2, side=1)[:2] == (False, 1)
+    assert check(plugin, 'CROSS', '100', 100 + band / 2, side=-1)[:2] == (False, -1)
+    assert check(plugin, 'CROSS', '100', 100 - band * 1.01, side=1)[:2] == (True, -1)
+    # nor does it note a side on the first check
+    assert check(plugin, 'CROSS', '100', 100 + band / 2)[:2] == (False, 0)
+
+
+def test_trail_tracks_the_high_water_mark(plugin):
+    assert check(plugin, 'TRAIL', '10', 100.0) == (False, 0, 100.0)
+    assert check(plugin, 'TRAIL', '10', 120.0, high_water=110.0) == (False, 0, 120.0)
+    assert check(plugin, 'TRAIL', '10', 99.5, high_water=110.0) == (False, 0, 110.0)
+    assert check(plugin, 'TRAIL', '10', 99.0, high_water=110.0) == (True, 0, 110.0)
+
+
+@pytest.mark.parametrize('limit_type, threshold, snapshot, price, triggered', [
+    ('FAN', '1', {'ema_fan': 1}, 100.0, True),
+    ('FAN', '-1', {'ema_fan': 1}, 100.0, False),
+    ('FAN', '-1', {'ema_fan': -1}, 100.0, True),
+    ('FAN', '1', {'ema_fan': None}, 100.0, False),
+    ('BAND', '1', {'bollinger': (90.0, 110.0)}, 111.0, True),
+    ('BAND', '1', {'bollinger': (90.0, 110.0)}, 100.0, False),
+    ('BAND', '-1', {'bollinger': (90.0, 110.0)}, 89.0, True),
+    ('BAND', '1', {'bollinger': None}, 1000.0, False),
+    ('ROC', '1', {'roc': 3.0, 'roc_bands': (-2.0, 2.0)}, 100.0, True),
+    ('ROC', '-1', {'roc': 3.0, 'roc_bands': (-2.0, 2.0)}, 100.0, False),
+    ('ROC', '-1', {'roc': -3.0, 'roc_bands': (-2.0, 2.0)}, 100.0, True),
+    ('ROC', '1', {'roc': 3.0, 'roc_bands': None}, 100.0, False),
+    ('VAP', '80', {'vap': 85.0}, 100.0, True),
+    ('VAP', '80', {'vap': 80.0}, 100.0, True),
+    ('VAP', '80', {'vap': 79.9}, 100.0, False),
+    ('VAP', '80', {'vap': None}, 100.0, False),
+])
+def test_indicator_limits(plugin, limit_type, threshold, snapshot, price, triggered):
+    assert check(plugin, limit_type, threshold, price, indicators={'AAPL': snapshot})[0] == triggered
+
+
+def test_indicator_limits_need_a_snapshot(plugin):
+    for limit_type, threshold in (('FAN', '1'), ('BAND', '-1'), ('ROC', '1'), ('VAP', '0.0001')):
+        assert not check(plugin, limit_type, threshold, 100.0)[0]
+
+
+def test_missing_symbols_never_trigger(plugin):
+    rules = [('BUY', 'MSFT', '1000', None, None), ('CROSS', 'MSFT', '10', 1, None),
+             ('TRAIL', 'MSFT', '5', None, 100.0), ('SELL', 'AAPL', '1', None, None)]
+    triggered, side, high_water, price = plugin.LimitEngine(rules).evaluate({'AAPL': quote(50.0)})
+    assert triggered.tolist() == [False, False, False, True]
+    assert side.tolist() == [0, 1, 0, 0]
+    assert high_water[2] == 100.0
+    assert price[3] == 50.0
+
+
+def test_many_rules_in_one_pass(plugin):
+    rules = [('BUY', 'AAPL', '100', None, None), ('SELL', 'AAPL', '100', None, None),
+             ('BUY', 'MSFT', '300', None, None), ('SELL', 'MSFT', '300', None, None)]
+    triggered = plugin.LimitEngine(rules).evaluate({'AAPL': quote(90.0), 'MSFT': quote(310.0)})[0]
+    assert triggered.tolist() == [True, False, False, True]
+
+
+@pytest.mark.parametrize('value, bands, side', [
+    (3.0, (-2.0, 2.0), 1), (-3.0, (-2.0, 2.0), -1), (0.0, (-2.0, 2.0), 0), (2.0, (-2.0, 2.0), 0),
+    (None, (-2.0, 2.0), 0), (3.0, None, 0),
+])
+def test_band_side(plugin, value, bands, side):
+    assert plugin.band_side(value, bands) == side
+
+
+# check_price_limits end to end, against a real limit store and alert queue
+class Registry(dict):
+    indicators = {}
+
+
+@pytest.fixture
+def stores(plugin, state_db):
+    return plugin.PriceLimitStore(state_db), plugin.AlertQueue(state_db)
+
+
+def test_check_price_limits(plugin, stores):
+    limits, alerts = stores
+    limits.add('BUY', 'AAPL', '100', now=1)
+    limits.add('SELL', 'AAPL', '200', now=2)
+    limits.add('CROSS', 'AAPL', '150', now=3)
+    limits.add('TRAIL', 'AAPL', '10', now=4)
+
+    assert plugin.check_price_limits(Registry(AAPL=quote(90.0)), limits, alerts)
+    # the BUY triggered and is gone, CROSS noted its side and TRAIL its high-water mark
+    assert limits.rules() == [('SELL', 'AAPL', '200', None, None), ('CROSS', 'AAPL', '150', -1, None),
+                              ('TRAIL', 'AAPL', '10', 0, 90.0)]
+    assert alerts.claim() == {'title': 'Price Alarm', 'subtitle': 'BUY Limit: 100.0', 'text': 'AAPL current price is: 90.0'}
+
+    assert plugin.check_price_limits(Registry(AAPL=quote(160.0)), limits, alerts)
+    # CROSS stays set after it triggers
+    assert limits.rules() == [('SELL', 'AAPL', '200', None, None), ('CROSS', 'AAPL', '150', 1, None),
+                              ('TRAIL', 'AAPL', '10', 0, 160.0)]
+    assert alerts.claim()['subtitle'] == 'CROSS Limit: 150.0 (up)'
+    assert not alerts.claim()
+
+
+def test_check_price_limits_skips_stale_quotes(plugin, stores):
+    limits, alerts = stores
+    limits.add('BUY', 'AAPL', '100')
+    stale = quote(90.0)
+    stale.stale_since = 1.0
+    assert not plugin.check_price_limits(Registry(AAPL=stale), limits, alerts)
+    assert not plugin.check_price_limits(Registry(), limits, alerts)
+    assert limits.entries() == [('BUY', 'AAPL', '100')]
+    assert alerts.pending() == 0
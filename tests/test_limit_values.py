@@ -0,0 +1,38 @@
+import pytest
+
+
+@pytest.mark.parametrize('limit_type, value', [
+    ('BUY', '25.70'), ('BUY', '.0001'), ('BUY', '0.0001'), ('BUY', '12345'),
+    ('SELL', '25.7'), ('CROSS', '100'),
+    ('PCT', '5'), ('PCT', '-3'), ('PCT', '-.5'), ('PCT', '0.0001'),
+    ('TRAIL', '0.0001'), ('TRAIL', '7.5'), ('TRAIL', '99.9999'),
+    ('FAN', '1'), ('FAN', '-1'), ('BAND', '1'), ('ROC', '-1'),
+    ('VAP', '0.0001'), ('VAP', '80'), ('VAP', '100'),
+])
+def test_accepts(plugin, limit_type, value):
+    assert plugin.limit_value_error(limit_type, value) is None
+
+
+@pytest.mark.parametrize('limit_type, value', [
+    # empty and digit-less values
+    ('BUY', ''), ('PCT', ''), ('TRAIL', ''), ('VAP', ''), ('FAN', ''),
+    ('BUY', '.'), ('PCT', '-'), ('PCT', '-.'),
+    # zero, which would never trigger or trigger on the first check
+    ('BUY', '0'), ('SELL', '0.00'), ('CROSS', '.0'),
+    ('PCT', '0'), ('PCT', '-0'), ('PCT', '-0.0'),
+    ('TRAIL', '0'), ('TRAIL', '-0'),
+    ('VAP', '0'), ('VAP', '0.0'),
+    # out of range
+    ('TRAIL', '100'), ('TRAIL', '150'), ('VAP', '100.0001'), ('VAP', '101'),
+    ('FAN', '0'), ('BAND', '2'), ('ROC', '1.0'),
+    # wrong shape
+    ('BUY', '-5'), ('TRAIL', '-5'), ('VAP', '-5'), ('SELL', '25.70001'), ('BUY', '1e3'), ('BUY', '25.70\n'),
+])
+def test_rejects(plugin, limit_type, value):
+    error = plugin.limit_value_error(limit_type, value)
+    assert error is not None
+    assert ' ' + limit_type + ' values are ' in error
+
+
+def test_every_limit_type_has_a_rule(plugin):
+    assert set(plugin.LIMIT_VALUES) == set(plugin.LIMIT_TYPES)
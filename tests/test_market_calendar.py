@@ -0,0 +1,104 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+NEW_YORK = ZoneInfo('America/New_York')
+
+
+def ts(*args):
+    return datetime(*args, tzinfo=NEW_YORK).timestamp()
+
+
+@pytest.fixture
+def calendar(plugin):
+    return plugin.MarketCalendar()
+
+
+@pytest.mark.parametrize('year, sunday', [
+    (2000, date(2000, 4, 23)), (2019, date(2019, 4, 21)), (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)), (2026, date(2026, 4, 5)), (2038, date(2038, 4, 25)),
+])
+def test_easter(plugin, year, sunday):
+    assert plugin.easter(year) == sunday
+
+
+def test_holidays_2026(plugin):
+    holidays, early_closes = plugin.nyse_holidays(2026)
+    assert holidays == {
+        date(2026, 1, 1), date(2026, 1, 19), date(2026, 2, 16), date(2026, 4, 3), date(2026, 5, 25),
+        date(2026, 6, 19), date(2026, 7, 3), date(2026, 9, 7), date(2026, 11, 26), date(2026, 12, 25),
+    }
+    # Jul 3 is the observed Independence Day itself, so it's not an early close
+    assert early_closes == {date(2026, 11, 27), date(2026, 12, 24)}
+
+
+def test_saturday_new_year_is_not_observed(plugin, calendar):
+    assert date(2022, 1, 1).weekday() == 5
+    assert date(2021, 12, 31) not in plugin.nyse_holidays(2021)[0]
+    assert date(2021, 12, 31) not in plugin.nyse_holidays(2022)[0]
+    assert calendar.trading_day(date(2021, 12, 31))
+
+
+def test_sunday_holiday_is_observed_on_monday(plugin):
+    # Juneteenth 2022 and Christmas 2022 fell on a Sunday
+    holidays = plugin.nyse_holidays(2022)[0]
+    assert date(2022, 6, 20) in holidays
+    assert date(2022, 12, 26) in holidays
+
+
+def test_juneteenth_only_from_2022(calendar):
+    assert calendar.trading_day(date(2021, 6, 18))
+    assert not calendar.trading_day(date(2023, 6, 19))
+
+
+def test_early_closes(plugin):
+    # Jul 3 and Dec 24 only when Monday to Thursday, and always the day after Thanksgiving
+    assert plugin.nyse_holidays(2024)[1] == {date(2024, 7, 3), date(2024, 11, 29), date(2024, 12, 24)}
+    assert plugin.nyse_holidays(2027)[1] == {date(2027, 11, 26)}
+
+
+def test_sessions(plugin, calendar):
+    assert calendar.sessions(date(2026, 10, 16)) == plugin.MARKET_SESSIONS
+    assert calendar.sessions(date(2026, 11, 27)) == plugin.EARLY_CLOSE_SESSIONS
+    assert calendar.sessions(date(2026, 10, 17)) == (('CLOSED', 0),) # Saturday
+    assert calendar.sessions(date(2026, 11, 26)) == (('CLOSED', 0),) # Thanksgiving
+
+
+@pytest.mark.parametrize('now, session, started', [
+    ((2026, 10, 16, 3, 59), 'CLOSED', (2026, 10, 15, 20, 0)),
+    ((2026, 10, 16, 4, 0), 'PRE', (2026, 10, 16, 4, 0)),
+    ((2026, 10, 16, 9, 30), 'REGULAR', (2026, 10, 16, 9, 30)),
+    ((2026, 10, 16, 15, 59), 'REGULAR', (2026, 10, 16, 9, 30)),
+    ((2026, 10, 16, 16, 0), 'POST', (2026, 10, 16, 16, 0)),
+    ((2026, 10, 16, 20, 0), 'CLOSED', (2026, 10, 16, 20, 0)),
+    # a weekend is one closed stretch from Friday's after hours on
+    ((2026, 10, 18, 12, 0), 'CLOSED', (2026, 10, 16, 20, 0)),
+    ((2026, 10, 19, 3, 0), 'CLOSED', (2026, 10, 16, 20, 0)),
+    # and a long weekend from the trading day before the holiday
+    ((2026, 1, 19, 10, 0), 'CLOSED', (2026, 1, 16, 20, 0)),
+    # early close: after hours from 1pm to 5pm
+    ((2026, 11, 27, 13, 30), 'POST', (2026, 11, 27, 13, 0)),
+    ((2026, 11, 27, 17, 30), 'CLOSED', (2026, 11, 27, 17, 0)),
+    ((2026, 11, 30, 2, 0), 'CLOSED', (2026, 11, 27, 17, 0)),
+])
+def test_current(calendar, now, session, started):
+    assert calendar.current(ts(*now)) == (session, ts(*started))
+
+
+def test_current_across_daylight_saving_change(calendar):
+    # clocks went back on Sunday 2026-11-01
+    assert calendar.current(ts(2026, 11, 2, 9, 45)) == ('REGULAR', ts(2026, 11, 2, 9, 30))
+    assert calendar.current(ts(2026, 11, 1, 12, 0)) == ('CLOSED', ts(2026, 10, 30, 20, 0))
+
+
+def test_quote_fresh(calendar):
+    ttl = {'REGULAR': 60, 'PRE': 300, 'POST': 300}
+    fetched = ts(2026, 10, 16, 10, 0)
+    assert calendar.quote_fresh(fetched, fetched + 30, ttl)
+    assert not calendar.quote_fresh(fetched, fetched + 90, ttl)
+    # the regular session ended since
+    assert not calendar.quote_fresh(ts(2026, 10, 16, 15, 59, 50), ts(2026, 10, 16, 16, 0, 10), ttl)
+    # closed: fresh however old, as long as it was fetched after the close
+    assert calendar.quote_fresh(ts(2026, 10, 16, 20, 5), ts(2026, 10, 18, 12, 0), ttl)
+    assert not calendar.quote_fresh(ts(2026, 10, 16, 19, 55), ts(2026, 10, 18, 12, 0), ttl)
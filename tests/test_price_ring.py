@@ -0,0 +1,110 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def ring_path(tmp_path):
+    return str(tmp_path / 'AAPL.ring')
+
+
+def prices(ring, n=None):
+    return ring.latest(n)['price'].tolist()
+
+
+def test_empty_ring(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        assert ring.count == 0
+        assert prices(ring) == []
+
+
+def test_append_and_latest(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        assert ring.append(1.0, 10.0, 2)
+        assert ring.append(2.0, 11.0, 2)
+        latest = ring.latest()
+        assert latest['ts'].tolist() == [1.0, 2.0]
+        assert latest['price'].tolist() == [10.0, 11.0]
+        assert latest['session'].tolist() == [2, 2]
+        assert prices(ring, 1) == [11.0]
+        assert prices(ring, 10) == [10.0, 11.0]
+
+
+def test_repeats_are_dropped(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        assert ring.append(1.0, 10.0, 2)
+        assert not ring.append(2.0, 10.0, 2)
+        # the same price in another session is a new record
+        assert ring.append(3.0, 10.0, 3)
+        assert ring.count == 2
+
+
+def test_wraparound(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        for n in range(10):
+            ring.append(float(n), 100.0 + n, 2)
+        assert ring.count == 10
+        assert prices(ring) == [106.0, 107.0, 108.0, 109.0]
+        assert prices(ring, 2) == [108.0, 109.0]
+        assert ring.latest()['ts'].tolist() == [6.0, 7.0, 8.0, 9.0]
+        # a repeat is checked against the newest record, wherever it landed
+        assert not ring.append(10.0, 109.0, 2)
+
+
+def test_latest_is_a_copy(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        ring.append(1.0, 10.0, 2)
+        latest = ring.latest()
+    assert latest['price'].tolist() == [10.0]
+
+
+def test_records_survive_reopening(plugin, ring_path):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        for n in range(6):
+            ring.append(float(n), 100.0 + n, 2)
+    with plugin.PriceRing(ring_path, 4) as ring:
+        assert ring.count == 6
+        assert prices(ring) == [102.0, 103.0, 104.0, 105.0]
+
+
+@pytest.mark.parametrize('appended, capacity, kept', [
+    (6, 8, [102.0, 103.0, 104.0, 105.0]), # grown after wrapping around
+    (3, 8, [100.0, 101.0, 102.0]), # grown before
+    (6, 2, [104.0, 105.0]), # shrunk after wrapping around
+    (3, 2, [101.0, 102.0]), # shrunk before
+])
+def test_capacity_change_keeps_the_latest(plugin, ring_path, appended, capacity, kept):
+    with plugin.PriceRing(ring_path, 4) as ring:
+        for n in range(appended):
+            ring.append(float(n), 100.0 + n, 2)
+    with plugin.PriceRing(ring_path, capacity) as ring:
+        assert ring.capacity == capacity
+        assert prices(ring) == kept
+        ring.append(99.0, 1.0, 2)
+        assert prices(ring) == (kept + [1.0])[-capacity:]
+
+
+def test_unreadable_file_starts_over(plugin, ring_path):
+    with open(ring_path, 'wb') as f:
+        f.write(b'not a price ring at all')
+    with plugin.PriceRing(ring_path, 4) as ring:
+        assert ring.count == 0
+        assert ring.append(1.0, 10.0, 2)
+
+
+def test_price_history(plugin, tmp_path):
+    history = plugin.PriceHistory(str(tmp_path / 'history'), 4)
+    fresh = SimpleNamespace(stale_since=None, current_price=10.0, session='REGULAR')
+    stale = SimpleNamespace(stale_since=1.0, current_price=20.0, session='REGULAR')
+    missing = SimpleNamespace(stale_since=None, current_price=math.nan, session='REGULAR')
+    assert history.record({'AAPL': fresh, 'MSFT': stale, 'BRK/B': fresh, 'TSLA': missing}, now=1.0) == 2
+    assert history.record({'AAPL': fresh}, now=2.0) == 0
+    assert history.version('AAPL') == 1
+    assert history.latest('AAPL')['price'].tolist() == [10.0]
+    assert history.latest('AAPL')['session'].tolist() == [plugin.SESSION_CODES['REGULAR']]
+    assert history.latest('BRK/B')['price'].tolist() == [10.0]
+    assert history.latest('MSFT') is None
+    assert history.version('MSFT') == 0
+    # another process's appends show up in a new PriceHistory's versions
+    assert plugin.PriceHistory(str(tmp_path / 'history'), 4).version('AAPL') == 1
@@ -0,0 +1,247 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+NEW_YORK = ZoneInfo('America/New_York')
+
+
+def ts(*args):
+    return datetime(*args, tzinfo=NEW_YORK).timestamp()
+
+
+# Quote cache ----------------------------------------------------------------------------------------------------------
+def make_quote(plugin, symbol, price, market_state='REGULAR', timezone=None):
+    info = {'symbol': symbol, 'marketState': market_state, 'regularMarketPreviousClose': 100.0}
+    if timezone:
+        info['exchangeTimezoneName'] = timezone
+    return plugin.Quote.from_info(symbol, info, price)
+
+
+@pytest.fixture
+def quote_cache(plugin, state_db):
+    return plugin.QuoteCache(state_db)
+
+
+def test_quote_cache_round_trip(plugin, quote_cache):
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 101.5)}, now=1000.0)
+    fresh = quote_cache.get_fresh(['AAPL', 'MSFT'], now=1030.0)
+    assert list(fresh) == ['AAPL']
+    assert fresh['AAPL'].to_dict() == make_quote(plugin, 'AAPL', 101.5).to_dict()
+
+
+@pytest.mark.parametrize('market_state, age, fresh', [
+    ('REGULAR', 59, True), ('REGULAR', 61, False),
+    ('PRE', 299, True), ('POST', 301, False),
+    ('CLOSED', 4 * 3600 - 1, True), ('CLOSED', 4 * 3600 + 1, False),
+])
+def test_quote_cache_ttl_follows_the_session(plugin, quote_cache, market_state, age, fresh):
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 101.5, market_state)}, now=1000.0)
+    assert bool(quote_cache.get_fresh(['AAPL'], now=1000.0 + age)) == fresh
+
+
+def test_quote_cache_max_age(plugin, quote_cache):
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 101.5)}, now=1000.0)
+    assert quote_cache.get_fresh(['AAPL'], now=1500.0, max_age=600)
+    assert not quote_cache.get_fresh(['AAPL'], now=1700.0, max_age=600)
+
+
+def test_quote_cache_uses_the_market_calendar(plugin, quote_cache, monkeypatch):
+    monkeypatch.setattr(plugin, 'OPTION_USE_MARKET_CALENDAR', True)
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 101.5, 'CLOSED', 'America/New_York'),
+                     'BTC-USD': make_quote(plugin, 'BTC-USD', 101.5, 'CLOSED')}, now=ts(2026, 10, 16, 20, 5))
+    # a US quote fetched after Friday's after hours lasts the weekend, one on its own clock its usual 4 hours
+    assert list(quote_cache.get_fresh(['AAPL', 'BTC-USD'], now=ts(2026, 10, 18, 12, 0))) == ['AAPL']
+    assert not quote_cache.get_fresh(['AAPL'], now=ts(2026, 10, 19, 4, 0, 1))
+
+
+def test_quote_cache_invalidate_and_get_last(plugin, quote_cache):
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 101.5)}, now=1000.0)
+    quote_cache.invalidate()
+    assert not quote_cache.get_fresh(['AAPL'], now=1001.0)
+    last = quote_cache.get_last(['AAPL', 'MSFT'])
+    assert list(last) == ['AAPL']
+    assert last['AAPL'].current_price == 101.5
+    assert last['AAPL'].stale_since == 1000.0
+    # the next put makes it fresh again
+    quote_cache.put({'AAPL': make_quote(plugin, 'AAPL', 102.0)}, now=1002.0)
+    assert quote_cache.get_fresh(['AAPL'], now=1003.0)['AAPL'].current_price == 102.0
+
+
+def test_quote_cache_skips_entries_of_older_versions(quote_cache, state_db):
+    state_db.execute("INSERT INTO quote_cache VALUES ('AAPL', 'REGULAR', 1000.0, '{\"symbol\": \"AAPL\"}')")
+    assert not quote_cache.get_fresh(['AAPL'], now=1001.0)
+    assert not quote_cache.get_last(['AAPL'])
+
+
+# Price limits ---------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def limits(plugin, state_db):
+    return plugin.PriceLimitStore(state_db)
+
+
+def test_price_limits_keep_their_order(limits):
+    limits.add('SELL', 'MSFT', '400', now=2)
+    limits.add('BUY', 'AAPL', '100', now=1)
+    limits.add('BUY', 'AAPL', '100', now=3) # already set
+    assert limits.entries() == [('BUY', 'AAPL', '100'), ('SELL', 'MSFT', '400')]
+
+
+def test_price_limit_state(limits):
+    limits.add('CROSS', 'AAPL', '150', now=1)
+    limits.add('TRAIL', 'AAPL', '10', now=2)
+    assert limits.rules() == [('CROSS', 'AAPL', '150', None, None), ('TRAIL', 'AAPL', '10', None, None)]
+    limits.save_state([('AAPL', 'CROSS', '150', -1, None), ('AAPL', 'TRAIL', '10', 0, 120.0)])
+    limits.save_state([('AAPL', 'CROSS', '150', 1, None)])
+    assert limits.rules() == [('CROSS', 'AAPL', '150', 1, None), ('TRAIL', 'AAPL', '10', 0, 120.0)]
+
+
+def test_price_limit_remove(limits):
+    limits.add('TRAIL', 'AAPL', '10')
+    limits.save_state([('AAPL', 'TRAIL', '10', 0, 120.0)])
+    assert limits.remove('TRAIL', 'AAPL', '10')
+    assert not limits.remove('TRAIL', 'AAPL', '10')
+    # setting it again starts without the old high-water mark
+    limits.add('TRAIL', 'AAPL', '10')
+    assert limits.rules() == [('TRAIL', 'AAPL', '10', None, None)]
+
+
+def test_price_limit_clear(limits):
+    limits.add('BUY', 'AAPL', '100')
+    limits.add('CROSS', 'MSFT', '400')
+    limits.save_state([('MSFT', 'CROSS', '400', 1, None)])
+    limits.clear()
+    assert limits.entries() == []
+    limits.add('CROSS', 'MSFT', '400')
+    assert limits.rules() == [('CROSS', 'MSFT', '400', None, None)]
+
+
+def test_price_limits_import_legacy_file(plugin, state_db, tmp_path):
+    data_file = tmp_path / 'stocks.db'
+    data_file.write_text('SELL MSFT 400\nnonsense\nBUY AAPL 100\nBUY AAPL abc\nBUY AAPL 100\n\nCROSS TSLA 250.5\n')
+    limits = plugin.open_price_limits(str(data_file), state_db)
+    assert limits.entries() == [('SELL', 'MSFT', '400'), ('BUY', 'AAPL', '100'), ('CROSS', 'TSLA', '250.5')]
+    assert not data_file.exists()
+    assert (tmp_path / 'stocks.db.migrated').exists()
+    # only once
+    plugin.open_price_limits(str(data_file), state_db)
+    assert len(limits.entries()) == 3
+
+
+# Alert queue ----------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def alerts(plugin, state_db):
+    return plugin.AlertQueue(state_db)
+
+
+def test_alert_queue_is_first_in_first_out(alerts):
+    assert alerts.claim() is None
+    assert alerts.put('AAPL', 'Price Alarm', 'BUY Limit: 100.0', 'AAPL at 99', now=1000.0)
+    assert alerts.put('MSFT', 'Price Alarm', 'SELL Limit: 400.0', 'MSFT at 401', now=1001.0)
+    assert alerts.pending() == 2
+    assert alerts.claim(now=1002.0)['subtitle'] == 'BUY Limit: 100.0'
+    assert alerts.claim(now=1003.0)['subtitle'] == 'SELL Limit: 400.0'
+    assert alerts.claim(now=1004.0) is None
+    assert alerts.pending() == 0
+
+
+def test_alert_queue_merges_waiting_alerts(alerts):
+    alerts.put('AAPL', 'Price Alarm', 'BUY Limit: 100.0', 'AAPL at 99', now=1000.0)
+    alerts.put('AAPL', 'Price Alarm', 'CROSS Limit: 99.5 (down)', 'AAPL at 98', now=1001.0)
+    alerts.put('AAPL', 'Price Alarm', 'BUY Limit: 100.0', 'AAPL at 97', now=1002.0)
+    assert alerts.pending() == 1
+    assert alerts.claim(now=1003.0) == {'title': 'Price Alarm', 'subtitle': 'BUY Limit: 100.0, CROSS Limit: 99.5 (down)',
+                                        'text': 'AAPL at 97'}
+
+
+def test_alert_queue_drops_recent_duplicates(plugin, alerts):
+    alerts.put('AAPL', 'Price Alarm', 'CROSS Limit: 150.0 (up)', 'AAPL at 151', now=1000.0)
+    alerts.claim(now=1001.0)
+    assert not alerts.put('AAPL', 'Price Alarm', 'CROSS Limit: 150.0 (up)', 'AAPL at 152', now=1100.0)
+    assert alerts.put('AAPL', 'Price Alarm', 'CROSS Limit: 150.0 (down)', 'AAPL at 148', now=1100.0)
+    assert alerts.claim(now=1101.0)['subtitle'] == 'CROSS Limit: 150.0 (down)'
+    assert alerts.put('AAPL', 'Price Alarm', 'CROSS Limit: 150.0 (up)', 'AAPL at 152',
+                      now=1001.0 + plugin.ALERT_DEDUP_SECONDS + 1)
+
+
+def test_alert_queue_prune(alerts, state_db):
+    alerts.put('AAPL', 'Price Alarm', 'BUY Limit: 100.0', 'AAPL at 99', now=1000.0)
+    alerts.claim(now=1001.0)
+    alerts.put('MSFT', 'Price Alarm', 'SELL Limit: 400.0', 'MSFT at 401', now=1002.0)
+    alerts.prune(2000.0)
+    assert state_db.execute('SELECT symbol FROM alert_queue').fetchall() == [('MSFT',)]
+    assert alerts.pending() == 1
+
+
+# Intraday bars --------------------------------------------------------------------------------------------------------
+# A yf.download() style frame of 1-minute bars for several tickers; bars maps symbol -> [(New York time tuple, close)]
+def intraday_frame(bars):
+    import pandas as pd
+    index = sorted({datetime(*when, tzinfo=NEW_YORK) for symbol_bars in bars.values() for when, _ in symbol_bars})
+    index = pd.DatetimeIndex(index).tz_convert('UTC')
+    columns = {}
+    for symbol, symbol_bars in bars.items():
+        closes = pd.Series({pd.Timestamp(datetime(*when, tzinfo=NEW_YORK)): close for when, close in symbol_bars})
+        closes.index = closes.index.tz_convert('UTC')
+        columns[(symbol, 'Close')] = closes.reindex(index)
+        columns[(symbol, 'Volume')] = closes.reindex(index) * 0 + 1000
+    return pd.DataFrame(columns, index=index)
+
+
+@pytest.fixture
+def bars(plugin, state_db):
+    return plugin.IntradayBarStore(state_db)
+
+
+SESSIONS = {'AAPL': ('America/New_York', 570, 960), 'MSFT': ('America/New_York', 570, 960)}
+
+
+def test_intraday_bars_store(bars):
+    bars.store(intraday_frame({'AAPL': [((2026, 10, 16, 9, 30), 100.0), ((2026, 10, 16, 9, 31), 101.0)],
+                               'MSFT': [((2026, 10, 16, 9, 30), 400.0)]}), ['AAPL', 'MSFT', 'TSLA'])
+    assert bars.last_timestamps(['AAPL', 'MSFT', 'TSLA']) == {'AAPL': ts(2026, 10, 16, 9, 31), 'MSFT': ts(2026, 10, 16, 9, 30)}
+    frame = bars.close_frame(['AAPL', 'MSFT'])
+    assert frame['AAPL'].tolist() == [100.0, 101.0]
+    assert frame['MSFT'].iloc[0] == 400.0
+    # a bar downloaded again replaces the unfinished one
+    bars.store(intraday_frame({'AAPL': [((2026, 10, 16, 9, 31), 101.5)]}), ['AAPL'])
+    assert bars.close_frame(['AAPL'])['AAPL'].tolist() == [100.0, 101.5]
+
+
+def test_intraday_bars_store_single_ticker(bars):
+    import pandas as pd
+    index = pd.DatetimeIndex([datetime(2026, 10, 16, 9, 30, tzinfo=NEW_YORK)]).tz_convert('UTC')
+    bars.store(pd.DataFrame({'Close': [100.0], 'Volume': [1000.0]}, index=index), ['AAPL'])
+    assert bars.last_timestamps(['AAPL']) == {'AAPL': ts(2026, 10, 16, 9, 30)}
+
+
+def test_regular_session_closes(plugin):
+    import pandas as pd
+    frame = intraday_frame({
+        'AAPL': [((2026, 10, 15, 15, 59), 99.0), ((2026, 10, 15, 16, 0), 100.0), ((2026, 10, 15, 16, 5), 100.5),
+                 ((2026, 10, 16, 9, 29), 101.0), ((2026, 10, 16, 9, 30), 102.0), ((2026, 10, 16, 10, 0), 103.0)],
+        'MSFT': [((2026, 10, 15, 16, 0), 400.0), ((2026, 10, 16, 8, 0), 401.0)],
+    })
+    closes = frame.xs('Close', axis=1, level=1)
+    day = (datetime(2026, 10, 16).date() - datetime(1970, 1, 1).date()).days
+    # MSFT's last day has only pre-market bars
+    assert plugin.regular_session_closes(closes, SESSIONS) == {'AAPL': (103.0, day), 'MSFT': (None, day)}
+    assert plugin.regular_session_closes(closes, SESSIONS, {'AAPL': day, 'MSFT': day}) == {
+        'AAPL': (100.0, day - 1), 'MSFT': (400.0, day - 1)}
+    assert plugin.regular_session_closes(pd.DataFrame(), SESSIONS) == {}
+
+
+def test_intraday_bars_finalize_older_sessions(bars, state_db):
+    bars.store(intraday_frame({
+        'AAPL': [((2026, 10, 14, 16, 0), 98.0),
+                 ((2026, 10, 15, 15, 59), 99.0), ((2026, 10, 15, 16, 0), 100.0), ((2026, 10, 15, 16, 5), 100.5),
+                 ((2026, 10, 16, 9, 30), 102.0), ((2026, 10, 16, 10, 0), 103.0)],
+        'MSFT': [((2026, 10, 15, 16, 0), 400.0), ((2026, 10, 16, 8, 0), 401.0)],
+    }), ['AAPL', 'MSFT'])
+    # MSFT has no regular-session bar today, so it falls back to the last recorded session close
+    assert bars.regular_session_closes(['AAPL', 'MSFT', 'TSLA'], SESSIONS) == {'AAPL': 103.0, 'MSFT': 400.0, 'TSLA': None}
+    assert state_db.execute('SELECT symbol, session_date, close FROM session_closes ORDER BY symbol, session_date').fetchall() == [
+        ('AAPL', '2026-10-14', 98.0), ('AAPL', '2026-10-15', 100.0), ('MSFT', '2026-10-15', 400.0)]
+    # bars over a day older than the symbol's newest are pruned once summarized
+    assert min(bars.close_frame(['AAPL']).index) == datetime(2026, 10, 15, 15, 59, tzinfo=NEW_YORK)
+    assert bars.last_session_close('AAPL') == 100.0
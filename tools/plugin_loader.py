@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+#
+# Imports stocks-advanced.py as a module, for the tools in this folder and the benchmarks. The plugin's file name has a
+# dash in it and its hidden state files live next to it, so it's imported from a temporary copy in a directory of the
+# caller's choosing and its state never touches your real price limits, caches or daemon.
+
+import importlib.util
+import os
+import shutil
+
+
+def default_plugin_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'stocks-advanced.py')
+
+
+# Import the plugin as a module. A temporary copy is used so its hidden state files land in the temporary directory.
+def load_plugin(path, workdir):
+    plugin = os.path.join(workdir, 'stocks_advanced.py')
+    shutil.copy(path, plugin)
+    os.environ['STOCKS_HEADLESS'] = '1'
+    spec = importlib.util.spec_from_file_location('stocks_advanced', plugin)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
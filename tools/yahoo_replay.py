@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+#
+# Offline stand-ins for Yahoo Finance, so stocks-advanced.py can be run, tested and benchmarked without the network.
+#
+# Every Yahoo call the plugin makes goes through its YAHOO_CLIENT (quote endpoint JSON, yf.Ticker, yf.download), so a
+# stand-in only has to replace that one object. Three are provided:
+#
+#   record:DIR   the real client, with every response it returns (bulk quotes, fast_info, .info, 1-minute and daily bars)
+#                also saved as JSON fixtures in DIR. Re-recording a symbol merges new bars into its fixture.
+#   replay:DIR   serves the fixtures in DIR. Symbols without a fixture are missing from quote responses and raise on
+#                .fast_info, like symbols Yahoo doesn't know.
+#   synthetic    makes up deterministic quotes and two days of 1-minute bars for any symbol, for watchlists of any size.
+#
+# replay and synthetic can add latency to every request (--latency 0.2, or a range 0.1:0.4) and fail a fraction of them
+# (--error-rate 0.1) to exercise the retry, circuit breaker and stale quote paths.
+#
+# Usage: python3 tools/yahoo_replay.py record DIR [--symbols AAPL,MSFT] [--info] [--plugin path/to/stocks-advanced.py]
+#        python3 tools/yahoo_replay.py menu --backend replay:DIR [--symbols ...] [--latency 0.2] [--error-rate 0.1]
+#
+# record runs one full refresh of the plugin's watch_symbols (or --symbols) with the cache off; --info turns on the
+# debug submenu so full .info payloads are recorded too. menu prints the menu rendered against a backend. Both use a
+# temporary copy of the plugin, so your price limits and caches are untouched. Benchmarks use install() directly.
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import quote as url_quote
+
+from plugin_loader import default_plugin_path, load_plugin
+
+BAR_COLUMNS = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')
+FIXTURE_KINDS = ('quote', 'fast_info', 'info', 'bars', 'daily')
+
+
+class InjectedError(ConnectionError):
+    pass
+
+
+# Bar frames <-> JSON -------------------------------------------------------------------------------------------------
+# Bars are stored as epoch seconds plus one row per bar, with the exchange timezone kept so replayed frames have the same tz-aware index yfinance returns.
+def frame_to_bars(frame):
+    frame = frame.dropna(subset=['Close'])
+    columns = [column for column in BAR_COLUMNS if column in frame.columns]
+    return {
+        'timezone': str(frame.index.tz) if frame.index.tz is not None else 'UTC',
+        'columns': columns,
+        'index': [int(ts.timestamp()) for ts in frame.index],
+        'data': frame[columns].astype(float).values.tolist(),
+    }
+
+
+def bars_to_frame(bars):
+    import pandas as pd
+    index = pd.to_datetime(bars['index'], unit='s', utc=True).tz_convert(bars['timezone'])
+    return pd.DataFrame(bars['data'], index=index, columns=bars['columns']).rename_axis('Datetime')
+
+
+# New bars win over stored ones with the same timestamp
+def merge_bars(old, new):
+    if not old or old.get('columns') != new['columns']:
+        return new
+    rows = dict(zip(old['index'], old['data']))
+    rows.update(zip(new['index'], new['data']))
+    index = sorted(rows)
+    return dict(new, index=index, data=[rows[ts] for ts in index])
+
+
+# period= as yfinance takes it ('1d', '2d', '5d', ...): the bars of the last N trading days present
+def slice_bars(frame, period=None, start=None, **_):
+    import pandas as pd
+    if start is not None:
+        start = pd.Timestamp(start, unit='s', tz='UTC') if isinstance(start, (int, float)) else pd.Timestamp(start)
+        if start.tzinfo is None:
+            start = start.tz_localize(frame.index.tz)
+        return frame[frame.index >= start]
+    if period and period.endswith('d') and not frame.empty:
+        days = sorted(set(frame.index.date))[-int(period[:-1]):]
+        return frame[[d in days for d in frame.index.date]]
+    return frame
+
+
+def daily_bars(frame):
+    if frame.empty:
+        return frame
+    grouped = frame.groupby(frame.index.normalize())
+    return grouped.agg({'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Adj Close': 'last',
+                        'Volume': 'sum'}).rename_axis('Date')
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Fixture stores --------------------------------------------------------------------------------------------------------
+# One JSON file per symbol and kind: DIR/<kind>/<symbol>.json. Symbols are percent-encoded in file names (^GSPC, EURUSD=X).
+class FixtureStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def path(self, kind, symbol):
+        return os.path.join(self.directory, kind, url_quote(symbol, safe='') + '.json')
+
+    def read(self, kind, symbol):
+        try:
+            with open(self.path(kind, symbol)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write(self, kind, symbol, payload):
+        path = self.path(kind, symbol)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            if kind in ('bars', 'daily'):
+                payload = merge_bars(self.read(kind, symbol), payload)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(payload, f, indent=1, sort_keys=True)
+            os.replace(path + '.tmp', path)
+
+    def symbols(self):
+        try:
+            return sorted(name[:-5] for name in os.listdir(os.path.join(self.directory, 'quote')) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+
+# Made-up data for any symbol, seeded by the symbol so every run (and every process) sees the same prices
+class SyntheticStore:
+    def __init__(self, timezone='America/New_York', now=None):
+        self.timezone = timezone
+        self.now = now
+        self.lock = threading.Lock()
+        self.generated = {}
+
+    def generate(self, symbol):
+        import numpy as np
+        import pandas as pd
+        with self.lock:
+            if symbol in self.generated:
+                return self.generated[symbol]
+        seed = zlib.crc32(symbol.encode())
+        rng = np.random.default_rng(seed)
+        now = pd.Timestamp(self.now, unit='s', tz='UTC') if self.now else pd.Timestamp.now(tz='UTC')
+        now = now.tz_convert(self.timezone).floor('min')
+        days = pd.bdate_range(end=now.normalize().tz_localize(None), periods=2)
+        index = pd.DatetimeIndex([]).tz_localize(self.timezone)
+        for day in days:
+            minutes = pd.date_range(day + pd.Timedelta(hours=4), day + pd.Timedelta(hours=19, minutes=59), freq='1min',
+                                    tz=self.timezone)
+            index = index.append(minutes[minutes <= now])
+        base = 1 + seed % 50000 / 100
+        close = base * np.exp(np.cumsum(rng.normal(0, 0.0008, len(index))))
+        frame = pd.DataFrame({'Open': close, 'High': close * 1.0005, 'Low': close * 0.9995, 'Close': close,
+                              'Adj Close': close, 'Volume': rng.integers(100, 10000, len(index)).astype(float)},
+                             index=index).rename_axis('Datetime')
+        minutes = index.hour * 60 + index.minute
+        regular = frame[(minutes >= 570) & (minutes < 960)]
+        last_day = regular[regular.index.date == regular.index.date[-1]] if not regular.empty else frame
+        previous = regular[regular.index.date < last_day.index.date[0]]
+        price = float(last_day['Close'].iloc[-1])
+        previous_close = float(previous['Close'].iloc[-1]) if not previous.empty else base
+        quote = {
+            'symbol': symbol, 'shortName': symbol + ' Inc', 'longName': symbol + ' Incorporated', 'currency': 'USD',
+            'exchange': 'NMS', 'exchangeTimezoneName': self.timezone, 'marketState': self.market_state(now),
+            'regularMarketPrice': price, 'regularMarketTime': int(last_day.index[-1].timestamp()),
+            'regularMarketPreviousClose': previous_close, 'regularMarketOpen': float(last_day['Open'].iloc[0]),
+            'regularMarketDayHigh': float(last_day['High'].max()), 'regularMarketDayLow': float(last_day['Low'].min()),
+            'fiftyTwoWeekHigh': price * 1.4, 'fiftyTwoWeekLow': price * 0.6, 'bid': price - 0.01, 'ask': price + 0.01,
+            'regularMarketChangePercent': (price / previous_close - 1) * 100,
+            'preMarketPrice': float(frame['Close'].iloc[-1]), 'postMarketPrice': float(frame['Close'].iloc[-1]),
+        }
+        with self.lock:
+            self.generated[symbol] = (quote, frame)
+        return quote, frame
+
+    @staticmethod
+    def market_state(now):
+        minutes = now.hour * 60 + now.minute
+        if now.weekday() >= 5 or minutes < 240 or minutes >= 1200:
+            return 'CLOSED'
+        return 'PRE' if minutes < 570 else 'REGULAR' if minutes < 960 else 'POST'
+
+    def read(self, kind, symbol):
+        quote, frame = self.generate(symbol)
+        if kind == 'quote':
+            return quote
+        if kind == 'info':
+            return dict(quote, dayHigh=quote['regularMarketDayHigh'], dayLow=quote['regularMarketDayLow'],
+                        previousClose=quote['regularMarketPreviousClose'], quoteType='EQUITY')
+        if kind == 'fast_info':
+            return {'lastPrice': quote['regularMarketPrice'], 'previousClose': quote['regularMarketPreviousClose'],
+                    'regularMarketPreviousClose': quote['regularMarketPreviousClose'], 'open': quote['regularMarketOpen'],
+                    'dayHigh': quote['regularMarketDayHigh'], 'dayLow': quote['regularMarketDayLow'],
+                    'yearHigh': quote['fiftyTwoWeekHigh'], 'yearLow': quote['fiftyTwoWeekLow'],
+                    'currency': quote['currency'], 'timezone': self.timezone, 'exchange': quote['exchange']}
+        if kind == 'bars':
+            return frame
+        if kind == 'daily':
+            return daily_bars(frame)
+        return None
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+# Stand-in clients -------------------------------------------------------------------------------------------------------
+# Same surface as the plugin's YahooClient: get_json, ticker, download and the request counters the debug menu shows.
+class StandInClient:
+    COUNTERS = ('requests', 'handshakes', 'crumb_fetches', 'new_connections', 'bytes')
+
+    def __init__(self, store, latency=(0.0, 0.0), error_rate=0.0, seed=0):
+        self.store = store
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.session = None
+        self.totals = dict.fromkeys(self.COUNTERS, 0)
+        self.run = dict.fromkeys(self.COUNTERS, 0)
+        self.calls = {}
+
+    # Every request: count it, wait out the injected latency and maybe fail
+    def request(self, kind):
+        with self.lock:
+            for counters in (self.totals, self.run):
+                counters['requests'] += 1
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            delay = self.rng.uniform(*self.latency)
+            fail = self.rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise InjectedError('injected failure ({})'.format(kind))
+
+    # Approximate response size: JSON size of payloads, 8 bytes per value of bar frames
+    def received(self, payload):
+        size = payload.size * 8 if hasattr(payload, 'size') else len(json.dumps(payload, default=str))
+        with self.lock:
+            for counters in (self.totals, self.run):
+                counters['bytes'] += size
+        return payload
+
+    def reset_run(self):
+        with self.lock:
+            self.run = dict.fromkeys(self.COUNTERS, 0)
+
+    def reuse_ratio(self, counters):
+        return None
+
+    def read(self, kind, symbol):
+        payload = self.store.read(kind, symbol)
+        if kind in ('bars', 'daily') and isinstance(payload, dict):
+            return bars_to_frame(payload)
+        return payload
+
+    def get_json(self, url, params=None):
+        self.request('quote')
+        quotes = (self.read('quote', symbol) for symbol in (params or {}).get('symbols', '').split(','))
+        return self.received({'quoteResponse': {'result': [quote for quote in quotes if quote], 'error': None}})
+
+    def ticker(self, symbol):
+        return StandInTicker(self, symbol)
+
+    def download(self, symbols, **kwargs):
+        import pandas as pd
+        self.request('download')
+        symbols = symbols.split() if isinstance(symbols, str) else list(symbols)
+        frames = {}
+        for symbol in symbols:
+            frame = self.read('bars', symbol)
+            if frame is not None:
+                frames[symbol] = slice_bars(frame, **kwargs)
+        if not frames:
+            return pd.DataFrame()
+        return self.received(pd.concat(frames, axis=1, names=['Ticker', 'Price']))
+
+
+class StandInTicker:
+    def __init__(self, client, symbol):
+        self.client = client
+        self.ticker = symbol
+
+    def fetch(self, kind):
+        self.client.request(kind)
+        payload = self.client.read(kind, self.ticker)
+        if payload is None:
+            raise KeyError('{}: no {} fixture, symbol may be delisted'.format(self.ticker, kind))
+        return self.client.received(payload)
+
+    @property
+    def fast_info(self):
+        return self.fetch('fast_info')
+
+    @property
+    def info(self):
+        return self.fetch('info')
+
+    def history(self, interval='1d', **kwargs):
+        import pandas as pd
+        try:
+            frame = self.fetch('daily' if interval == '1d' else 'bars')
+        except KeyError:
+            return pd.DataFrame()
+        return slice_bars(frame, **kwargs)
+
+
+# The real client with every response also written to the fixture store. Counters and the session are the real ones.
+class RecordingClient:
+    def __init__(self, live, store):
+        self.live = live
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.live, name)
+
+    def get_json(self, url, params=None):
+        response = self.live.get_json(url, params=params)
+        for quote in (response or {}).get('quoteResponse', {}).get('result') or []:
+            if 'symbol' in quote:
+                self.store.write('quote', quote['symbol'], quote)
+        return response
+
+    def ticker(self, symbol):
+        return RecordingTicker(self.live.ticker(symbol), self.store)
+
+    def download(self, symbols, **kwargs):
+        frame = self.live.download(symbols, **kwargs)
+        if frame is not None and not frame.empty:
+            if hasattr(frame.columns, 'levels'):
+                for symbol in frame.columns.get_level_values(0).unique():
+                    self.store.write('bars', symbol, frame_to_bars(frame[symbol]))
+            else:
+                self.store.write('bars', symbols[0] if not isinstance(symbols, str) else symbols, frame_to_bars(frame))
+        return frame
+
+
+class RecordingTicker:
+    def __init__(self, ticker, store):
+        self.live = ticker
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.live, name)
+
+    @property
+    def fast_info(self):
+        fast_info = self.live.fast_info
+        recorded = {}
+        for key in ('lastPrice', 'previousClose', 'regularMarketPreviousClose', 'open', 'dayHigh', 'dayLow', 'yearHigh',
+                    'yearLow', 'currency', 'timezone', 'exchange'):
+            try:
+                recorded[key] = fast_info[key]
+            except Exception:
+                pass
+        self.store.write('fast_info', self.live.ticker, recorded)
+        return fast_info
+
+    @property
+    def info(self):
+        info = self.live.info
+        self.store.write('info', self.live.ticker, info)
+        return info
+
+    def history(self, interval='1d', **kwargs):
+        frame = self.live.history(interval=interval, **kwargs)
+        if frame is not None and not frame.empty:
+            self.store.write('daily' if interval == '1d' else 'bars', self.live.ticker, frame_to_bars(frame))
+        return frame
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+def parse_latency(text):
+    low, _, high = str(text).partition(':')
+    return float(low), float(high or low)
+
+
+# Swap the loaded plugin's YAHOO_CLIENT for the backend named by spec ('live', 'record:DIR', 'replay:DIR', 'synthetic') and return it
+def install(plugin, spec, latency=(0.0, 0.0), error_rate=0.0, seed=0):
+    kind, _, directory = spec.partition(':')
+    if kind == 'live':
+        client = plugin.YahooClient()
+    elif kind == 'record':
+        client = RecordingClient(plugin.YahooClient(), FixtureStore(directory))
+    elif kind == 'replay':
+        if not os.path.isdir(directory):
+            raise SystemExit('no fixtures in {!r}; record some with: yahoo_replay.py record {}'.format(directory, directory))
+        client = StandInClient(FixtureStore(directory), latency, error_rate, seed)
+    elif kind == 'synthetic':
+        client = StandInClient(SyntheticStore(), latency, error_rate, seed)
+    else:
+        raise SystemExit('unknown backend {!r}: use live, record:DIR, replay:DIR or synthetic'.format(spec))
+    plugin.YAHOO_CLIENT = client
+    return client
+
+
+def render_once(plugin, workdir, symbols=None, use_cache=False):
+    if symbols:
+        plugin.watch_symbols = {'Watchlist': dict.fromkeys(symbols, '')}
+    plugin.OPTION_USE_QUOTE_CACHE = use_cache
+    return plugin.render_menu_text(os.path.join(workdir, '.stocks_advanced.db'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record, replay or synthesize Yahoo responses for stocks-advanced.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='refresh once against Yahoo and save every response as fixtures')
+    record.add_argument('directory')
+    record.add_argument('--info', action='store_true', help='also record full .info (turns on the debug submenu)')
+    menu = commands.add_parser('menu', help='print the menu rendered against a backend')
+    menu.add_argument('--backend', default='synthetic', help='replay:DIR, synthetic, live or record:DIR')
+    menu.add_argument('--latency', type=parse_latency, default=(0.0, 0.0), help='seconds per request, or a range LOW:HIGH')
+    menu.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    menu.add_argument('--seed', type=int, default=0)
+    for command in (record, menu):
+        command.add_argument('--symbols', help='comma separated symbols instead of the plugin\'s watch_symbols')
+        command.add_argument('--plugin', default=default_plugin_path())
+    args = parser.parse_args()
+
+    symbols = args.symbols.split(',') if args.symbols else None
+    with tempfile.TemporaryDirectory() as workdir:
+        plugin = load_plugin(args.plugin, workdir)
+        if args.command == 'record':
+            plugin.OPTION_SHOW_DEBUG_SUBMENU = args.info
+            client = install(plugin, 'record:' + args.directory)
+            render_once(plugin, workdir, symbols)
+            print('recorded {} symbols in {} ({} requests)'.format(len(client.store.symbols()), args.directory,
+                                                                  client.totals['requests']))
+        else:
+            client = install(plugin, args.backend, args.latency, args.error_rate, args.seed)
+            sys.stdout.write(render_once(plugin, workdir, symbols))
+            if isinstance(client, StandInClient):
+                sys.stderr.write('requests: {}\n'.format(', '.join('{} {}'.format(kind, n)
+                                                                   for kind, n in sorted(client.calls.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# Local stand-in for Yahoo's streaming price feed, to run and test the daemon's OPTION_USE_STREAMING backend offline.
+#
+# The feed is a websocket: the client sends {"subscribe": [symbols]} (and again every 15 seconds to keep it), the server
+# sends {"type": "pricing", "message": <base64 protobuf PricingData>} frames. This tool can
+#
+#   record FILE         subscribe to the real feed for a while and save every frame it sends to FILE, as JSON lines with
+#                       their arrival time
+#   serve FILE          replay FILE's frames from a local websocket server at their recorded pace (--speed 10 for ten
+#                       times faster), over and over, sending each client only the symbols it subscribed to
+#   serve --synthetic   serve made-up frames instead: a random walk for every subscribed symbol each --interval seconds
+#
+# --drop-after closes every connection after that many seconds, to exercise reconnecting and the polling fallback.
+#
+# Usage: python3 tools/yahoo_stream.py record FILE [--symbols AAPL,MSFT] [--seconds 60] [--plugin path/to/stocks-advanced.py]
+#        python3 tools/yahoo_stream.py serve (FILE | --synthetic) [--port 8765] [--speed 1] [--interval 1]
+#                                            [--session REGULAR] [--drop-after SECONDS]
+#
+# Run the daemon with STOCKS_STREAM_URL=ws://127.0.0.1:8765 (and OPTION_USE_STREAMING on) to have it use the stand-in.
+
+import argparse
+import base64
+import json
+import math
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import yahoo_replay
+from plugin_loader import default_plugin_path, load_plugin
+
+YAHOO_STREAM_URL = 'wss://streamer.finance.yahoo.com/?version=2'
+RESUBSCRIBE_SECONDS = 15
+MARKET_HOURS = {'PRE': 0, 'REGULAR': 1, 'POST': 2, 'CLOSED': 3}
+
+
+def encode_frame(**fields):
+    from yfinance.pricing_pb2 import PricingData
+    message = PricingData(**fields).SerializeToString()
+    return json.dumps({'type': 'pricing', 'message': base64.b64encode(message).decode('ascii')})
+
+
+def frame_symbol(frame):
+    from yfinance.pricing_pb2 import PricingData
+    message = PricingData()
+    message.ParseFromString(base64.b64decode(json.loads(frame)['message']))
+    return message.id
+
+
+def plugin_symbols(path):
+    with tempfile.TemporaryDirectory() as workdir:
+        plugin = load_plugin(path, workdir)
+        return plugin.SymbolRegistry(plugin.watch_symbols).symbols + list(plugin.INDICES_DICT)
+
+
+# Recorded frames ------------------------------------------------------------------------------------------------------
+def record(path, symbols, seconds, url=YAHOO_STREAM_URL):
+    from websockets.sync.client import connect
+    count = 0
+    start = subscribed = time.time()
+    with connect(url) as websocket, open(path, 'w') as out:
+        websocket.send(json.dumps({'subscribe': symbols}))
+        while time.time() - start < seconds:
+            if time.time() - subscribed >= RESUBSCRIBE_SECONDS:
+                websocket.send(json.dumps({'subscribe': symbols}))
+                subscribed = time.time()
+            try:
+                frame = websocket.recv(timeout=1)
+            except TimeoutError:
+                continue
+            out.write(json.dumps({'t': round(time.time() - start, 3), 'frame': frame}) + '\n')
+            count += 1
+    return count
+
+
+def load_frames(path):
+    with open(path) as f:
+        frames = [json.loads(line) for line in f if line.strip()]
+    return [(frame['t'], frame_symbol(frame['frame']), frame['frame']) for frame in frames]
+
+
+# The symbols one client subscribed to. Its reader thread changes them while the sender iterates, so every access holds the lock.
+class Subscriptions:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.symbols = set()
+
+    def update(self, request):
+        with self.lock:
+            self.symbols.update(request.get('subscribe', []))
+            self.symbols.difference_update(request.get('unsubscribe', []))
+
+    def __contains__(self, symbol):
+        with self.lock:
+            return symbol in self.symbols
+
+    def snapshot(self):
+        with self.lock:
+            return sorted(self.symbols)
+
+
+# The recorded frames of subscribed symbols at their recorded pace, looping
+def replayed_frames(frames, subscribed, speed=1.0):
+    while True:
+        start = time.time()
+        for t, symbol, frame in frames:
+            time.sleep(max(0, start + t / speed - time.time()))
+            if symbol in subscribed:
+                yield frame
+        time.sleep(1 / speed)
+
+
+# Made-up frames ---------------------------------------------------------------------------------------------------------
+# Every subscribed symbol moves a little each interval, starting from the same price the synthetic quote backend in
+# yahoo_replay.py gives it
+def synthetic_frames(subscribed, interval=1.0, session='REGULAR', seed=0):
+    rng = random.Random(seed)
+    prices = {}
+    while True:
+        for symbol in subscribed.snapshot():
+            base = 1 + zlib.crc32(symbol.encode()) % 50000 / 100
+            price = prices[symbol] = prices.get(symbol, base) * math.exp(rng.gauss(0, 0.001))
+            yield encode_frame(id=symbol, price=price, time=int(time.time() * 1000), market_hours=MARKET_HOURS[session],
+                               previous_close=base, change_percent=(price / base - 1) * 100,
+                               day_high=max(price, base), day_low=min(price, base), bid=price - 0.01, ask=price + 0.01)
+        time.sleep(interval)
+
+
+# Serve frames(subscribed) to every client, subscribed being the live Subscriptions of that client
+def serve(frames, host='127.0.0.1', port=8765, drop_after=None):
+    from websockets.exceptions import ConnectionClosed
+    from websockets.sync.server import serve as websocket_server
+
+    def handler(websocket):
+        subscribed = Subscriptions()
+
+        def read_subscriptions():
+            try:
+                for message in websocket:
+                    subscribed.update(json.loads(message))
+            except (ConnectionClosed, ValueError):
+                pass
+
+        threading.Thread(target=read_subscriptions, daemon=True).start()
+        connected = time.time()
+        try:
+            for frame in frames(subscribed):
+                if drop_after is not None and time.time() - connected > drop_after:
+                    break
+                websocket.send(frame)
+        except ConnectionClosed:
+            pass
+
+    with websocket_server(handler, host, port) as server:
+        print('serving on ws://{}:{}'.format(host, port), flush=True)
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Yahoo's streaming price feed, or serve recorded or made-up frames")
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_command = commands.add_parser('record', help='save the real feed to a file')
+    record_command.add_argument('file')
+    record_command.add_argument('--symbols', help="comma separated symbols instead of the plugin's watch_symbols")
+    record_command.add_argument('--seconds', type=float, default=60)
+    record_command.add_argument('--plugin', default=default_plugin_path())
+    serve_command = commands.add_parser('serve', help='serve frames from a local websocket server')
+    serve_command.add_argument('file', nargs='?')
+    serve_command.add_argument('--synthetic', action='store_true', help='serve made-up frames instead of a recording')
+    serve_command.add_argument('--host', default='127.0.0.1')
+    serve_command.add_argument('--port', type=int, default=8765)
+    serve_command.add_argument('--speed', type=float, default=1.0, help='replay this many times faster than recorded')
+    serve_command.add_argument('--interval', type=float, default=1.0, help='seconds between synthetic updates')
+    serve_command.add_argument('--session', choices=sorted(MARKET_HOURS), default='REGULAR', help='session of synthetic updates')
+    serve_command.add_argument('--drop-after', type=float, help='close every connection after this many seconds')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        symbols = args.symbols.split(',') if args.symbols else plugin_symbols(args.plugin)
+        count = record(args.file, symbols, args.seconds)
+        print('recorded {} frames for {} symbols in {}'.format(count, len(symbols), args.file))
+    elif args.synthetic:
+        serve(lambda subscribed: synthetic_frames(subscribed, args.interval, args.session), args.host, args.port, args.drop_after)
+    elif args.file:
+        frames = load_frames(args.file)
+        serve(lambda subscribed: replayed_frames(frames, subscribed, args.speed), args.host, args.port, args.drop_after)
+    else:
+        sys.exit('serve needs a recorded FILE or --synthetic')
+
+
+if __name__ == '__main__':
+    main()